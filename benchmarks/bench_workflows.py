@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Throughput of the main WebAPI workflows against the mock HPC Web Service API (vecnet.winhpc.mockserver)
+Mock server runs in a separate process, so client CPU time and memory are measured without it.
+Run from the top-level directory of the package (or install the package first):
+    PYTHONPATH=. python benchmarks/bench_workflows.py [--jobs 200] [--tasks 5000] [--latency 0.005]
+                                                      [--processes 4] [--json]
+
+Reported for every workflow: operations per second, p50/p99 latency of its main request, client CPU time
+and peak resident memory of the benchmark process.
+"""
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+from vecnet.winhpc import submit
+from vecnet.winhpc.metrics import MetricsCollector
+from vecnet.winhpc.parallel import ProcessPoolWebAPI
+from vecnet.winhpc.webapi import WebAPI
+from vecnet.winhpc.workers import bounded_imap
+from vecnet.winhpc.xmlutils import JobXml
+
+
+def start_mock_server(args):
+    command = [sys.executable, "-m", "vecnet.winhpc.mockserver", "--port", "0",
+               "--latency", "%s" % args.latency, "--latency-jitter", "%s" % args.latency_jitter,
+               "--error-rate", "%s" % args.error_rate, "--run-time", "%s" % args.run_time]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    url = process.stdout.readline().decode("ascii").strip()
+    if not url:
+        process.kill()
+        raise RuntimeError("Mock server failed to start")
+    port = int(url.split(":")[2].split("/")[0])
+    return process, port
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return maxrss / (1024.0 * 1024.0) if sys.platform == "darwin" else maxrss / 1024.0
+
+
+class Workflow(object):
+    """ Measures a single workflow: wall time, CPU time and request latency (via WebAPI hooks) """
+    def __init__(self, name, server, endpoint):
+        self.name = name
+        self.server = server
+        self.endpoint = endpoint
+        self.collector = MetricsCollector()
+
+    def __enter__(self):
+        self.server.hooks.append(self.collector)
+        self.cpu = sum(os.times()[:2])
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.time() - self.start
+        self.cpu = sum(os.times()[:2]) - self.cpu
+        self.server.hooks.remove(self.collector)
+
+    def result(self, count, unit):
+        stats = self.collector.summary().get(self.endpoint, {})
+        return {
+            "workflow": self.name,
+            "count": count,
+            "unit": unit,
+            "seconds": self.elapsed,
+            "rate": count / self.elapsed if self.elapsed > 0 else None,
+            "p50_ms": stats["p50"] * 1000 if stats.get("p50") is not None else None,
+            "p99_ms": stats["p99"] * 1000 if stats.get("p99") is not None else None,
+            "requests": sum(endpoint["count"] for endpoint in self.collector.summary().values()),
+            "cpu_seconds": self.cpu,
+            "peak_memory_mb": peak_memory_mb(),
+        }
+
+
+def bench_create_jobs(server, args):
+    with Workflow("create_job", server, "POST Jobs") as workflow:
+        job_ids = list(bounded_imap(lambda i: server.create_job(name="bench %d" % i), range(args.jobs),
+                                    args.concurrency))
+    return workflow.result(len(job_ids), "jobs"), job_ids
+
+
+def bench_add_tasks(server, args):
+    job_id = server.create_job(name="bench add_tasks")
+    tasks = ({"commandLine": "model.exe --seed %d" % i} for i in range(args.tasks))
+    with Workflow("add_tasks", server, "POST Job/{id}/Tasks") as workflow:
+        results = server.add_tasks(job_id, tasks, concurrency=args.concurrency)
+    return workflow.result(len(results), "tasks"), job_id
+
+
+def bench_create_job_from_xml(server, args):
+    tasks = ({"CommandLine": "model.exe --seed %d" % i} for i in range(args.tasks))
+    with Workflow("create_job_from_xml", server, "POST Jobs/JobFile") as workflow:
+        server.create_job_from_xml(JobXml({"Name": "bench from xml"}, tasks))
+    return workflow.result(args.tasks, "tasks")
+
+
+def bench_poll_status(server, args, job_ids):
+    for job_id in job_ids:
+        server.submit_job(job_id)
+    polls = list(job_ids) * max(1, args.polls // max(len(job_ids), 1))
+    with Workflow("get_job State", server, "GET Job/{id}") as workflow:
+        list(bounded_imap(lambda job_id: server.get_job(job_id, ["State"]), polls, args.concurrency))
+    return workflow.result(len(polls), "polls")
+
+
+def bench_wait_for_jobs(server, args, job_ids):
+    with Workflow("wait_for_jobs", server, "GET Job/{id}") as workflow:
+        finished = list(server.wait_for_jobs(job_ids, min_interval=0.1, concurrency=args.concurrency))
+    return workflow.result(len(finished), "jobs")
+
+
+def bench_iter_tasks(server, args, job_id):
+    with Workflow("iter_tasks", server, "GET Job/{id}/Tasks") as workflow:
+        count = sum(1 for _ in server.iter_tasks(job_id, ["TaskId", "State"]))
+    return workflow.result(count, "tasks")
+
+
+def bench_process_pool(server, args, port):
+    # Requests are made by worker processes, so only wall time and rate are meaningful
+    with ProcessPoolWebAPI(processes=args.processes, concurrency=args.concurrency, host="127.0.0.1",
+                           username="user", password="password", port=port, scheme="http",
+                           hpc_cluster_name="MOCKCLUSTER") as pool:
+        tasks = ({"commandLine": "model.exe --seed %d" % i} for i in range(args.tasks))
+        with Workflow("add_tasks x%d procs" % args.processes, server, "POST Job/{id}/Tasks") as workflow:
+            job_id, results = pool.create_job_with_tasks(tasks, {"Name": "bench process pool"})
+    return workflow.result(len(results), "tasks")
+
+
+def bench_submit_batch(server, args):
+    records = ({"id": i, "command": "model.exe --seed %d" % i, "workdir": None, "env": None, "job": None,
+                "name": None} for i in range(args.tasks))
+    jobs = submit.group_records(records, args.tasks_per_job)
+    output = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+    with Workflow("submit.py --batch", server, "POST Job/{id}/Tasks") as workflow:
+        submit.submit_batch(server, jobs, output, "bench batch", "Normal", concurrency=args.concurrency)
+    return workflow.result(args.tasks, "tasks")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--tasks", type=int, default=5000)
+    parser.add_argument("--polls", type=int, default=5000)
+    parser.add_argument("--tasks-per-job", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.005, help="Mock server latency, in seconds")
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--run-time", type=float, default=1.0, help="Time a mock job is running, in seconds")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Also add tasks using ProcessPoolWebAPI with this number of processes")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    process, port = start_mock_server(args)
+    try:
+        server = WebAPI("127.0.0.1", "user", "password", port=port, scheme="http",
+                        hpc_cluster_name="MOCKCLUSTER", pool_maxsize=args.concurrency)
+        results = []
+        result, job_ids = bench_create_jobs(server, args)
+        results.append(result)
+        result, task_job_id = bench_add_tasks(server, args)
+        results.append(result)
+        results.append(bench_create_job_from_xml(server, args))
+        results.append(bench_poll_status(server, args, job_ids))
+        results.append(bench_wait_for_jobs(server, args, job_ids))
+        results.append(bench_iter_tasks(server, args, task_job_id))
+        results.append(bench_submit_batch(server, args))
+        if args.processes > 0:
+            results.append(bench_process_pool(server, args, port))
+        connections = server.connection_stats()
+        server.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.json:
+        print(json.dumps({"results": results, "connections": connections}, indent=2, sort_keys=True))
+        return
+    print("%-22s %8s %-6s %9s %10s %9s %9s %8s %9s" % ("workflow", "count", "unit", "seconds", "rate/s",
+                                                       "p50 ms", "p99 ms", "cpu s", "rss MB"))
+    for r in results:
+        print("%-22s %8d %-6s %9.2f %10.1f %9s %9s %8.2f %9s" % (
+            r["workflow"], r["count"], r["unit"], r["seconds"], r["rate"] or 0,
+            "%.1f" % r["p50_ms"] if r["p50_ms"] is not None else "-",
+            "%.1f" % r["p99_ms"] if r["p99_ms"] is not None else "-",
+            r["cpu_seconds"],
+            "%.0f" % r["peak_memory_mb"] if r["peak_memory_mb"] is not None else "-"))
+    print("connections: %(requests)d requests, %(connections_opened)d opened, "
+          "%(connections_reused)d reused" % connections)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Compare streaming property parser (vecnet.winhpc.xmlutils) with the original minidom implementation
+Run from the top-level directory of the package (or install the package first):
+    PYTHONPATH=. python benchmarks/bench_xml_parsing.py [--properties 10000] [--repeat 5]
+"""
+import argparse
+import timeit
+from io import StringIO
+from xml.dom import minidom
+
+from vecnet.winhpc import xmlutils
+
+
+def minidom_parse_properties(xml):
+    # Original implementation of WebAPI._get_properties_from_xml
+    properties = {}
+    parsed_xml = minidom.parse(StringIO(xml))
+    for property_tag in parsed_xml.getElementsByTagName('Property'):
+        name = property_tag.getElementsByTagName('Name')[0].firstChild.data
+        try:
+            value = property_tag.getElementsByTagName('Value')[0].firstChild.data
+        except AttributeError:
+            value = None
+        properties[name] = value
+    return properties
+
+
+def make_document(count):
+    xml = [u"<ArrayOfProperty xmlns=\"http://schemas.microsoft.com/HPCS2008R2/common\" "
+           u"xmlns:i=\"http://www.w3.org/2001/XMLSchema-instance\">"]
+    for i in range(count):
+        if i % 10 == 0:
+            xml.append(u"<Property><Name>Property%d</Name><Value/></Property>" % i)
+        else:
+            xml.append(u"<Property><Name>Property%d</Name><Value>Value &amp; %d</Value></Property>" % (i, i))
+    xml.append(u"</ArrayOfProperty>")
+    return u"".join(xml)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--properties", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    xml = make_document(args.properties)
+    assert xmlutils.parse_properties(xml) == minidom_parse_properties(xml)
+
+    for name, func in (("minidom", minidom_parse_properties), ("iterparse", xmlutils.parse_properties)):
+        best = min(timeit.repeat(lambda: func(xml), number=1, repeat=args.repeat))
+        print("%-10s %8.1f ms  (%d properties, %.0f KB document)" % (name, best * 1000, args.properties,
+                                                                      len(xml) / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,8 @@ setup(
     url="https://github.com/vecnet/vecnet.winhpc",
     packages=find_packages(),  # https://pythonhosted.org/setuptools/setuptools.html#using-find-packages
     install_requires=['requests'],
+    # AsyncWebAPI (vecnet.winhpc.asyncwebapi) requires python 3.5+ and aiohttp
+    extras_require={'async': ['aiohttp']},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "License :: OSI Approved :: Mozilla Public License 2.0 (MPL 2.0)",
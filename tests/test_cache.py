@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" MetadataCache and PropertyCache
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from vecnet.winhpc.cache import MetadataCache, PropertyCache
+from vecnet.winhpc.mockserver import MockHPCServer
+from vecnet.winhpc.webapi import WebAPI
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def webapi(self, mock):
+        # Cluster name is discovered (and cached) on first use
+        return WebAPI(mock.host, "user", "password", port=mock.port, scheme=mock.scheme,
+                      metadata_cache=MetadataCache(self.path))
+
+    def test_cluster_name_is_cached(self):
+        with MockHPCServer() as mock:
+            self.assertEqual(self.webapi(mock).hpc_cluster_name, mock.cluster_name)
+            requests = mock.requests
+            self.assertEqual(self.webapi(mock).get_version(), mock.version)
+            self.assertEqual(mock.requests, requests + 1)
+
+    def test_not_found_job_keeps_cache(self):
+        with MockHPCServer() as mock:
+            self.webapi(mock).get_version()
+            server = self.webapi(mock)
+            self.assertIsNone(server.get_job("12345"))
+            self.assertEqual(server.last_response.status_code, 404)
+            key = "%s:%s" % (mock.host, mock.port)
+            self.assertEqual(MetadataCache(self.path).get(key, "cluster_name"), mock.cluster_name)
+            # Cluster name is not discovered again
+            requests = mock.requests
+            server.get_job("12345")
+            self.assertEqual(mock.requests, requests + 1)
+
+    def test_wrong_cluster_name_is_refreshed(self):
+        with MockHPCServer() as mock:
+            MetadataCache(self.path).set("%s:%s" % (mock.host, mock.port), "cluster_name", "Renamed")
+            server = self.webapi(mock)
+            self.assertIsNone(server.get_version())
+            self.assertEqual(server.get_version(), mock.version)
+            self.assertEqual(server.hpc_cluster_name, mock.cluster_name)
+
+
+class PropertyCacheTest(unittest.TestCase):
+    def test_lookup(self):
+        cache = PropertyCache()
+        cache.store(("job", "1"), {"Name": "a", "State": "Running"})
+        self.assertEqual(cache.lookup(("job", "1"), ["Name", "Owner"]), ({"Name": "a"}, ["Owner"]))
+        # Not all properties are known
+        self.assertEqual(cache.lookup(("job", "1")), (None, None))
+        self.assertEqual(cache.stats(), {"hits": 0, "misses": 2, "entries": 1})
+
+    def test_property_names_are_case_insensitive(self):
+        cache = PropertyCache()
+        cache.store(("job", "1"), {"Name": "a"})
+        cache.store(("job", "1"), {"name": "b"})
+        self.assertEqual(cache.lookup(("job", "1"), ["NAME"]), ({"NAME": "b"}, []))
+
+    def test_invalidate_job(self):
+        cache = PropertyCache()
+        cache.store(("job", "1"), {"Name": "a"})
+        cache.store(("task", "1", "2"), {"Name": "b"})
+        cache.store(("job", "3"), {"Name": "c"})
+        cache.invalidate_job(1)
+        self.assertEqual(cache.lookup(("job", "1"), ["Name"]), ({}, ["Name"]))
+        self.assertEqual(cache.lookup(("task", "1", "2"), ["Name"]), ({}, ["Name"]))
+        self.assertEqual(cache.lookup(("job", "3"), ["Name"]), ({"Name": "c"}, []))
+
+    def test_read_racing_with_invalidation_is_not_stored(self):
+        cache = PropertyCache()
+        generation = cache.generation(("job", "1"))
+        # The job is modified while properties are being read
+        cache.invalidate(("task", "1", "2"))
+        self.assertFalse(cache.store(("job", "1"), {"Name": "old"}, generation=generation))
+        generation = cache.generation(("job", "1"))
+        cache.clear()
+        self.assertFalse(cache.store(("job", "1"), {"Name": "old"}, generation=generation))
+        self.assertTrue(cache.store(("job", "1"), {"Name": "new"}, generation=cache.generation(("job", "1"))))
+        self.assertEqual(cache.lookup(("job", "1"), ["Name"]), ({"Name": "new"}, []))
+
+    def test_generations_are_bounded(self):
+        cache = PropertyCache(max_entries=10)
+        for job_id in range(1000):
+            cache.store(("job", "%s" % job_id), {"Name": "a"})
+            cache.store(("task", "%s" % job_id, "1"), {"Name": "a"})
+            cache.invalidate(("job", "%s" % job_id))
+            cache.invalidate_job(job_id + 5000)
+        self.assertLessEqual(len(cache._job_generations), 10)
+        # Read of a job whose generation was dropped in the meantime is not stored
+        generation = cache.generation(("job", "1"))
+        cache.store(("job", "1"), {"Name": "a"})
+        cache.invalidate_job(1)
+        self.assertFalse(cache.store(("job", "1"), {"Name": "old"}, generation=generation))
+        self.assertTrue(cache.store(("job", "1"), {"Name": "new"}, generation=cache.generation(("job", "1"))))
+
+    def test_webapi_invalidates_modified_job(self):
+        with MockHPCServer() as mock:
+            cache = PropertyCache()
+            server = WebAPI(mock.host, "user", "password", property_cache=cache, **mock.webapi_kwargs())
+            job_id = server.create_job(Name="before")
+            self.assertEqual(server.get_job(job_id, ["Name"]), {"Name": "before"})
+            requests = mock.requests
+            self.assertEqual(server.get_job(job_id, ["Name"]), {"Name": "before"})
+            self.assertEqual(mock.requests, requests)
+            server.set_job_properties(job_id, Name="after")
+            self.assertEqual(server.get_job(job_id, ["Name"]), {"Name": "after"})
+
+
+if __name__ == "__main__":
+    unittest.main()
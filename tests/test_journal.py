@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" SubmissionJournal: resuming submissions interrupted by a crash
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from vecnet.winhpc import journal
+from vecnet.winhpc.journal import SubmissionJournal
+from vecnet.winhpc.mockserver import MockHPCServer
+from vecnet.winhpc.webapi import WebAPI
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingWebAPI(WebAPI):
+    """ Adds only the first `added` tasks of the second chunk, then crashes before the journal records them """
+    added = 30
+
+    def __init__(self, *args, **kwargs):
+        WebAPI.__init__(self, *args, **kwargs)
+        self.chunks = 0
+
+    def add_tasks(self, job_id, tasks, concurrency=8):
+        self.chunks += 1
+        if self.chunks == 2:
+            WebAPI.add_tasks(self, job_id, tasks[:self.added], concurrency)
+            raise Crash()
+        return WebAPI.add_tasks(self, job_id, tasks, concurrency)
+
+
+class SubmissionJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "journal.db")
+        self.chunk_size = journal.CHUNK_SIZE
+        journal.CHUNK_SIZE = 100
+        self.mock = MockHPCServer().start()
+        self.tasks = [{"Name": "t%d" % i, "CommandLine": "run %d" % i} for i in range(250)]
+        self.tasks[5]["EnvironmentVariables"] = {"A": "1"}
+
+    def tearDown(self):
+        self.mock.stop()
+        journal.CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.directory)
+
+    def webapi(self, cls=WebAPI):
+        return cls(self.mock.host, "user", "password", **self.mock.webapi_kwargs())
+
+    def test_submit(self):
+        with SubmissionJournal(self.path) as submissions:
+            submission_id, job_id = submissions.submit(self.webapi(), self.tasks, {"Name": "job"})
+            self.assertEqual(submissions.status(submission_id),
+                             {"job_id": job_id, "state": journal.SUBMITTED, "tasks": 250, "added": 250, "failed": 0})
+            self.assertEqual(submissions.pending(), [])
+
+    def test_resume_after_crash(self):
+        with SubmissionJournal(self.path) as submissions:
+            self.assertRaises(Crash, submissions.submit, self.webapi(CrashingWebAPI), self.tasks, {"Name": "job"})
+        with SubmissionJournal(self.path) as submissions:
+            self.assertEqual(submissions.pending(), [1])
+            self.assertEqual(submissions.status(1)["added"], 100)
+            server = self.webapi()
+            job_id = submissions.resume(server, 1)
+            self.assertEqual(submissions.status(1)["state"], journal.SUBMITTED)
+            # Tasks added before the crash, but not recorded, are not added again
+            self.assertEqual(self.mock.stats()["tasks"], 250)
+            task_ids = submissions.task_ids(1)
+            self.assertEqual(len(set(task_ids)), 250)
+            for seq in (0, 5, 100, 129, 130, 249):
+                self.assertEqual(server.get_task(job_id, task_ids[seq], ["Name"])["Name"], "t%d" % seq)
+            self.assertEqual(server.get_task_environment_variables(job_id, task_ids[5]), {"A": "1"})
+
+    def test_resume_after_crash_after_submit(self):
+        with SubmissionJournal(self.path) as submissions:
+            submission_id, job_id = submissions.submit(self.webapi(), self.tasks[:10], {"Name": "job"})
+            # The job was submitted, but the process crashed before it was recorded
+            submissions._set_state(submission_id, journal.CREATED)
+        with SubmissionJournal(self.path) as submissions:
+            self.assertEqual(submissions.resume(self.webapi(), submission_id), job_id)
+            self.assertEqual(submissions.status(submission_id)["state"], journal.SUBMITTED)
+            self.assertEqual(submissions.pending(), [])
+            self.assertEqual(self.mock.stats()["tasks"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Retry of failed requests and head node failover, against mockserver.MockHPCServer
+"""
+import unittest
+
+from vecnet.winhpc.mockserver import MockHPCServer
+from vecnet.winhpc.retry import CircuitBreaker, RetryPolicy
+from vecnet.winhpc.webapi import HPC_Pack_2012, WebAPI
+
+# Nothing listens on this address, connections are refused immediately
+DEAD_HOST = "127.0.0.2"
+
+
+class LostSubmitResponseServer(MockHPCServer):
+    """ Submits the job, but responds to the first Submit Job request with 500 (as if the response was lost) """
+    def handle(self, method, path, body):
+        status, text, headers = MockHPCServer.handle(self, method, path, body)
+        if path.endswith("/Submit") and not getattr(self, "lost", False):
+            self.lost = True
+            return 500, text, headers
+        return status, text, headers
+
+
+def webapi(mock, host=None, **kwargs):
+    return WebAPI(host or mock.host, "user", "password", **dict(mock.webapi_kwargs(), **kwargs))
+
+
+class RetryTest(unittest.TestCase):
+    def test_retry_injected_errors(self):
+        with MockHPCServer(error_rate=0.3, seed=1, retry_after=0) as mock:
+            server = webapi(mock, retry_policy=RetryPolicy(max_retries=10, backoff_factor=0.001))
+            job_id = server.create_job(Name="retry")
+            self.assertIsNotNone(job_id)
+            results = server.add_tasks(job_id, [{"CommandLine": "echo %d" % i} for i in range(30)])
+            self.assertTrue(all(result.ok for result in results))
+            self.assertGreater(mock.errors_injected, 0)
+            # Retries of non-idempotent requests never create duplicates
+            self.assertEqual(mock.stats()["jobs"], 1)
+            self.assertEqual(mock.stats()["tasks"], 30)
+
+    def test_non_idempotent_request_is_not_repeated(self):
+        with MockHPCServer(error_rate=1.0, error_status=500) as mock:
+            server = webapi(mock, retry_policy=RetryPolicy(max_retries=3, backoff_factor=0.001))
+            self.assertIsNone(server.create_job(Name="x"))
+            self.assertEqual(mock.requests, 1)
+            self.assertIsNone(server.get_version())
+            self.assertEqual(mock.requests, 1 + 4)
+            self.assertEqual(server.last_response.retries, 3)
+
+    def test_backoff_is_not_request_time(self):
+        events = []
+        with MockHPCServer(error_rate=1.0) as mock:
+            server = webapi(mock, hooks=[events.append],
+                            retry_policy=RetryPolicy(max_retries=2, backoff_factor=0.2, jitter=False))
+            self.assertIsNone(server.get_version())
+            response = server.last_response
+            self.assertEqual(response.retries, 2)
+            self.assertGreaterEqual(response.retry_delay, 0.6)
+            self.assertLess(response.elapsed, 0.5)
+            self.assertEqual(events[0].request_time, response.elapsed)
+
+    def test_lost_submit_response(self):
+        with LostSubmitResponseServer() as mock:
+            server = webapi(mock, retry_policy=RetryPolicy(max_retries=2, backoff_factor=0.001))
+            job_id = server.create_job(Name="lost")
+            self.assertTrue(server.submit_job(job_id))
+            self.assertNotEqual(server.get_job_property(job_id, "State"), "Configuring")
+
+    def test_submit_failure_without_retry(self):
+        with LostSubmitResponseServer() as mock:
+            server = webapi(mock)
+            job_id = server.create_job(Name="lost")
+            # Without retries the client can't tell the response was lost
+            self.assertFalse(server.submit_job(job_id))
+
+
+class FailoverTest(unittest.TestCase):
+    def test_rotation_returns_to_original_host(self):
+        server = WebAPI("hn1.example.com", "user", "password", hpc_cluster_name="Cluster",
+                        failover_hosts=["hn2.example.com", "hn3.example.com"])
+        # Active head node is unknown, so every failover moves to the next host
+        server._query_active_head_node = lambda host: None
+        hosts = [server.failover() for i in range(4)]
+        self.assertEqual(hosts, ["hn2.example.com", "hn3.example.com", "hn1.example.com", "hn2.example.com"])
+
+    def test_failover_to_active_head_node(self):
+        with MockHPCServer() as mock:
+            server = webapi(mock, host=DEAD_HOST, failover_hosts=[mock.host], api_version=HPC_Pack_2012,
+                            retry_policy=RetryPolicy(max_retries=2, backoff_factor=0.001),
+                            circuit_breaker=CircuitBreaker(failure_threshold=1))
+            self.assertEqual(server.get_version(), mock.version)
+            self.assertEqual(server.host, mock.host)
+            self.assertEqual(server.last_response.retries, 1)
+
+    def test_failover_back_to_original_host(self):
+        with MockHPCServer() as mock:
+            server = webapi(mock, failover_hosts=[DEAD_HOST], api_version=HPC_Pack_2012,
+                            retry_policy=RetryPolicy(max_retries=2, backoff_factor=0.001),
+                            circuit_breaker=CircuitBreaker(failure_threshold=1))
+            # Client has switched to the failover host, which went down in turn
+            server.host = DEAD_HOST
+            self.assertEqual(server.get_version(), mock.version)
+            self.assertEqual(server.host, mock.host)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Batch submission (submit.py --batch) and its --resume
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from vecnet.winhpc import submit
+from vecnet.winhpc.mockserver import MockHPCServer
+from vecnet.winhpc.webapi import WebAPI
+
+
+class CrashingOutput(io.StringIO):
+    """ Results file of a process that crashes after `lines` lines are written (never if lines is None) """
+    def __init__(self, lines=None):
+        io.StringIO.__init__(self)
+        self.lines = lines
+
+    def write(self, data):
+        if self.lines is not None:
+            if self.lines == 0:
+                raise IOError("Crash")
+            self.lines -= 1
+        return io.StringIO.write(self, u"%s" % data)
+
+
+def records(count):
+    return [{"id": number, "command": "run %d" % number, "workdir": None, "env": None, "job": None, "name": None}
+            for number in range(count)]
+
+
+class ReadRecordsTest(unittest.TestCase):
+    def test_ids(self):
+        fp = io.StringIO(u'{"id": 0, "command": "a"}\n{"command": "b"}\n{"id": "x", "command": "c"}\n')
+        self.assertEqual([record["id"] for record in submit.read_records(fp)], [0, 2, "x"])
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.home = os.environ.get("HOME")
+        os.environ["HOME"] = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(os.environ["HOME"])
+        if self.home is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = self.home
+
+    def test_cluster_name_is_discovered_once(self):
+        with MockHPCServer() as mock:
+            for requests in (2, 1):
+                # Every CLI invocation creates a new WebAPI instance
+                server = submit._webapi(mock.host, "user", "password", port=mock.port, scheme=mock.scheme)
+                mock.reset()
+                self.assertIsNotNone(server.create_job(name="job"))
+                self.assertEqual(mock.requests, requests)
+
+    def test_no_cache(self):
+        with MockHPCServer() as mock:
+            for i in range(2):
+                server = submit._webapi(mock.host, "user", "password", use_cache=False, port=mock.port,
+                                        scheme=mock.scheme)
+                mock.reset()
+                server.create_job(name="job")
+                self.assertEqual(mock.requests, 2)
+
+
+class SubmitBatchTest(unittest.TestCase):
+    def test_resume(self):
+        with MockHPCServer() as mock:
+            server = WebAPI(mock.host, "user", "password", **mock.webapi_kwargs())
+            jobs = submit.group_records(records(50), 100)
+            # Job line and the first 20 tasks are written before the crash
+            output = CrashingOutput(21)
+            self.assertRaises(IOError, submit.submit_batch, server, jobs, output, "batch", "Normal", concurrency=1)
+            previous_jobs, done = submit.read_results(io.StringIO(output.getvalue()))
+            self.assertEqual(len(done), 20)
+            self.assertEqual(list(previous_jobs.values()), [["1", False]])
+
+            failed = submit.submit_batch(server, jobs, CrashingOutput(), "batch", "Normal", previous_jobs, done)
+            self.assertEqual(failed, 0)
+            # Only the task being added when the process crashed is added twice
+            self.assertEqual(mock.stats()["jobs"], 1)
+            self.assertEqual(mock.stats()["tasks"], 51)
+            self.assertNotEqual(server.get_job_property("1", "State"), "Configuring")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" TaskStore
+"""
+import unittest
+
+from vecnet.winhpc.mockserver import MockHPCServer
+from vecnet.winhpc.taskstore import TaskStore
+from vecnet.winhpc.webapi import WebAPI
+
+
+class TaskStoreTest(unittest.TestCase):
+    def test_update(self):
+        store = TaskStore()
+        self.assertTrue(store.update("7", "8", {"State": "Failed", "ExitCode": "3221225477"}))
+        self.assertEqual(store.get(7, 8)["ExitCode"], -1073741819)
+        self.assertEqual(store.failures(), [(7, 8, -1073741819)])
+        self.assertEqual(store.counts(), {7: {"Failed": 1}})
+
+    def test_invalid_values_are_not_stored(self):
+        store = TaskStore()
+        self.assertFalse(store.update("x", 1, {"State": "Running"}))
+        self.assertFalse(store.update(1, 2 ** 40, {"State": "Running"}))
+        self.assertTrue(store.update(1, 1, {"State": "Running", "ExitCode": "abc"}))
+        self.assertIsNone(store.get(1, 1)["ExitCode"])
+        self.assertEqual(len(store), 1)
+
+    def test_unknown_state_is_not_counted(self):
+        with MockHPCServer() as mock:
+            store = TaskStore()
+            server = WebAPI(mock.host, "user", "password", task_store=store, **mock.webapi_kwargs())
+            job_id = server.create_job(Name="tasks")
+            server.add_tasks(job_id, [{"CommandLine": "echo %d" % i} for i in range(3)])
+            server.get_task(job_id, 3, ["CommandLine"])
+            self.assertEqual(store.counts(), {})
+            self.assertEqual(store.get(job_id, 3)["State"], None)
+            list(server.iter_tasks(job_id, ["TaskId", "State"]))
+            self.assertEqual(store.counts(), {int(job_id): {"Configuring": 3}})
+            self.assertEqual(store.summary(job_id)["tasks"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
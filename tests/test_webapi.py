@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" WebAPI operations against mockserver.MockHPCServer
+"""
+import threading
+import time
+import unittest
+
+from vecnet.winhpc.mockserver import MockHPCServer
+from vecnet.winhpc.retry import CircuitBreaker
+from vecnet.winhpc.webapi import JOB_NOT_FOUND, WebAPI
+
+
+class UploadFailingWebAPI(WebAPI):
+    """ Connection drops after the first chunk of Create Job From XML request body is sent """
+    def create_job_from_xml(self, xml):
+        next(iter(xml))
+        return None
+
+
+class WebAPITest(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockHPCServer(queue_time=0.1, run_time=0.2).start()
+        self.server = WebAPI(self.mock.host, "user", "password", **self.mock.webapi_kwargs())
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_add_tasks(self):
+        job_id = self.server.create_job(Name="tasks")
+        results = self.server.add_tasks(job_id, [{"CommandLine": "echo %d" % i, "EnvironmentVariables": {"N": i}}
+                                                 for i in range(20)])
+        # Tasks are added by parallel requests, so task IDs are not in order
+        self.assertEqual(sorted(int(result.task_id) for result in results), list(range(1, 21)))
+        self.assertEqual(self.server.get_task_environment_variables(job_id, results[6].task_id), {"N": "6"})
+        self.assertEqual(len(list(self.server.iter_tasks(job_id, ["TaskId"]))), 20)
+
+    def test_create_job_with_tasks_failure(self):
+        tasks = [{"CommandLine": "echo %d" % i} for i in range(5)]
+        self.server.circuit_breaker = CircuitBreaker(failure_threshold=1)
+        self.server.circuit_breaker.record_failure()
+        for from_xml in (False, True):
+            job_id, results = self.server.create_job_with_tasks(tasks, from_xml=from_xml)
+            self.assertIsNone(job_id)
+            self.assertEqual(len(results), 5)
+            job_id, results = self.server.create_job_with_tasks(iter(tasks), from_xml=from_xml)
+            self.assertEqual([result.task_id for result in results], [None] * 5)
+            self.assertTrue(all(result.error for result in results))
+
+    def test_create_job_from_xml_upload_failure(self):
+        server = UploadFailingWebAPI(self.mock.host, "user", "password", **self.mock.webapi_kwargs())
+        tasks = ({"CommandLine": "x" * 1000} for i in range(200))
+        job_id, results = server.create_job_with_tasks(tasks, from_xml=True)
+        self.assertIsNone(job_id)
+        self.assertEqual(len(results), 200)
+
+    def test_wait_for_jobs(self):
+        job_ids = [self.server.create_job(Name="job %d" % i) for i in range(3)]
+        for job_id in job_ids:
+            self.assertTrue(self.server.submit_job(job_id))
+        finished = dict(self.server.wait_for_jobs(job_ids + ["999"], timeout=10, min_interval=0.05))
+        self.assertEqual(finished, dict([(job_id, {"State": "Finished"}) for job_id in job_ids] +
+                                        [("999", {"State": JOB_NOT_FOUND})]))
+
+    def test_wait_for_jobs_yields_finished_job_immediately(self):
+        finished = self.server.create_job(Name="finished")
+        self.server.submit_job(finished)
+        self.assertEqual(self.server.wait_for_job(finished, timeout=10, min_interval=0.05)["State"], "Finished")
+        unfinished = [self.server.create_job(Name="job %d" % i) for i in range(40)]
+        self.mock.latency = 0.05
+        started = time.time()
+        jobs = self.server.wait_for_jobs([finished] + unfinished, concurrency=2)
+        self.assertEqual(next(jobs), (finished, {"State": "Finished"}))
+        # The round of 41 polls takes about 1 second
+        self.assertLess(time.time() - started, 0.5)
+        jobs.close()
+        time.sleep(0.3)
+        self.assertEqual([thread for thread in threading.enumerate() if thread.name.startswith("WorkerPool")], [])
+
+    def test_wait_for_job_timeout(self):
+        job_id = self.server.create_job(Name="never submitted")
+        self.assertIsNone(self.server.wait_for_job(job_id, timeout=0.2, min_interval=0.05))
+
+
+if __name__ == "__main__":
+    unittest.main()
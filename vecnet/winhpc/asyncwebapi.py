@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" asyncio version of WebAPI client.
+Requires python 3.5+ and aiohttp (pip install vecnet.winhpc[async])
+
+Usage:
+    async with AsyncWebAPI(hostname, username, password) as server:
+        job_id = await server.create_job(name="My job")
+        await server.add_task(job_id, commandLine="hostname")
+        await server.submit_job(job_id)
+
+Requests are built by the operations module shared with WebAPI; retry policy (retry.RetryPolicy) and hooks
+(for example, metrics.MetricsCollector) work the same way as in WebAPI.
+"""
+import asyncio
+import collections
+import time
+
+import aiohttp
+
+from . import metrics, operations, xmlutils
+from .transport import Response, body_size
+from .webapi import (WebAPI, TaskResult, HPC_Pack_2008_R2_SP3, HPC_Pack_2008_R2_SP4, JOB_CANCELED_STATES,
+                     JOB_SUBMITTED_STATES)
+
+
+class AsyncWebAPI(object):
+    def __init__(self,
+                 host,
+                 username,
+                 password,
+                 port=443,
+                 hpc_cluster_name=None,
+                 api_version=HPC_Pack_2008_R2_SP3,
+                 concurrency=100,
+                 pool_maxsize=100,
+                 scheme="https",
+                 retry_policy=None,
+                 hooks=None,
+                 timeout=None):
+        """
+        :param concurrency: Maximum number of requests in flight, additional requests wait for a free slot
+        :param pool_maxsize: Maximum number of connections to WinHPC WebAPI server
+        :param retry_policy: (optional) retry.RetryPolicy, see WebAPI
+        :param hooks: (optional) Functions called with metrics.RequestEvent after each request, see WebAPI
+        :param timeout: (optional) Maximum time of a single request, in seconds
+        """
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.scheme = scheme
+        self.api_version = api_version
+        self.hpc_cluster_name = hpc_cluster_name
+        self.concurrency = concurrency
+        self.pool_maxsize = pool_maxsize
+        self.retry_policy = retry_policy
+        self.hooks = list(hooks) if hooks is not None else []
+        self.timeout = timeout
+        # HTTP Request headers
+        self.headers = {"Content-type": "application/xml"}
+        if self.api_version is not None:
+            self.headers["api-version"] = self.api_version
+        self._session = None
+        self._semaphore = None
+        self._cluster_lock = None
+        self._base_url = None
+        if hpc_cluster_name is not None:
+            self._base_url = self._make_base_url(hpc_cluster_name)
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Helper functions
+    # ---------------------------------------------------------------------------------------------- #
+    _xml_from_properties = staticmethod(WebAPI._xml_from_properties)
+    _get_clusters_from_xml = staticmethod(WebAPI._get_clusters_from_xml)
+    _requested_properties_to_string = WebAPI._requested_properties_to_string
+
+    def _make_base_url(self, hpc_cluster_name):
+        return "{scheme}://{host}:{port}/WindowsHPC/{HPC_cluster_name}/".format(
+            scheme=self.scheme,
+            host=self.host,
+            port=self.port,
+            HPC_cluster_name=hpc_cluster_name,
+        )
+
+    def _get_session(self):
+        # aiohttp session and asyncio primitives must be created inside a running event loop
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize, ssl=False)
+            timeout = aiohttp.ClientTimeout(total=self.timeout) if self.timeout is not None else None
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  auth=aiohttp.BasicAuth(self.username, self.password),
+                                                  timeout=timeout)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._cluster_lock = asyncio.Lock()
+        return self._session
+
+    async def get_base_url(self):
+        """ URL of the cluster REST API. Cluster name is discovered by get_clusters() on first use """
+        if self._base_url is None:
+            self._get_session()
+            async with self._cluster_lock:
+                if self._base_url is None:
+                    clusters = await self.get_clusters()
+                    if clusters:
+                        self.hpc_cluster_name = clusters[0]
+                    self._base_url = self._make_base_url(self.hpc_cluster_name)
+        return self._base_url
+
+    async def close(self):
+        """ Close all pooled connections to WinHPC WebAPI server """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def send(self, method, url, data=None, headers=None, parser=None, idempotent=None):
+        """ Send HTTP request to WinHPC WebAPI server using correct headers, api-version and credentials
+        :param method: HTTP method (GET, POST or PUT)
+        :param url: URL to post
+        :param data: (optional) Data to be posted (string or bytes)
+        :param headers: (optional) Additional headers if necessary
+        :param parser: (optional) Function to parse body of successful response, result is saved in response.value
+        :param idempotent: (optional) True if request can be safely repeated (see retry.RetryPolicy).
+                           Default is True for GET and PUT requests, False for POST requests
+
+        :return: Response object
+        """
+        if headers is None:
+            headers = self.headers
+        else:
+            merged_headers = dict(self.headers)
+            merged_headers.update(headers)
+            headers = merged_headers
+
+        if method not in ("post", "get", "put"):
+            raise RuntimeError("HTTP method %s is not supported" % method)
+        if idempotent is None:
+            idempotent = method in ("get", "put")
+
+        started = time.time()
+        retry_delay = 0.0
+        attempt = 0
+        while True:
+            response = await self._send_once(method, url, data, headers)
+            if self.retry_policy is None or not self.retry_policy.should_retry(attempt, response, idempotent):
+                break
+            sleep_started = time.time()
+            await asyncio.sleep(self.retry_policy.delay(attempt, response))
+            retry_delay += time.time() - sleep_started
+            attempt += 1
+        response.retries = attempt
+        # Time spent waiting between retries is not part of request time
+        response.elapsed = time.time() - started - retry_delay
+        response.retry_delay = retry_delay
+        response.bytes_sent = body_size(data) or 0
+        try:
+            if parser is not None and response.ok:
+                parse_started = time.time()
+                response.value = parser(response.text)
+                response.parse_time = time.time() - parse_started
+        finally:
+            if self.hooks:
+                metrics.emit(self.hooks, method, url, response)
+        return response
+
+    async def _send_once(self, method, url, data, headers):
+        session = self._get_session()
+        async with self._semaphore:
+            try:
+                async with session.request(method, url, data=data, headers=headers) as r:
+                    body = await r.read()
+                    return Response(status_code=r.status,
+                                    text=body.decode(r.charset or "utf-8", "replace"),
+                                    headers=r.headers,
+                                    bytes_received=len(body))
+            except aiohttp.ClientConnectorError as e:
+                # Connection could not be established, request was not sent
+                return Response(text="%s" % e, error="%s" % e, request_sent=False)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                message = "%s" % e or "Request timed out"
+                return Response(text=message, error=message)
+
+    async def send_operation(self, operation):
+        """ Send request of HPC Web Service API operation (see operations module)
+        :param operation: operations.Operation
+        :return: Response object, response.value is the parsed response body
+        """
+        return await self.send(operation.method, await self.get_base_url() + operation.path, operation.data,
+                               operation.headers, parser=operation.parser, idempotent=operation.idempotent)
+
+    async def _value(self, operation):
+        # Parsed response body (response body if operation has no parser), None if request failed
+        r = await self.send_operation(operation)
+        if not r.ok:
+            return None
+        return r.value if operation.parser is not None else r.text
+
+    async def _applied_after_retry(self, response, job_id, states):
+        # See WebAPI._applied_after_retry
+        if response.retries == 0:
+            return False
+        properties = await self.get_job(job_id, ["State"])
+        return bool(properties) and properties.get("State") in states
+
+    async def request(self, method, url, data=None, headers=None, idempotent=None):
+        """ Send HTTP request to WinHPC WebAPI server
+        :return: True if request successfully completed
+        :return: False if error happened
+        """
+        r = await self.send(method, url, data, headers, idempotent=idempotent)
+        return r.ok
+
+    async def post(self, url, data, headers=None, idempotent=False):
+        return await self.request("post", url, data, headers=headers, idempotent=idempotent)
+
+    async def get(self, url):
+        return await self.request("get", url)
+
+    async def put(self, url, data):
+        return await self.request("put", url, data)
+
+    # ------------------------------------------------------------------------------------------- #
+    # HPC Web Service API functions
+    # Please refer to WebAPI class, operations module and HPC Web Service API Reference for additional details
+    # http://msdn.microsoft.com/en-us/library/hh560258(v=vs.85).aspx
+    # ------------------------------------------------------------------------------------------- #
+    async def add_task(self, job_id, **properties):
+        return await self._value(operations.add_task(job_id, properties))
+
+    async def add_tasks(self, job_id, tasks):
+        """ Add many tasks to a job concurrently (limited by concurrency parameter of AsyncWebAPI).
+        Tasks are read from the iterable as requests complete, at most 2 * concurrency tasks ahead,
+        so it can be a generator of millions of tasks.
+
+        :param job_id: Job ID
+        :param tasks: Iterable of dictionaries with task properties. Environment variables of a task can be
+                      specified as a dictionary in "EnvironmentVariables" property (see WebAPI.add_tasks)
+        :return: List of TaskResult (task_id, error), in the same order as tasks
+        """
+        async def add_task(properties):
+            task_id = None
+            try:
+                properties, env_variables = operations.split_environment_variables(properties)
+                r = await self.send_operation(operations.add_task(job_id, properties))
+                if not r.ok:
+                    return TaskResult(None, r.text)
+                task_id = r.value
+                if env_variables:
+                    r = await self.send_operation(operations.set_task_environment_variables(job_id, task_id,
+                                                                                            env_variables))
+                    if not r.ok:
+                        return TaskResult(task_id, r.text)
+                return TaskResult(task_id, None)
+            except Exception as e:
+                return TaskResult(task_id, "%s" % e)
+
+        results = []
+        pending = collections.deque()
+        window = 2 * self.concurrency
+        try:
+            for properties in tasks:
+                pending.append(asyncio.ensure_future(add_task(properties)))
+                if len(pending) >= window:
+                    results.append(await pending.popleft())
+            while pending:
+                results.append(await pending.popleft())
+        finally:
+            # Caller was cancelled - don't leave requests running
+            for future in pending:
+                future.cancel()
+        return results
+
+    async def cancel_job(self, job_id, forced=False, message=""):
+        r = await self.send_operation(operations.cancel_job(job_id, forced, message))
+        if not r.ok:
+            return await self._applied_after_retry(r, job_id, JOB_CANCELED_STATES)
+        return True
+
+    async def cancel_task(self, job_id, task_id, forced=False, message=""):
+        return (await self.send_operation(operations.cancel_task(job_id, task_id, forced, message))).ok
+
+    async def create_job(self, **properties):
+        return await self._value(operations.create_job(properties))
+
+    async def create_job_with_tasks(self, tasks, job_properties=None, from_xml=False):
+        """ Create a new job and populate it with tasks. The job is not submitted.
+        See WebAPI.create_job_with_tasks for details
+        :return: (job_id, list of TaskResult) tuple, job_id is None if job creation failed
+        """
+        if job_properties is None:
+            job_properties = {}
+        if from_xml:
+            # aiohttp can't stream synchronous generators, so the document is built in memory
+            job_xml = xmlutils.JobXml(job_properties, tasks)
+            r = await self.send_operation(operations.create_job_from_xml(job_xml.to_bytes()))
+            if not r.ok:
+                return None, [TaskResult(None, r.text) for i in range(job_xml.task_count)]
+            return r.value, [TaskResult("%s" % (i + 1), None) for i in range(job_xml.task_count)]
+
+        job_id = await self.create_job(**job_properties)
+        if job_id is None:
+            return None, []
+        return job_id, await self.add_tasks(job_id, tasks)
+
+    async def create_job_from_xml(self, xml):
+        return await self._value(operations.create_job_from_xml(xml))
+
+    async def get_active_head_node(self):
+        if self.api_version < HPC_Pack_2008_R2_SP4:
+            raise NotImplementedError("Minimum api-version supported is %s" % HPC_Pack_2008_R2_SP4)
+        return await self._value(operations.get_active_head_node())
+
+    async def get_clusters(self):
+        # http://msdn.microsoft.com/en-us/library/hh770490(v=vs.85).aspx
+        r = await self.send("get", operations.clusters_url(self.scheme, self.host, self.port),
+                            parser=self._get_clusters_from_xml)
+        if not r.ok:
+            return None
+        return r.value
+
+    async def get_job(self, job_id, requested_properties=None):
+        return await self._value(operations.get_job(job_id, requested_properties))
+
+    async def get_job_as_xml(self, job_id):
+        return await self._value(operations.get_job_as_xml(job_id))
+
+    async def get_job_custom_properties(self, job_id, requested_properties=None):
+        return await self._value(operations.get_job_custom_properties(job_id, requested_properties))
+
+    async def get_job_property(self, job_id, property_name):
+        properties = await self.get_job(job_id, [property_name])
+        if not properties:
+            return None
+        return properties[property_name]
+
+    async def get_job_environment_variables(self, job_id, requested_variables=None):
+        return await self._value(operations.get_job_environment_variables(job_id, requested_variables))
+
+    async def get_subtask(self, job_id, task_id, subtask_id, requested_properties=None):
+        return await self._value(operations.get_subtask(job_id, task_id, subtask_id, requested_properties))
+
+    async def get_subtask_as_xml(self, job_id, task_id, subtask_id):
+        return await self._value(operations.get_subtask_as_xml(job_id, task_id, subtask_id))
+
+    async def get_task(self, job_id, task_id, requested_properties=None):
+        return await self._value(operations.get_task(job_id, task_id, requested_properties))
+
+    async def get_task_environment_variables(self, job_id, task_id, requested_env_variables=None):
+        return await self._value(operations.get_task_environment_variables(job_id, task_id, requested_env_variables))
+
+    async def get_version(self):
+        return await self._value(operations.get_version())
+
+    async def requeue_job(self, job_id):
+        return (await self.send_operation(operations.requeue_job(job_id))).ok
+
+    async def set_job_environment_variables(self, job_id, **variables):
+        return (await self.send_operation(operations.set_job_environment_variables(job_id, variables))).ok
+
+    async def set_job_properties(self, job_id, **properties):
+        if self.api_version is None:
+            raise RuntimeError("Minimum supported api-version: %s" % HPC_Pack_2008_R2_SP3)
+        return (await self.send_operation(operations.set_job_properties(job_id, properties))).ok
+
+    async def set_job_custom_properties(self, job_id, **properties):
+        return (await self.send_operation(operations.set_job_custom_properties(job_id, properties))).ok
+
+    async def set_task_environment_variables(self, job_id, task_id, **env_variables):
+        return (await self.send_operation(operations.set_task_environment_variables(job_id, task_id,
+                                                                                    env_variables))).ok
+
+    async def set_task_properties(self, job_id, task_id, **properties):
+        return (await self.send_operation(operations.set_task_properties(job_id, task_id, properties))).ok
+
+    async def submit_job(self, job_id, **properties):
+        r = await self.send_operation(operations.submit_job(job_id, properties))
+        if not r.ok:
+            return await self._applied_after_retry(r, job_id, JOB_SUBMITTED_STATES)
+        return True
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Caches used by WebAPI to avoid repeated requests to WinHPC WebAPI server
+"""
+import collections
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class MetadataCache(object):
+    """ On-disk cache of cluster metadata (cluster name, HPC Pack version, active head node), so short-lived
+    processes don't have to query WinHPC WebAPI server every time they start.
+
+    The cache is a JSON file {"host:port": {"field": [value, timestamp], ...}, ...}
+    Entries older than ttl seconds are ignored.
+    """
+    def __init__(self, path=None, ttl=3600):
+        """
+        :param path: (optional) Path to cache file. Default is ~/.vecnet.winhpc.cache.json
+        :param ttl: Time to live of cache entries, in seconds
+        """
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"), ".vecnet.winhpc.cache.json")
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _load(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+            if isinstance(data, dict):
+                return data
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def _save(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".winhpc-cache-")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump(data, fp)
+            if hasattr(os, "replace"):
+                os.replace(temp_path, self.path)
+            else:
+                # os.rename can't overwrite existing file on Windows in python 2.7
+                if os.name == "nt" and os.path.exists(self.path):
+                    os.remove(self.path)
+                os.rename(temp_path, self.path)
+        except (IOError, OSError):
+            # Cache is an optimization only, failure to save it is not an error
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get(self, key, field):
+        """ Cached value of the field, None if it is not cached or expired
+        :param key: Cache key (host:port of WinHPC WebAPI server)
+        :param field: Name of the field (for example, "cluster_name")
+        """
+        with self._lock:
+            if self._data is None:
+                self._data = self._load()
+            entry = self._data.get(key, {}).get(field)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def set(self, key, field, value):
+        """ Save field value in the cache
+        :param key: Cache key (host:port of WinHPC WebAPI server)
+        :param field: Name of the field
+        :param value: Value of the field (must be JSON serializable)
+        """
+        with self._lock:
+            # Re-read the file to keep entries saved by other processes
+            self._data = self._load()
+            self._data.setdefault(key, {})[field] = [value, time.time()]
+            self._save(self._data)
+
+    def invalidate(self, key):
+        """ Remove all cached fields for the key """
+        with self._lock:
+            self._data = self._load()
+            if key in self._data:
+                del self._data[key]
+                self._save(self._data)
+
+
+# Time to live (in seconds) of job and task properties in PropertyCache.
+# Properties that change while a job runs are cached for a short time, properties that never change - for long.
+DEFAULT_FIELD_TTLS = {
+    "State": 2.0,
+    "Progress": 2.0,
+    "ProgressMessage": 2.0,
+    "Id": 3600.0,
+    "TaskId": 3600.0,
+    "Name": 3600.0,
+    "Owner": 3600.0,
+    "Project": 3600.0,
+    "CommandLine": 3600.0,
+    "CreateTime": 3600.0,
+    "SubmitTime": 3600.0,
+}
+
+
+class PropertyCache(object):
+    """ In-process LRU cache of job and task properties with per-field time to live.
+    WebAPI reads properties from the cache in get_job, get_task and get_job_custom_properties, and invalidates
+    cached properties of jobs and tasks it modifies. Thread-safe.
+
+    Cache keys are tuples: ("job", job_id), ("task", job_id, task_id), ("job_custom", job_id).
+    Property names are case insensitive, like in HPC Web Service API.
+
+    A read that started before the job was invalidated must not store its (possibly outdated) result:
+    take generation(key) before sending the request and pass it to store().
+    """
+    def __init__(self, max_entries=10000, default_ttl=5.0, field_ttls=None):
+        """
+        :param max_entries: Maximum number of cached jobs and tasks, least recently used are evicted
+        :param default_ttl: Time to live (in seconds) of properties not listed in field_ttls
+        :param field_ttls: (optional) Dictionary {property name: time to live}, default is DEFAULT_FIELD_TTLS
+        """
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.field_ttls = dict(DEFAULT_FIELD_TTLS if field_ttls is None else field_ttls)
+        self._field_ttls = dict((name.lower(), ttl) for name, ttl in self.field_ttls.items())
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> [{lowercase property name: (property name, value, expiration time)},
+        #         expiration time of the complete property set or None]
+        self._entries = collections.OrderedDict()
+        # job_id -> set of keys of the job and its tasks
+        self._job_keys = {}
+        # Invalidations are numbered by _invalidations. job_id -> number of the last invalidation of the job or
+        # its tasks, kept only while the job has cached keys (bounded like _entries). _forgotten is the highest
+        # number dropped from _job_generations, used for jobs without an entry. _epoch counts clear() calls
+        self._invalidations = 0
+        self._job_generations = {}
+        self._forgotten = 0
+        self._epoch = 0
+
+    def _ttl(self, name):
+        return self._field_ttls.get(name.lower(), self.default_ttl)
+
+    def generation(self, key):
+        """ Token identifying the current version of cached properties of the job (or task) in key, see store() """
+        with self._lock:
+            return self._epoch, self._invalidations
+
+    def _invalidated(self, key):
+        # Called with self._lock held
+        self._invalidations += 1
+        if key[1] in self._job_keys:
+            self._job_generations[key[1]] = self._invalidations
+        else:
+            self._forgotten = self._invalidations
+
+    def _changed_since(self, key, generation):
+        # Called with self._lock held. A job without generation entry may have been invalidated after its entry
+        # was dropped, so it is compared with the newest dropped generation (may report a change that didn't
+        # happen - the result is then just not cached)
+        epoch, invalidations = generation
+        if epoch != self._epoch:
+            return True
+        return self._job_generations.get(key[1], self._forgotten) > invalidations
+
+    def lookup(self, key, requested_properties=None):
+        """ Find properties in the cache
+        :param key: Cache key
+        :param requested_properties: List of property names, None for all properties
+        :return: (cached properties, missing properties) tuple. If requested_properties is None, missing properties
+                 is None unless all properties are cached and none of them expired
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.pop(key)
+                self._entries[key] = entry
+            if requested_properties is None:
+                if entry is not None and entry[1] is not None and entry[1] > now:
+                    self.hits += 1
+                    return dict((name, value) for name, value, expires in entry[0].values()), []
+                self.misses += 1
+                return None, None
+            cached = {}
+            missing = []
+            for name in requested_properties:
+                field = entry[0].get(name.lower()) if entry is not None else None
+                if field is not None and field[2] > now:
+                    cached[name] = field[1]
+                else:
+                    missing.append(name)
+            if missing:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return cached, missing
+
+    def store(self, key, properties, complete=False, generation=None):
+        """ Save properties in the cache
+        :param key: Cache key
+        :param properties: Dictionary of properties
+        :param complete: True if properties contains all properties of the job or task
+        :param generation: (optional) Value of generation(key) taken before properties were requested.
+                           Properties are not saved if the job was invalidated since then
+        :return: True if properties were saved
+        """
+        now = time.time()
+        with self._lock:
+            if generation is not None and self._changed_since(key, generation):
+                return False
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = [{}, None]
+                self._job_keys.setdefault(key[1], set()).add(key)
+            for name in properties:
+                entry[0][name.lower()] = (name, properties[name], now + self._ttl(name))
+            if complete:
+                entry[1] = min([expires for name, value, expires in entry[0].values()] or [now])
+            elif entry[1] is not None:
+                entry[1] = min(entry[1], min(expires for name, value, expires in entry[0].values()))
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._job_keys.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._job_keys[key[1]]
+                self._forgotten = max(self._forgotten, self._job_generations.pop(key[1], 0))
+
+    def invalidate(self, key):
+        """ Remove properties of a job or a task from the cache """
+        with self._lock:
+            self._invalidated(key)
+            self._remove(key)
+
+    def invalidate_job(self, job_id):
+        """ Remove all cached properties of the job and its tasks """
+        with self._lock:
+            self._invalidated((None, "%s" % job_id))
+            for key in list(self._job_keys.get("%s" % job_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._job_keys.clear()
+            self._job_generations.clear()
+            self._epoch += 1
+
+    def stats(self):
+        """ Cache statistics
+        :return: Dictionary with "hits", "misses" and "entries" keys
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
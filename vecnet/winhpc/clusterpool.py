@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Several HPC clusters behind one interface, with load-aware placement of new jobs.
+
+    pool = ClusterPool({"east": WebAPI(host1, username, password),
+                        "west": WebAPI(host2, username, password)})
+    job_id = pool.create_job(Name="My job")     # "west:1234" - job 1234 on the least loaded cluster
+    pool.add_task(job_id, commandLine="model.exe")
+    pool.submit_job(job_id)
+    pool.get_job_property(job_id, "State")
+
+Job IDs returned by ClusterPool are "<cluster name>:<job ID on the cluster>". Placement of every job created
+by the pool is recorded in `placements` (any dict-like object, for example a shelve, can be passed to keep
+the record between runs).
+"""
+import logging
+import threading
+import time
+
+from .workers import bounded_imap
+
+logger = logging.getLogger(__name__)
+
+
+class ClusterState(object):
+    """ Load of a cluster as seen by ClusterPool """
+    def __init__(self, name, server):
+        self.name = name
+        self.server = server
+        # Number of queued jobs at the last refresh
+        self.queue_depth = 0
+        # Jobs placed on the cluster since the last refresh
+        self.pending = 0
+        # Exponentially weighted moving average of request time, in seconds
+        self.latency = None
+        self.errors = 0
+        self.available = True
+        self.refreshed_at = None
+
+    @property
+    def load(self):
+        """ Queued jobs, including jobs placed since the last refresh """
+        return self.queue_depth + self.pending
+
+    def __repr__(self):
+        return "<ClusterState %s load=%s latency=%s available=%s>" % (self.name, self.load, self.latency,
+                                                                      self.available)
+
+
+class RoutingPolicy(object):
+    """ Chooses a cluster for a new job """
+    def choose(self, clusters, job_properties):
+        """
+        :param clusters: List of ClusterState of available clusters (not empty)
+        :param job_properties: Dictionary of properties of the new job
+        :return: ClusterState
+        """
+        raise NotImplementedError()
+
+
+class LeastLoadedPolicy(RoutingPolicy):
+    """ Cluster with the lowest queue_depth + latency_weight * latency (latency in seconds) """
+    def __init__(self, latency_weight=10.0):
+        self.latency_weight = latency_weight
+
+    def score(self, cluster):
+        return cluster.load + self.latency_weight * (cluster.latency or 0.0)
+
+    def choose(self, clusters, job_properties):
+        return min(clusters, key=self.score)
+
+
+class RoundRobinPolicy(RoutingPolicy):
+    """ Clusters in turn, ignoring their load """
+    def __init__(self):
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def choose(self, clusters, job_properties):
+        with self._lock:
+            cluster = clusters[self._next % len(clusters)]
+            self._next += 1
+        return cluster
+
+
+class ClusterPool(object):
+    """ Routes new jobs to clusters according to a RoutingPolicy (LeastLoadedPolicy by default) and forwards
+    operations on existing jobs to the cluster they were placed on. Thread-safe.
+
+    Queue depth of every cluster is the number of Queued jobs, refreshed every refresh_interval seconds.
+    Latency is measured by a hook added to every WebAPI instance.
+    """
+    def __init__(self, servers, policy=None, refresh_interval=30.0, latency_alpha=0.2, placements=None,
+                 queue_filter=None):
+        """
+        :param servers: Dictionary {cluster name: WebAPI}
+        :param policy: (optional) RoutingPolicy, default is LeastLoadedPolicy()
+        :param refresh_interval: Time (in seconds) queue depth of a cluster is considered current
+        :param latency_alpha: Weight of the most recent request in the latency moving average
+        :param placements: (optional) Dict-like object {job ID: (cluster name, job ID on the cluster)}
+        :param queue_filter: (optional) Get Job List query parameters selecting jobs counted as queue depth
+        """
+        self.clusters = {}
+        for name in servers:
+            if ":" in name:
+                raise ValueError("Cluster name can't contain ':' - %s" % name)
+            self.clusters[name] = ClusterState(name, servers[name])
+            servers[name].hooks.append(self._latency_hook(self.clusters[name]))
+        self.policy = policy if policy is not None else LeastLoadedPolicy()
+        self.refresh_interval = refresh_interval
+        self.latency_alpha = latency_alpha
+        self.placements = placements if placements is not None else {}
+        self.queue_filter = queue_filter if queue_filter is not None else {"JobState": "Queued"}
+        self._lock = threading.Lock()
+
+    def _latency_hook(self, cluster):
+        def hook(event):
+            with self._lock:
+                if event.error is not None or (event.status_code is not None and event.status_code >= 500):
+                    cluster.errors += 1
+                if cluster.latency is None:
+                    cluster.latency = event.request_time
+                else:
+                    cluster.latency += self.latency_alpha * (event.request_time - cluster.latency)
+        return hook
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Load tracking and routing
+    # ---------------------------------------------------------------------------------------------- #
+    def _refresh_cluster(self, cluster):
+        try:
+            queue_depth = sum(1 for job in cluster.server.iter_jobs(filter=self.queue_filter,
+                                                                    requested_properties=["Id"]))
+        except Exception as e:
+            logger.warning("Cluster %s is not available: %s", cluster.name, e)
+            with self._lock:
+                cluster.available = False
+                cluster.refreshed_at = time.time()
+            return
+        with self._lock:
+            cluster.queue_depth = queue_depth
+            cluster.pending = 0
+            cluster.available = True
+            cluster.refreshed_at = time.time()
+
+    def refresh(self, force=False):
+        """ Update queue depth of clusters, in parallel
+        :param force: Refresh all clusters, even if their queue depth is current
+        """
+        now = time.time()
+        clusters = [cluster for cluster in self.clusters.values()
+                    if force or cluster.refreshed_at is None or now - cluster.refreshed_at >= self.refresh_interval]
+        list(bounded_imap(self._refresh_cluster, clusters, len(clusters) or 1))
+
+    def choose_cluster(self, job_properties=None):
+        """ Cluster for a new job, according to the policy
+        :return: ClusterState
+        """
+        self.refresh()
+        available = [cluster for cluster in self.clusters.values() if cluster.available]
+        if not available:
+            # Try all clusters rather than fail without sending a request
+            available = list(self.clusters.values())
+        return self.policy.choose(sorted(available, key=lambda cluster: cluster.name), job_properties or {})
+
+    def stats(self):
+        """ Load of clusters
+        :return: Dictionary {cluster name: {"queue_depth", "pending", "latency", "errors", "available"}}
+        """
+        with self._lock:
+            return dict((cluster.name, {"queue_depth": cluster.queue_depth,
+                                        "pending": cluster.pending,
+                                        "latency": cluster.latency,
+                                        "errors": cluster.errors,
+                                        "available": cluster.available})
+                        for cluster in self.clusters.values())
+
+    def locate(self, job_id):
+        """ Cluster and local job ID of a job created by the pool
+        :param job_id: Job ID returned by create_job ("<cluster name>:<job ID>")
+        :raises: KeyError if cluster is not in the pool
+        :return: (WebAPI, job ID on the cluster) tuple
+        """
+        placement = self.placements.get(job_id)
+        if placement is None:
+            placement = ("%s" % job_id).rpartition(":")[::2]
+        return self.clusters[placement[0]].server, placement[1]
+
+    def _place(self, cluster, local_job_id):
+        job_id = "%s:%s" % (cluster.name, local_job_id)
+        self.placements[job_id] = (cluster.name, local_job_id)
+        with self._lock:
+            cluster.pending += 1
+        return job_id
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Job creation
+    # ---------------------------------------------------------------------------------------------- #
+    def create_job(self, **properties):
+        """ Create a new job on the cluster chosen by the policy, see WebAPI.create_job
+        :return: Job ID ("<cluster name>:<job ID>"), None if job creation failed
+        """
+        cluster = self.choose_cluster(properties)
+        local_job_id = cluster.server.create_job(**properties)
+        if local_job_id is None:
+            return None
+        return self._place(cluster, local_job_id)
+
+    def create_job_with_tasks(self, tasks, job_properties=None, concurrency=8, from_xml=False):
+        """ Create a new job with tasks on the cluster chosen by the policy, see WebAPI.create_job_with_tasks
+        :return: (job_id, list of TaskResult) tuple, job_id is None if job creation failed
+        """
+        cluster = self.choose_cluster(job_properties)
+        local_job_id, results = cluster.server.create_job_with_tasks(tasks, job_properties, concurrency=concurrency,
+                                                                     from_xml=from_xml)
+        if local_job_id is None:
+            return None, results
+        return self._place(cluster, local_job_id), results
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Operations on existing jobs, forwarded to the cluster the job was placed on
+    # ---------------------------------------------------------------------------------------------- #
+    def add_task(self, job_id, **properties):
+        server, local_job_id = self.locate(job_id)
+        return server.add_task(local_job_id, **properties)
+
+    def add_tasks(self, job_id, tasks, concurrency=8):
+        server, local_job_id = self.locate(job_id)
+        return server.add_tasks(local_job_id, tasks, concurrency=concurrency)
+
+    def cancel_job(self, job_id, forced=False, message=""):
+        server, local_job_id = self.locate(job_id)
+        return server.cancel_job(local_job_id, forced=forced, message=message)
+
+    def get_job(self, job_id, requested_properties=None):
+        server, local_job_id = self.locate(job_id)
+        return server.get_job(local_job_id, requested_properties)
+
+    def get_job_property(self, job_id, property_name):
+        server, local_job_id = self.locate(job_id)
+        return server.get_job_property(local_job_id, property_name)
+
+    def get_task(self, job_id, task_id, requested_properties=None):
+        server, local_job_id = self.locate(job_id)
+        return server.get_task(local_job_id, task_id, requested_properties)
+
+    def iter_tasks(self, job_id, requested_properties=None, filter=None):
+        server, local_job_id = self.locate(job_id)
+        return server.iter_tasks(local_job_id, requested_properties, filter)
+
+    def requeue_job(self, job_id):
+        server, local_job_id = self.locate(job_id)
+        return server.requeue_job(local_job_id)
+
+    def set_job_properties(self, job_id, **properties):
+        server, local_job_id = self.locate(job_id)
+        return server.set_job_properties(local_job_id, **properties)
+
+    def submit_job(self, job_id, **properties):
+        server, local_job_id = self.locate(job_id)
+        return server.submit_job(local_job_id, **properties)
+
+    def wait_for_job(self, job_id, timeout=None, requested_properties=None, **kwargs):
+        server, local_job_id = self.locate(job_id)
+        return server.wait_for_job(local_job_id, timeout=timeout, requested_properties=requested_properties,
+                                   **kwargs)
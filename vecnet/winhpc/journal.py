@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Local SQLite journal of bulk submissions (create_job, add_task, submit_job), so that a submission
+interrupted by a crash can be resumed with only the missing requests.
+
+    journal = SubmissionJournal("submissions.db")
+    submission_id, job_id = journal.submit(server, task_generator, {"Name": "Large job"})
+
+    # After a crash
+    for submission_id in journal.pending():
+        journal.resume(server, submission_id)
+
+Tasks added by the server, but not recorded in the journal before the crash, are found by comparing Name and
+CommandLine of tasks in the job with the intended tasks, so they are not added twice. A job created just
+before the crash, but not recorded, can't be found this way and is created again.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+# Number of tasks added to a job between journal commits
+CHUNK_SIZE = 500
+
+# Submission states
+PENDING = "pending"
+CREATED = "created"
+SUBMITTED = "submitted"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_properties TEXT NOT NULL,
+    job_id TEXT,
+    state TEXT NOT NULL,
+    submit INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    submission_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    properties TEXT NOT NULL,
+    task_id TEXT,
+    error TEXT,
+    PRIMARY KEY (submission_id, seq)
+);
+"""
+
+
+def _get(properties, name):
+    # Property names are case insensitive (commandLine, CommandLine)
+    for key in properties:
+        if key.lower() == name.lower():
+            return "%s" % properties[key]
+    return None
+
+
+class SubmissionJournal(object):
+    """ Record of intended tasks, IDs returned by the server and state of every submission.
+    Tasks are inserted once; task IDs, errors and submission state are updated in place as requests complete.
+    """
+    def __init__(self, path):
+        """
+        :param path: Path to SQLite database file (created if it doesn't exist)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            with self.db:
+                return self.db.execute(sql, params)
+
+    def _set_state(self, submission_id, state, job_id=None):
+        if job_id is None:
+            self._execute("UPDATE submissions SET state = ?, updated_at = ? WHERE id = ?",
+                          (state, time.time(), submission_id))
+        else:
+            self._execute("UPDATE submissions SET state = ?, job_id = ?, updated_at = ? WHERE id = ?",
+                          (state, "%s" % job_id, time.time(), submission_id))
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Journal contents
+    # ---------------------------------------------------------------------------------------------- #
+    def record(self, tasks, job_properties=None, submit=True):
+        """ Record intended submission without sending any requests (see resume)
+        :param tasks: Iterable of dictionaries with task properties
+        :param job_properties: (optional) Dictionary of job properties
+        :param submit: Submit the job after all tasks are added
+        :return: Submission ID
+        """
+        now = time.time()
+        with self._lock:
+            with self.db:
+                cursor = self.db.execute(
+                    "INSERT INTO submissions (job_properties, state, submit, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (json.dumps(job_properties or {}), PENDING, 1 if submit else 0, now, now))
+                submission_id = cursor.lastrowid
+                self.db.executemany("INSERT INTO tasks (submission_id, seq, properties) VALUES (?, ?, ?)",
+                                    ((submission_id, seq, json.dumps(properties))
+                                     for seq, properties in enumerate(tasks)))
+        return submission_id
+
+    def pending(self):
+        """ IDs of submissions that are not finished """
+        return [row[0] for row in self._execute(
+            "SELECT id FROM submissions WHERE state != ? ORDER BY id", (SUBMITTED,)).fetchall()]
+
+    def status(self, submission_id):
+        """ State of a submission
+        :return: Dictionary with "job_id", "state", "tasks", "added" and "failed" keys, None if not found
+        """
+        row = self._execute("SELECT job_id, state FROM submissions WHERE id = ?", (submission_id,)).fetchone()
+        if row is None:
+            return None
+        counts = self._execute(
+            "SELECT COUNT(*), COUNT(task_id), SUM(CASE WHEN error IS NOT NULL THEN 1 ELSE 0 END) "
+            "FROM tasks WHERE submission_id = ?", (submission_id,)).fetchone()
+        return {"job_id": row[0], "state": row[1], "tasks": counts[0], "added": counts[1], "failed": counts[2] or 0}
+
+    def task_ids(self, submission_id):
+        """ Task IDs in the order tasks were recorded (None for tasks not added yet) """
+        return [row[0] for row in self._execute(
+            "SELECT task_id FROM tasks WHERE submission_id = ? ORDER BY seq", (submission_id,)).fetchall()]
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Submission
+    # ---------------------------------------------------------------------------------------------- #
+    def submit(self, server, tasks, job_properties=None, submit=True, concurrency=8):
+        """ Record the submission and execute it
+        :param server: WebAPI instance
+        :param tasks: Iterable of dictionaries with task properties
+        :param job_properties: (optional) Dictionary of job properties
+        :param submit: Submit the job after all tasks are added
+        :param concurrency: Maximum number of add_task requests in flight
+        :return: (submission ID, job ID) tuple. Job ID is None if the job could not be created
+        """
+        submission_id = self.record(tasks, job_properties, submit)
+        return submission_id, self.resume(server, submission_id, concurrency=concurrency)
+
+    def resume(self, server, submission_id, concurrency=8, reconcile=True):
+        """ Send requests missing from the journal: create_job (if the job was not created), add_task for tasks
+        without task ID, set_task_environment_variables for tasks where it failed, and submit_job
+        :param server: WebAPI instance
+        :param submission_id: Submission ID
+        :param concurrency: Maximum number of add_task requests in flight
+        :param reconcile: Look for tasks added to the job, but not recorded in the journal
+        :raises: KeyError if submission is not found
+        :return: Job ID, None if the job could not be created
+        """
+        row = self._execute("SELECT job_properties, job_id, state, submit FROM submissions WHERE id = ?",
+                            (submission_id,)).fetchone()
+        if row is None:
+            raise KeyError("Submission %s not found" % submission_id)
+        job_properties, job_id, state, submit = json.loads(row[0]), row[1], row[2], row[3]
+        if state == SUBMITTED:
+            return job_id
+
+        if job_id is None:
+            job_id = server.create_job(**job_properties)
+            if job_id is None:
+                return None
+            self._set_state(submission_id, CREATED, job_id)
+        elif reconcile:
+            self._reconcile(server, submission_id, job_id)
+
+        self._retry_environment_variables(server, submission_id, job_id)
+        self._add_missing_tasks(server, submission_id, job_id, concurrency)
+
+        status = self.status(submission_id)
+        if submit and status["added"] == status["tasks"] and status["failed"] == 0:
+            if server.submit_job(job_id) or self._submitted_before(server, job_id):
+                self._set_state(submission_id, SUBMITTED)
+        return job_id
+
+    @staticmethod
+    def _submitted_before(server, job_id):
+        # Crash between successful submit_job and recording it: the job is already past Configuring
+        properties = server.get_job(job_id, ["State"])
+        return bool(properties) and properties.get("State") not in (None, "Configuring")
+
+    def _missing_tasks(self, submission_id):
+        return [(seq, json.loads(properties)) for seq, properties in self._execute(
+            "SELECT seq, properties FROM tasks WHERE submission_id = ? AND task_id IS NULL ORDER BY seq",
+            (submission_id,)).fetchall()]
+
+    def _add_missing_tasks(self, server, submission_id, job_id, concurrency):
+        missing = self._missing_tasks(submission_id)
+        for start in range(0, len(missing), CHUNK_SIZE):
+            chunk = missing[start:start + CHUNK_SIZE]
+            results = server.add_tasks(job_id, [properties for seq, properties in chunk], concurrency=concurrency)
+            with self._lock:
+                with self.db:
+                    self.db.executemany(
+                        "UPDATE tasks SET task_id = ?, error = ? WHERE submission_id = ? AND seq = ?",
+                        [(result.task_id, None if result.error is None else "%s" % result.error, submission_id, seq)
+                         for (seq, properties), result in zip(chunk, results)])
+
+    def _retry_environment_variables(self, server, submission_id, job_id):
+        # Tasks that were created, but setting their environment variables failed
+        rows = self._execute("SELECT seq, properties, task_id FROM tasks WHERE submission_id = ? "
+                             "AND task_id IS NOT NULL AND error IS NOT NULL", (submission_id,)).fetchall()
+        for seq, properties, task_id in rows:
+            variables = json.loads(properties).get("EnvironmentVariables")
+            if variables and server.set_task_environment_variables(job_id, task_id, **variables):
+                self._execute("UPDATE tasks SET error = NULL WHERE submission_id = ? AND seq = ?",
+                              (submission_id, seq))
+
+    def _reconcile(self, server, submission_id, job_id):
+        # Match tasks of the job, which are not recorded in the journal, with missing tasks by Name and CommandLine
+        recorded = set(task_id for task_id in self.task_ids(submission_id) if task_id is not None)
+        unrecorded = {}
+        for task in server.iter_tasks(job_id, ["TaskId", "Name", "CommandLine"]):
+            if task.get("TaskId") not in recorded:
+                key = (task.get("Name") or "", task.get("CommandLine") or "")
+                unrecorded.setdefault(key, []).append(task["TaskId"])
+        if not unrecorded:
+            return
+        updates = []
+        for seq, properties in self._missing_tasks(submission_id):
+            key = (_get(properties, "Name") or "", _get(properties, "CommandLine") or "")
+            if unrecorded.get(key):
+                task_id = unrecorded[key].pop(0)
+                # Environment variables might have not been set before the crash
+                error = "Not recorded" if properties.get("EnvironmentVariables") else None
+                updates.append((task_id, error, submission_id, seq))
+        with self._lock:
+            with self.db:
+                self.db.executemany("UPDATE tasks SET task_id = ?, error = ? WHERE submission_id = ? AND seq = ?",
+                                    updates)
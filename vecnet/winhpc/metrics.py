@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Request instrumentation for WebAPI.
+
+WebAPI calls every function in its hooks list with a RequestEvent after each request:
+    collector = MetricsCollector()
+    server = WebAPI(hostname, username, password, hooks=[collector])
+    ...
+    print(collector.to_json())
+"""
+import bisect
+import collections
+import json
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Path segments that are job, task or subtask IDs
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+_URL_PREFIX = re.compile(r"^[a-z]+://[^/]+/WindowsHPC/")
+
+# Upper bounds (in seconds) of latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class RequestEvent(collections.namedtuple("RequestEvent", [
+        "method", "endpoint", "url", "status_code", "bytes_sent", "bytes_received",
+        "request_time", "parse_time", "error"])):
+    """ Information about a single request to WinHPC WebAPI server
+    method: HTTP method (get, post or put)
+    endpoint: URL template without cluster name and IDs, for example Job/{id}/Tasks
+    url: Full URL of the request
+    status_code: HTTP status code, None if request could not be sent
+    bytes_sent: Size of request body
+    bytes_received: Size of response body
+    request_time: Time (in seconds) from sending the request to receiving the whole response. Waiting for
+                  the rate limiter and backoff between retries are not included
+    parse_time: Time (in seconds) spent parsing the response
+    error: Error message if request could not be sent, None otherwise
+    """
+    __slots__ = ()
+
+
+def endpoint_from_url(url):
+    """ URL template of the endpoint, e.g. https://head:443/WindowsHPC/CLUSTER//Job/12/Task/3?Properties=State
+    becomes Job/{id}/Task/{id}
+    """
+    path = url.split("?", 1)[0]
+    match = _URL_PREFIX.match(path)
+    if match is not None:
+        path = path[match.end():]
+        if path != "Clusters":
+            # Remove cluster name
+            path = path.partition("/")[2]
+    path = "/" + "/".join(segment for segment in path.split("/") if segment)
+    return _ID_SEGMENT.sub("/{id}", path)[1:]
+
+
+def emit(hooks, method, url, response):
+    """ Call every hook with RequestEvent of a completed request. Exceptions raised by hooks are logged
+    :param hooks: List of functions
+    :param method: HTTP method
+    :param url: URL of the request
+    :param response: transport.Response
+    """
+    event = RequestEvent(method=method,
+                         endpoint=endpoint_from_url(url),
+                         url=url,
+                         status_code=response.status_code,
+                         bytes_sent=response.bytes_sent,
+                         bytes_received=response.bytes_received,
+                         request_time=response.elapsed,
+                         parse_time=response.parse_time,
+                         error=response.error)
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception:
+            # Instrumentation must not break requests
+            logger.exception("Request hook %r failed", hook)
+
+
+def percentile(sorted_values, q):
+    """ q-th percentile (0 <= q <= 100) of a sorted list, nearest-rank method. None if the list is empty """
+    if not sorted_values:
+        return None
+    rank = int(round(q / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+class _EndpointStats(object):
+    def __init__(self, sample_size):
+        self.count = 0
+        self.errors = 0
+        self.request_time = 0.0
+        self.parse_time = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.status_codes = collections.defaultdict(int)
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        # Most recent latencies, used to calculate percentiles
+        self.samples = collections.deque(maxlen=sample_size)
+
+    def add(self, event):
+        self.count += 1
+        if event.error is not None or event.status_code != 200:
+            self.errors += 1
+        self.status_codes[event.status_code] += 1
+        self.request_time += event.request_time
+        self.parse_time += event.parse_time
+        self.bytes_sent += event.bytes_sent
+        self.bytes_received += event.bytes_received
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, event.request_time)] += 1
+        self.samples.append(event.request_time)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "status_codes": dict(("%s" % code, n) for code, n in self.status_codes.items()),
+            "request_time": self.request_time,
+            "parse_time": self.parse_time,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "p99": percentile(samples, 99),
+        }
+
+
+class MetricsCollector(object):
+    """ In-memory aggregator of RequestEvents: request counts, errors, bytes, latency histograms and
+    p50/p95/p99 latency per (method, endpoint). Thread-safe.
+    """
+    def __init__(self, sample_size=10000):
+        """
+        :param sample_size: Number of most recent requests per endpoint used to calculate percentiles
+        """
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, event):
+        key = (event.method, event.endpoint)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _EndpointStats(self.sample_size)
+            stats.add(event)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def summary(self):
+        """ Statistics per endpoint
+        :return: Dictionary {"METHOD endpoint": {"count": ..., "p50": ..., ...}}
+        """
+        with self._lock:
+            return dict(("%s %s" % (method.upper(), endpoint), stats.summary())
+                        for (method, endpoint), stats in self._stats.items())
+
+    def to_json(self, **kwargs):
+        """ Statistics per endpoint as JSON string (keyword arguments are passed to json.dumps) """
+        return json.dumps(self.summary(), sort_keys=True, **kwargs)
+
+    def to_prometheus(self, prefix="winhpc"):
+        """ Statistics in Prometheus text exposition format """
+        lines = [
+            "# TYPE %s_request_duration_seconds histogram" % prefix,
+        ]
+        with self._lock:
+            items = sorted(self._stats.items())
+            for (method, endpoint), stats in items:
+                labels = 'method="%s",endpoint="%s"' % (method.upper(), endpoint)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats.buckets):
+                    cumulative += count
+                    lines.append('%s_request_duration_seconds_bucket{%s,le="%s"} %d' %
+                                 (prefix, labels, bound, cumulative))
+                lines.append("%s_request_duration_seconds_sum{%s} %s" % (prefix, labels, stats.request_time))
+                lines.append("%s_request_duration_seconds_count{%s} %d" % (prefix, labels, stats.count))
+            lines.append("# TYPE %s_request_latency_seconds summary" % prefix)
+            for (method, endpoint), stats in items:
+                labels = 'method="%s",endpoint="%s"' % (method.upper(), endpoint)
+                samples = sorted(stats.samples)
+                for q in (50, 95, 99):
+                    value = percentile(samples, q)
+                    if value is not None:
+                        lines.append('%s_request_latency_seconds{%s,quantile="%s"} %s' %
+                                     (prefix, labels, q / 100.0, value))
+            for name, attribute in (("request_errors_total", "errors"),
+                                    ("request_bytes_sent_total", "bytes_sent"),
+                                    ("request_bytes_received_total", "bytes_received"),
+                                    ("response_parse_seconds_total", "parse_time")):
+                lines.append("# TYPE %s_%s counter" % (prefix, name))
+                for (method, endpoint), stats in items:
+                    labels = 'method="%s",endpoint="%s"' % (method.upper(), endpoint)
+                    lines.append("%s_%s{%s} %s" % (prefix, name, labels, getattr(stats, attribute)))
+        return "\n".join(lines) + "\n"
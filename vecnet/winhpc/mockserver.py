@@ -0,0 +1,561 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Local stand-in for HPC Web Service API, for benchmarks and offline testing.
+
+Jobs and tasks are kept in memory. A submitted job is Queued for queue_time seconds, then Running for run_time
+seconds, then Finished. Every request can be delayed (latency, latency_jitter) or rejected with error_status
+(error_rate), so retries and timeouts can be exercised without a real cluster.
+
+    with MockHPCServer(latency=0.005) as mock:
+        server = WebAPI(mock.host, "user", "password", **mock.webapi_kwargs())
+        job_id = server.create_job(Name="test")
+
+It can also be started as a separate process:
+    python -m vecnet.winhpc.mockserver --port 8080 --latency 0.005 --error-rate 0.01
+"""
+from __future__ import print_function
+import argparse
+import collections
+import random
+import ssl
+import sys
+import threading
+import time
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl, urlsplit
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl, urlsplit
+
+from . import xmlutils
+
+TERMINAL_STATES = ("Finished", "Failed", "Canceled")
+
+
+class MockError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def _capitalize(name):
+    # Property names are case insensitive, they are stored as in HpcJobXml (commandLine -> CommandLine)
+    return name[:1].upper() + name[1:]
+
+
+def _string_xml(value):
+    return (u"<string xmlns=\"http://schemas.microsoft.com/2003/10/Serialization/\">%s</string>" %
+            escape(u"%s" % value)).encode("utf-8")
+
+
+def _objects_xml(objects):
+    xml = [u"<ArrayOfObject xmlns=\"http://schemas.microsoft.com/HPCS2008R2/common\">"]
+    for properties in objects:
+        xml.append(u"<Object><Properties>")
+        for name in properties:
+            value = properties[name]
+            xml.append(u"<Property><Name>%s</Name><Value>%s</Value></Property>" %
+                       (escape(name), u"" if value is None else escape(u"%s" % value)))
+        xml.append(u"</Properties></Object>")
+    xml.append(u"</ArrayOfObject>")
+    return u"".join(xml).encode("utf-8")
+
+
+def _select(properties, requested):
+    # Subset of properties requested by comma-separated list of names (case insensitive)
+    if not requested:
+        return properties
+    by_name = dict((name.lower(), name) for name in properties)
+    selected = collections.OrderedDict()
+    for name in requested.split(","):
+        name = name.strip()
+        if name:
+            selected[by_name.get(name.lower(), name)] = properties.get(by_name.get(name.lower()))
+    return selected
+
+
+class _Job(object):
+    def __init__(self, job_id, properties):
+        self.id = job_id
+        self.properties = properties
+        self.env = {}
+        self.custom = {}
+        self.tasks = collections.OrderedDict()
+        self.submitted_at = None
+        self.next_task_id = 1
+
+
+class MockHPCServer(object):
+    """ In-process HTTP(S) server implementing the subset of HPC Web Service API used by WebAPI:
+    clusters, version, active head node, jobs (create, create from XML, list, get, set properties, submit,
+    cancel, requeue, environment variables, custom properties) and tasks (add, list, get, set properties,
+    cancel, environment variables, subtasks).
+    """
+    def __init__(self,
+                 host="127.0.0.1",
+                 port=0,
+                 cluster_name="MOCKCLUSTER",
+                 version="3.0.0000.0",
+                 latency=0.0,
+                 latency_jitter=0.0,
+                 error_rate=0.0,
+                 error_status=503,
+                 retry_after=None,
+                 queue_time=0.0,
+                 run_time=1.0,
+                 page_size=1000,
+                 certfile=None,
+                 keyfile=None,
+                 seed=None):
+        """
+        :param host: Address to listen on
+        :param port: Port to listen on, 0 to choose a free port
+        :param cluster_name: Name of the mock HPC cluster
+        :param version: HPC Pack version returned by Version operation
+        :param latency: Delay before every response, in seconds
+        :param latency_jitter: Random additional delay (0..latency_jitter), in seconds
+        :param error_rate: Probability of rejecting a request with error_status, without processing it
+        :param error_status: HTTP status of injected errors
+        :param retry_after: (optional) Value of Retry-After header of injected errors
+        :param queue_time: Time a submitted job spends in Queued state, in seconds
+        :param run_time: Time a job spends in Running state, in seconds
+        :param page_size: Maximum number of objects returned by Get Job List and Get Task List
+        :param certfile: (optional) Certificate file; if specified, server uses HTTPS
+        :param keyfile: (optional) Private key file for certfile
+        :param seed: (optional) Seed of random number generator used for latency jitter and error injection
+        """
+        self.host = host
+        self.port = port
+        self.cluster_name = cluster_name
+        self.version = version
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.queue_time = queue_time
+        self.run_time = run_time
+        self.page_size = page_size
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.scheme = "https" if certfile is not None else "http"
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self.reset()
+
+    def reset(self):
+        """ Remove all jobs and reset request counters """
+        with self._lock:
+            self.jobs = collections.OrderedDict()
+            self.next_job_id = 1
+            self.requests = 0
+            self.errors_injected = 0
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Server lifecycle
+    # ---------------------------------------------------------------------------------------------- #
+    def start(self):
+        """ Start serving requests in a background thread """
+        server = self
+
+        class Handler(_Handler):
+            mock = server
+
+        self._httpd = _ThreadingHTTPServer((self.host, self.port), Handler)
+        if self.certfile is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.load_cert_chain(self.certfile, self.keyfile)
+            self._httpd.socket = context.wrap_socket(self._httpd.socket, server_side=True)
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        return "%s://%s:%s/WindowsHPC/" % (self.scheme, self.host, self.port)
+
+    def webapi_kwargs(self):
+        """ Keyword arguments for WebAPI constructor (port, scheme and hpc_cluster_name) """
+        return {"port": self.port, "scheme": self.scheme, "hpc_cluster_name": self.cluster_name}
+
+    def stats(self):
+        """ Number of requests, injected errors, jobs and tasks """
+        with self._lock:
+            return {"requests": self.requests,
+                    "errors_injected": self.errors_injected,
+                    "jobs": len(self.jobs),
+                    "tasks": sum(len(job.tasks) for job in self.jobs.values())}
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Request processing
+    # ---------------------------------------------------------------------------------------------- #
+    def handle(self, method, path, body):
+        """ Process a request
+        :param method: HTTP method
+        :param path: Path and query string of the request
+        :param body: Request body (bytes)
+        :return: (status, response body, dictionary of headers) tuple
+        """
+        with self._lock:
+            self.requests += 1
+            inject_error = self.error_rate > 0 and self._random.random() < self.error_rate
+            delay = self.latency
+            if self.latency_jitter > 0:
+                delay += self._random.uniform(0, self.latency_jitter)
+            if inject_error:
+                self.errors_injected += 1
+        if delay > 0:
+            time.sleep(delay)
+        if inject_error:
+            headers = {}
+            if self.retry_after is not None:
+                headers["Retry-After"] = "%s" % self.retry_after
+            return self.error_status, _string_xml("Injected error"), headers
+
+        parts = urlsplit(path)
+        # Query parameter names are case insensitive
+        query = dict((name.lower(), value) for name, value in parse_qsl(parts.query))
+        segments = [segment for segment in parts.path.split("/") if segment]
+        try:
+            if len(segments) < 2 or segments[0] != "WindowsHPC":
+                raise MockError(404, "Not found")
+            if segments[1] == "Clusters":
+                return 200, _objects_xml([{"Name": self.cluster_name}]), {}
+            if segments[1] != self.cluster_name:
+                raise MockError(404, "Cluster %s not found" % segments[1])
+            with self._lock:
+                return self._route(method.lower(), segments[2:], query, body)
+        except MockError as e:
+            return e.status, _string_xml(e), {}
+        except ElementTree.ParseError as e:
+            return 400, _string_xml("Malformed XML: %s" % e), {}
+
+    def _route(self, method, segments, query, body):
+        if segments == ["Version"] and method == "get":
+            return 200, _string_xml(self.version), {}
+        if segments == ["ActiveHeadnode"] and method == "get":
+            return 200, _string_xml(self.host), {}
+        if segments == ["Jobs"]:
+            if method == "post":
+                return 200, _string_xml(self._create_job(xmlutils.parse_properties(body))), {}
+            if method == "get":
+                jobs = self.jobs.values()
+                if "jobstate" in query:
+                    states = set(query["jobstate"].split(","))
+                    jobs = [job for job in jobs if self._job_properties(job)["State"] in states]
+                return self._page([self._job_properties(job) for job in jobs], query)
+        if segments == ["Jobs", "JobFile"] and method == "post":
+            return 200, _string_xml(self._create_job_from_xml(body)), {}
+        if len(segments) < 2 or segments[0] != "Job":
+            raise MockError(404, "Not found")
+
+        job = self._get_job(segments[1])
+        action = segments[2:]
+        if not action:
+            if method == "get":
+                if query.get("render", "").lower() == "hpcjobxml":
+                    tasks = [task for task in job.tasks.values()]
+                    return 200, xmlutils.JobXml(job.properties, tasks).to_bytes(), {}
+                return self._properties(_select(self._job_properties(job), query.get("properties")))
+            if method == "put":
+                self._update(job.properties, xmlutils.parse_properties(body))
+                return 200, b"", {}
+        elif action == ["Submit"] and method == "post":
+            if job.submitted_at is not None:
+                raise MockError(400, "Job %s has already been submitted" % job.id)
+            self._update(job.properties, xmlutils.parse_properties(body) if body else {})
+            self._submit(job)
+            return 200, b"", {}
+        elif action == ["Cancel"] and method == "post":
+            state = self._job_properties(job)["State"]
+            if state in TERMINAL_STATES:
+                raise MockError(400, "Job %s is %s" % (job.id, state))
+            job.properties["State"] = "Canceled"
+            return 200, b"", {}
+        elif action == ["Requeue"] and method == "post":
+            if self._job_properties(job)["State"] not in ("Canceled", "Failed"):
+                raise MockError(400, "Only Canceled or Failed jobs can be requeued")
+            for task in job.tasks.values():
+                task.pop("State", None)
+            self._submit(job)
+            return 200, b"", {}
+        elif action == ["EnvVariables"]:
+            return self._variables(job.env, method, query.get("properties") or query.get("names"), body)
+        elif action == ["CustomProperties"] and method == "get":
+            return self._properties(_select(job.custom, query.get("names")))
+        elif action == ["Custom"] and method == "post":
+            job.custom.update(xmlutils.parse_properties(body))
+            return 200, b"", {}
+        elif action == ["Tasks"]:
+            if method == "post":
+                return 200, _string_xml(self._add_task(job, xmlutils.parse_properties(body))), {}
+            if method == "get":
+                return self._page([self._task_properties(job, task) for task in job.tasks.values()], query)
+        elif len(action) >= 2 and action[0] == "Task":
+            return self._route_task(method, job, action[1], action[2:], query, body)
+        raise MockError(404, "Not found")
+
+    def _route_task(self, method, job, task_id, action, query, body):
+        task = job.tasks.get(task_id)
+        if task is None:
+            raise MockError(404, "Task %s not found" % task_id)
+        if not action:
+            if method == "get":
+                return self._properties(_select(self._task_properties(job, task), query.get("properties")))
+            if method == "put":
+                self._update(task, xmlutils.parse_properties(body))
+                return 200, b"", {}
+        elif action == ["Cancel"] and method == "post":
+            if self._task_properties(job, task)["State"] in TERMINAL_STATES:
+                raise MockError(400, "Task %s is finished" % task_id)
+            task["State"] = "Canceled"
+            return 200, b"", {}
+        elif action == ["EnvVariables"]:
+            env = task.setdefault("EnvironmentVariables", {})
+            return self._variables(env, method, query.get("names") or query.get("properties"), body)
+        elif len(action) == 2 and action[0] == "SubTask" and method == "get":
+            properties = collections.OrderedDict([("SubTaskId", action[1]),
+                                                  ("State", self._task_properties(job, task)["State"])])
+            return self._properties(_select(properties, query.get("properties")))
+        raise MockError(404, "Not found")
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Jobs and tasks
+    # ---------------------------------------------------------------------------------------------- #
+    @staticmethod
+    def _update(target, properties):
+        for name in properties:
+            target[_capitalize(name)] = properties[name]
+
+    def _get_job(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise MockError(404, "Job %s not found" % job_id)
+        return job
+
+    def _create_job(self, properties):
+        job_id = "%s" % self.next_job_id
+        self.next_job_id += 1
+        job = _Job(job_id, collections.OrderedDict([
+            ("Id", job_id),
+            ("Name", ""),
+            ("Owner", "MOCK\\user"),
+            ("Priority", "Normal"),
+            ("State", "Configuring"),
+            ("CreateTime", time.strftime("%Y-%m-%dT%H:%M:%S")),
+            ("SubmitTime", None),
+        ]))
+        self._update(job.properties, properties)
+        self.jobs[job_id] = job
+        return job_id
+
+    def _create_job_from_xml(self, body):
+        root = ElementTree.fromstring(body)
+        job_id = self._create_job(dict((name, value) for name, value in root.attrib.items()))
+        job = self.jobs[job_id]
+        for element in root.iter():
+            tag = element.tag.rpartition("}")[2]
+            if tag == "Task":
+                properties = dict(element.attrib)
+                variables = self._xml_variables(element)
+                if variables:
+                    properties["EnvironmentVariables"] = variables
+                self._add_task(job, properties)
+        job.env.update(self._xml_variables(root))
+        return job_id
+
+    @staticmethod
+    def _xml_variables(element):
+        variables = {}
+        for child in element:
+            if child.tag.rpartition("}")[2] == "EnvironmentVariables":
+                for variable in child:
+                    name = value = None
+                    for field in variable:
+                        field_tag = field.tag.rpartition("}")[2]
+                        if field_tag == "Name":
+                            name = field.text
+                        elif field_tag == "Value":
+                            value = field.text
+                    variables[name] = value
+        return variables
+
+    def _add_task(self, job, properties):
+        if job.submitted_at is not None and self._job_properties(job)["State"] in TERMINAL_STATES:
+            raise MockError(400, "Job %s is finished" % job.id)
+        task_id = "%s" % job.next_task_id
+        job.next_task_id += 1
+        task = collections.OrderedDict([("TaskId", task_id), ("Name", ""), ("CommandLine", "")])
+        self._update(task, properties)
+        job.tasks[task_id] = task
+        return task_id
+
+    def _submit(self, job):
+        job.submitted_at = time.time()
+        job.properties["State"] = "Queued"
+        job.properties["SubmitTime"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    def _job_properties(self, job):
+        properties = job.properties
+        if job.submitted_at is not None and properties["State"] in ("Queued", "Running"):
+            elapsed = time.time() - job.submitted_at
+            if elapsed >= self.queue_time + self.run_time:
+                properties["State"] = "Finished"
+            elif elapsed >= self.queue_time:
+                properties["State"] = "Running"
+        return properties
+
+    def _task_properties(self, job, task):
+        properties = collections.OrderedDict(
+            (name, value) for name, value in task.items() if name != "EnvironmentVariables")
+        if "State" not in properties:
+            properties["State"] = self._job_properties(job)["State"]
+        return properties
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Responses
+    # ---------------------------------------------------------------------------------------------- #
+    @staticmethod
+    def _properties(properties):
+        xml = [u"<ArrayOfProperty xmlns=\"http://schemas.microsoft.com/HPCS2008R2/common\" "
+               u"xmlns:i=\"http://www.w3.org/2001/XMLSchema-instance\">"]
+        for name in properties:
+            value = properties[name]
+            if value is None:
+                xml.append(u"<Property><Name>%s</Name><Value i:nil=\"true\" /></Property>" % escape(name))
+            else:
+                xml.append(u"<Property><Name>%s</Name><Value>%s</Value></Property>" %
+                           (escape(name), escape(u"%s" % value)))
+        xml.append(u"</ArrayOfProperty>")
+        return 200, u"".join(xml).encode("utf-8"), {}
+
+    def _variables(self, variables, method, requested, body):
+        if method == "get":
+            return self._properties(_select(variables, requested))
+        if method == "post":
+            variables.update(xmlutils.parse_properties(body))
+            return 200, b"", {}
+        raise MockError(405, "Method not allowed")
+
+    def _page(self, objects, query):
+        # Continuation token is the offset of the next page
+        requested = query.get("properties")
+        offset = int(query.get("queryid") or 0)
+        page = objects[offset:offset + self.page_size]
+        headers = {}
+        if offset + self.page_size < len(objects):
+            headers["x-ms-continuation-QueryId"] = "%s" % (offset + self.page_size)
+        return 200, _objects_xml([_select(properties, requested) for properties in page]), headers
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Default backlog (5) delays connections when many clients connect at once
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive connections, as with IIS
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, with Nagle's algorithm each response would wait for delayed ACK
+    disable_nagle_algorithm = True
+    mock = None
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _process(self):
+        body = self._read_body()
+        status, response_body, headers = self.mock.handle(self.command, self.path, body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml; charset=utf-8")
+        self.send_header("Content-Length", "%d" % len(response_body))
+        for name in headers:
+            self.send_header(name, headers[name])
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    do_GET = do_POST = do_PUT = _process
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock HPC Web Service API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--cluster-name", default="MOCKCLUSTER")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--queue-time", type=float, default=0.0)
+    parser.add_argument("--run-time", type=float, default=1.0)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    args = parser.parse_args()
+
+    mock = MockHPCServer(host=args.host, port=args.port, cluster_name=args.cluster_name,
+                         latency=args.latency, latency_jitter=args.latency_jitter,
+                         error_rate=args.error_rate, error_status=args.error_status,
+                         queue_time=args.queue_time, run_time=args.run_time, page_size=args.page_size,
+                         certfile=args.certfile, keyfile=args.keyfile)
+    mock.start()
+    # First line of output is used by benchmarks to find the port
+    print(mock.url)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Requests of HPC Web Service API operations, shared by WebAPI and AsyncWebAPI.
+
+Every function returns an Operation: HTTP method, path relative to the cluster URL (WebAPI.base_url), request
+body, additional headers, whether the request can be safely repeated, and parser of a successful response.
+The clients only send operations and handle the results:
+    r = server.send_operation(operations.get_job(job_id, ["State"]))
+    properties = r.value if r.ok else None
+
+HPC Web Service API Reference: http://msdn.microsoft.com/en-us/library/hh560258(v=vs.85).aspx
+"""
+from collections import namedtuple
+
+from . import xmlutils
+
+
+class Operation(namedtuple("Operation", ["method", "path", "data", "headers", "idempotent", "parser"])):
+    """ A single request of HPC Web Service API
+    method: HTTP method (get, post or put)
+    path: URL path and query string, relative to the cluster URL
+    data: Request body (None for GET requests)
+    headers: Additional headers, None if not needed
+    idempotent: True if request can be safely repeated (see retry.RetryPolicy)
+    parser: Function parsing body of a successful response, None if the body is not needed
+    """
+    __slots__ = ()
+
+
+def _operation(method, path, data=None, headers=None, idempotent=None, parser=None):
+    if idempotent is None:
+        idempotent = method in ("get", "put")
+    return Operation(method, path, data, headers, idempotent, parser)
+
+
+def names_to_string(names):
+    """ Comma separated list of property (or environment variable) names for a query string """
+    assert isinstance(names, list)
+    return ",".join(names)
+
+
+def _with_names(path, parameter, names):
+    if names is None:
+        return path
+    return path + "?%s=%s" % (parameter, names_to_string(names))
+
+
+def _message_xml(message):
+    return "<string xmlns=\"http://schemas.microsoft.com/2003/10/Serialization/\">%s</string>" % message
+
+
+def clusters_url(scheme, host, port):
+    """ URL of Get Cluster Name operation, the only operation that does not belong to a cluster """
+    # http://msdn.microsoft.com/en-us/library/hh770490(v=vs.85).aspx
+    return "%s://%s:%s/WindowsHPC/Clusters" % (scheme, host, port)
+
+
+def split_environment_variables(properties):
+    """ Task properties without "EnvironmentVariables", and environment variables (dictionary or None).
+    Environment variables of a task are set by a separate request after the task is created
+    """
+    properties = dict(properties)
+    return properties, properties.pop("EnvironmentVariables", None)
+
+
+def add_task(job_id, properties):
+    # Adds a task to a job, response is the task ID
+    # http://msdn.microsoft.com/en-us/library/hh560262(v=vs.85).aspx
+    return _operation("post", "/Job/%s/Tasks" % job_id, xmlutils.properties_to_xml(properties),
+                      parser=xmlutils.parse_string)
+
+
+def cancel_job(job_id, forced=False, message=""):
+    # http://msdn.microsoft.com/en-us/library/hh560253(v=vs.85).aspx
+    return _operation("post", "/Job/%s/Cancel" % job_id, _message_xml(message),
+                      headers={"forced": "%s" % bool(forced)}, idempotent=True)
+
+
+def cancel_task(job_id, task_id, forced=False, message=""):
+    # http://msdn.microsoft.com/en-us/library/hh560264(v=vs.85).aspx
+    path = "Job/%s/Task/%s/Cancel" % (job_id, task_id)
+    if forced:
+        path += "?Forced=True"
+    return _operation("post", path, _message_xml(message), idempotent=True)
+
+
+def create_job(properties):
+    # Creates a new job, response is the job ID
+    # http://msdn.microsoft.com/en-us/library/hh560265(v=vs.85).aspx
+    return _operation("post", "/Jobs", xmlutils.properties_to_xml(properties), parser=xmlutils.parse_string)
+
+
+def create_job_from_xml(xml):
+    # Creates a new job from job XML (string, bytes or iterable of bytes), response is the job ID
+    # http://msdn.microsoft.com/en-us/library/hh560266(v=vs.85).aspx
+    return _operation("post", "Jobs/JobFile", xml, parser=xmlutils.parse_string)
+
+
+def get_active_head_node():
+    # http://msdn.microsoft.com/en-us/library/dn275935(v=vs.85).aspx
+    return _operation("get", "ActiveHeadnode", parser=xmlutils.parse_string)
+
+
+def get_job(job_id, requested_properties=None):
+    # http://msdn.microsoft.com/en-us/library/hh529653(v=vs.85).aspx
+    return _operation("get", _with_names("Job/%s" % job_id, "properties", requested_properties),
+                      parser=xmlutils.parse_properties)
+
+
+def get_job_as_xml(job_id):
+    # Job in the format of Create Job From XML operation, response body is returned as is
+    # http://msdn.microsoft.com/en-us/library/hh529653(v=vs.85).aspx
+    return _operation("get", "Job/%s?Render=HpcJobXml" % job_id)
+
+
+def get_job_custom_properties(job_id, requested_properties=None):
+    # http://msdn.microsoft.com/en-us/library/hh560267(v=vs.85).aspx
+    return _operation("get", _with_names("Job/%s/CustomProperties" % job_id, "Names", requested_properties),
+                      parser=xmlutils.parse_properties)
+
+
+def get_job_environment_variables(job_id, requested_variables=None):
+    # http://msdn.microsoft.com/en-us/library/hh560268(v=vs.85).aspx
+    return _operation("get", _with_names("Job/%s/EnvVariables" % job_id, "properties", requested_variables),
+                      parser=xmlutils.parse_properties)
+
+
+def get_subtask(job_id, task_id, subtask_id, requested_properties=None):
+    # http://msdn.microsoft.com/en-us/library/hh529655(v=vs.85).aspx
+    return _operation("get", _with_names("Job/%s/Task/%s/SubTask/%s" % (job_id, task_id, subtask_id),
+                                         "Properties", requested_properties),
+                      parser=xmlutils.parse_properties)
+
+
+def get_subtask_as_xml(job_id, task_id, subtask_id):
+    # http://msdn.microsoft.com/en-us/library/hh529655(v=vs.85).aspx
+    return _operation("get", "Job/%s/Task/%s/SubTask/%s?Render=HpcJobXml" % (job_id, task_id, subtask_id))
+
+
+def get_task(job_id, task_id, requested_properties=None):
+    # http://msdn.microsoft.com/en-us/library/hh529656(v=vs.85).aspx
+    return _operation("get", _with_names("Job/%s/Task/%s" % (job_id, task_id), "Properties", requested_properties),
+                      parser=xmlutils.parse_properties)
+
+
+def get_task_environment_variables(job_id, task_id, requested_variables=None):
+    # http://msdn.microsoft.com/en-us/library/hh529657(v=vs.85).aspx
+    return _operation("get", _with_names("Job/%s/Task/%s/EnvVariables" % (job_id, task_id), "Names",
+                                         requested_variables),
+                      parser=xmlutils.parse_properties)
+
+
+def get_version():
+    # http://msdn.microsoft.com/en-us/library/hh560257(v=vs.85).aspx
+    return _operation("get", "Version", parser=xmlutils.parse_string)
+
+
+def requeue_job(job_id):
+    # Only jobs that are in the Canceled or Failed state can be requeued
+    # http://msdn.microsoft.com/en-us/library/hh529659(v=vs.85).aspx
+    return _operation("post", "Job/%s/Requeue" % job_id,
+                      '<ArrayOfProperty xmlns="http://schemas.microsoft.com/HPCS2008R2/common" />', idempotent=True)
+
+
+def set_job_environment_variables(job_id, variables):
+    # http://msdn.microsoft.com/en-us/library/hh529663(v=vs.85).aspx
+    return _operation("post", "Job/%s/EnvVariables" % job_id, xmlutils.properties_to_xml(variables),
+                      idempotent=True)
+
+
+def set_job_properties(job_id, properties):
+    # http://msdn.microsoft.com/en-us/library/hh529664(v=vs.85).aspx
+    return _operation("put", "Job/%s" % job_id, xmlutils.properties_to_xml(properties))
+
+
+def set_job_custom_properties(job_id, properties):
+    # http://msdn.microsoft.com/en-us/library/hh529662(v=vs.85).aspx
+    return _operation("post", "Job/%s/Custom" % job_id, xmlutils.properties_to_xml(properties), idempotent=True)
+
+
+def set_task_environment_variables(job_id, task_id, variables):
+    # http://msdn.microsoft.com/en-us/library/hh529665(v=vs.85).aspx
+    return _operation("post", "/Job/%s/Task/%s/EnvVariables" % (job_id, task_id),
+                      xmlutils.properties_to_xml(variables), idempotent=True)
+
+
+def set_task_properties(job_id, task_id, properties):
+    # http://msdn.microsoft.com/en-us/library/hh529667(v=vs.85).aspx
+    return _operation("put", "Job/%s/Task/%s" % (job_id, task_id), xmlutils.properties_to_xml(properties))
+
+
+def submit_job(job_id, properties=None):
+    # http://msdn.microsoft.com/en-us/library/hh560265(v=vs.85).aspx
+    return _operation("post", "/Job/%s/Submit" % job_id, xmlutils.properties_to_xml(properties or {}),
+                      idempotent=True)
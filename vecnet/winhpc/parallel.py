@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Bulk operations executed by a pool of worker processes.
+
+Above a few thousand tasks per second WebAPI is limited by XML serialization and parsing, which can't run
+in parallel threads because of the GIL. ProcessPoolWebAPI splits task and ID lists into shards, processes
+every shard in a worker process with its own WebAPI instance (and its own connection pool), and merges
+results back in the original order.
+
+    with ProcessPoolWebAPI(processes=4, host=hostname, username=username, password=password) as pool:
+        job_id, results = pool.create_job_with_tasks(task_generator, {"Name": "Large job"})
+        pool.server.submit_job(job_id)
+        states = pool.get_jobs(job_ids, ["State"])
+
+Keyword arguments of WebAPI constructor must be picklable, so hooks and caches shared between processes
+are not supported.
+"""
+import collections
+import itertools
+import multiprocessing
+
+from .webapi import WebAPI
+from .workers import bounded_imap
+
+# WebAPI instance of a worker process
+_server = None
+
+
+def _init_worker(webapi_kwargs):
+    global _server
+    _server = WebAPI(**webapi_kwargs)
+
+
+def _add_tasks(job_id, tasks, concurrency):
+    return _server.add_tasks(job_id, tasks, concurrency=concurrency)
+
+
+def _get_jobs(job_ids, requested_properties, concurrency):
+    return list(bounded_imap(lambda job_id: _server.get_job(job_id, requested_properties), job_ids, concurrency))
+
+
+def _get_tasks(job_id, task_ids, requested_properties, concurrency):
+    return list(bounded_imap(lambda task_id: _server.get_task(job_id, task_id, requested_properties),
+                             task_ids, concurrency))
+
+
+def _shards(iterable, shard_size):
+    iterator = iter(iterable)
+    while True:
+        shard = list(itertools.islice(iterator, shard_size))
+        if not shard:
+            return
+        yield shard
+
+
+class ProcessPoolWebAPI(object):
+    """ Process pool for bulk operations, each worker process has its own WebAPI instance.
+    Single-request operations should be done by `server` attribute (WebAPI instance of the parent process).
+    """
+    def __init__(self, processes=None, shard_size=500, concurrency=8, **webapi_kwargs):
+        """
+        :param processes: Number of worker processes, default is the number of CPUs
+        :param shard_size: Number of tasks or IDs processed by a worker process at once
+        :param concurrency: Maximum number of requests in flight in each worker process
+        :param webapi_kwargs: Arguments of WebAPI constructor (host, username, password, port, ...)
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.shard_size = shard_size
+        self.concurrency = concurrency
+        self.server = WebAPI(**webapi_kwargs)
+        worker_kwargs = dict(webapi_kwargs)
+        # Workers don't need to discover cluster name again
+        worker_kwargs["hpc_cluster_name"] = self.server.hpc_cluster_name
+        worker_kwargs.setdefault("pool_maxsize", concurrency)
+        self.pool = multiprocessing.Pool(self.processes, _init_worker, (worker_kwargs,))
+
+    def close(self):
+        """ Wait for worker processes to finish and close connections """
+        self.pool.close()
+        self.pool.join()
+        self.server.close()
+
+    def terminate(self):
+        """ Stop worker processes immediately """
+        self.pool.terminate()
+        self.pool.join()
+        self.server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def _map(self, func, args):
+        # Like Pool.imap, but reads no more than 2 * processes shards ahead of the results consumed,
+        # so args can be a generator producing millions of tasks
+        pending = collections.deque()
+        window = 2 * self.processes
+        for arg in args:
+            pending.append(self.pool.apply_async(func, arg))
+            while len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def add_tasks(self, job_id, tasks):
+        """ Add many tasks to a job, see WebAPI.add_tasks
+        :param job_id: Job ID
+        :param tasks: Iterable (for example, a generator) of dictionaries with task properties
+        :return: List of TaskResult (task_id, error), in the same order as tasks
+        """
+        results = []
+        for shard_results in self._map(_add_tasks, ((job_id, shard, self.concurrency)
+                                                    for shard in _shards(tasks, self.shard_size))):
+            results.extend(shard_results)
+        return results
+
+    def create_job_with_tasks(self, tasks, job_properties=None):
+        """ Create a new job and populate it with tasks added by worker processes. The job is not submitted.
+        :param tasks: Iterable of dictionaries with task properties
+        :param job_properties: (optional) Dictionary of job properties
+        :return: (job_id, list of TaskResult) tuple, job_id is None if job creation failed
+        """
+        job_id = self.server.create_job(**(job_properties or {}))
+        if job_id is None:
+            return None, []
+        return job_id, self.add_tasks(job_id, tasks)
+
+    def get_jobs(self, job_ids, requested_properties=None):
+        """ Properties of many jobs, see WebAPI.get_job
+        :param job_ids: Iterable of job IDs
+        :param requested_properties: (optional) List of job properties to return
+        :return: List of dictionaries of job properties (None if request failed), in the same order as job_ids
+        """
+        results = []
+        for shard_results in self._map(_get_jobs, ((shard, requested_properties, self.concurrency)
+                                                   for shard in _shards(job_ids, self.shard_size))):
+            results.extend(shard_results)
+        return results
+
+    def get_tasks(self, job_id, task_ids, requested_properties=None):
+        """ Properties of many tasks of a job, see WebAPI.get_task
+        :param job_id: Job ID
+        :param task_ids: Iterable of task IDs
+        :param requested_properties: (optional) List of task properties to return
+        :return: List of dictionaries of task properties (None if request failed), in the same order as task_ids
+        """
+        results = []
+        for shard_results in self._map(_get_tasks, ((job_id, shard, requested_properties, self.concurrency)
+                                                    for shard in _shards(task_ids, self.shard_size))):
+            results.extend(shard_results)
+        return results
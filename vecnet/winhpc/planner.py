@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Submission of very large task streams as several right-sized jobs, without overloading the head node.
+
+    planner = SubmissionPlanner(server, max_tasks_per_job=1000, max_submitted_jobs=4)
+    submission = planner.submit(task_generator, {"Name": "Sweep"})   # returns immediately
+    submission.counts()     # {"Running": 4, "Configuring": 1}
+    submission.wait()       # {job_id: final state} of all jobs
+    submission.cancel()
+
+Tasks are split into jobs of at most max_tasks_per_job tasks ("Sweep (1)", "Sweep (2)", ...). The next job is
+created while previous jobs run, but it is submitted only when fewer than max_submitted_jobs jobs of the
+submission are queued or running.
+
+Requests are throttled by retry.RateLimiter, adapted to request latency. The planner installs a rate limiter
+on the server (on every cluster of a ClusterPool) that doesn't have one; this affects all users of that
+WebAPI instance until planner.close() restores the previous rate limiters.
+"""
+import itertools
+import logging
+import threading
+import time
+
+from .retry import RateLimiter
+from .webapi import JOB_TERMINAL_STATES
+from .workers import bounded_imap
+
+logger = logging.getLogger(__name__)
+
+
+def _webapi_instances(server):
+    # WebAPI instances used by server: WebAPI itself or servers of all clusters of a clusterpool.ClusterPool
+    clusters = getattr(server, "clusters", None)
+    if clusters is not None:
+        return [cluster.server for cluster in clusters.values()]
+    return [server]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class SubJob(object):
+    """ One job of a planned submission """
+    def __init__(self, index, job_id, results):
+        # Position of the job in the submission, starting from 0
+        self.index = index
+        # None if the job could not be created
+        self.job_id = job_id
+        # List of webapi.TaskResult, in the order tasks were given
+        self.results = results
+        # Last known job state, None until the job is submitted
+        self.state = None
+
+    @property
+    def finished(self):
+        return self.state in JOB_TERMINAL_STATES
+
+    def __repr__(self):
+        return "<SubJob %s %s tasks=%d>" % (self.job_id, self.state, len(self.results))
+
+
+class PlannedSubmission(object):
+    """ Handle tracking all jobs of a submission made by SubmissionPlanner. Thread-safe. """
+    def __init__(self, planner):
+        self.planner = planner
+        self.jobs = []
+        # Exception (or error message) that stopped the submission
+        self.error = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def job_ids(self):
+        """ IDs of jobs created so far """
+        with self._lock:
+            return [job.job_id for job in self.jobs if job.job_id is not None]
+
+    @property
+    def submitting(self):
+        """ True while tasks are still being split into jobs and submitted """
+        return self._thread is not None and self._thread.is_alive()
+
+    def results(self):
+        """ Results of add_task requests of all tasks, in the order tasks were given
+        :return: List of (job_id, TaskResult) tuples
+        """
+        with self._lock:
+            return [(job.job_id, result) for job in self.jobs for result in job.results]
+
+    def states(self):
+        """ Last known state of every job (see refresh), without sending requests
+        :return: Dictionary {job_id: state}, state is None for jobs that are not submitted yet
+        """
+        with self._lock:
+            return dict((job.job_id, job.state) for job in self.jobs if job.job_id is not None)
+
+    def counts(self):
+        """ Number of jobs in every state (last known state, see refresh)
+        :return: Dictionary {state: number of jobs}, jobs that are not submitted yet are counted as "Configuring"
+        """
+        counts = {}
+        for state in self.states().values():
+            state = state or "Configuring"
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def active(self):
+        """ Submitted jobs that are not finished yet """
+        with self._lock:
+            return [job for job in self.jobs if job.state is not None and not job.finished]
+
+    def refresh(self):
+        """ Poll state of submitted jobs that are not finished
+        :return: Number of active jobs (submitted, not finished)
+        """
+        jobs = self.active()
+        server = self.planner.server
+
+        def poll(job):
+            return job, server.get_job(job.job_id, ["State"])
+
+        for job, properties in bounded_imap(poll, jobs, self.planner.concurrency):
+            if properties and properties.get("State"):
+                job.state = properties["State"]
+        return len(self.active())
+
+    def wait_submitted(self, timeout=None):
+        """ Wait until all tasks are added to jobs and all jobs are submitted (or submission stopped)
+        :param timeout: (optional) Maximum time to wait, in seconds
+        :return: True if submission is complete
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.submitting
+
+    def wait(self, timeout=None):
+        """ Wait until all jobs are submitted and finished
+        :param timeout: (optional) Maximum time to wait, in seconds
+        :return: Dictionary {job_id: state}, None if timeout expired
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            submitting = self.submitting
+            if self.refresh() == 0 and not submitting:
+                return self.states()
+            delay = self.planner.poll_interval
+            if deadline is not None:
+                if time.time() >= deadline:
+                    return None
+                delay = min(delay, deadline - time.time())
+            if submitting:
+                # Wake up as soon as the submission thread is done
+                self._thread.join(max(delay, 0))
+            else:
+                time.sleep(max(delay, 0))
+
+    def cancel(self, forced=False, message=""):
+        """ Stop the submission and cancel all jobs that are not finished, including jobs not submitted yet
+        :param forced: Cancel jobs immediately, without running node release tasks
+        :param message: Cancellation message
+        :return: Dictionary {job_id: True if the job was cancelled, False otherwise}
+        """
+        self._stopped.set()
+        self.wait_submitted()
+        with self._lock:
+            jobs = [job for job in self.jobs if job.job_id is not None and not job.finished]
+        server = self.planner.server
+
+        def cancel(job):
+            return job, server.cancel_job(job.job_id, forced=forced, message=message)
+
+        result = {}
+        for job, cancelled in bounded_imap(cancel, jobs, self.planner.concurrency):
+            result[job.job_id] = bool(cancelled)
+            if cancelled:
+                job.state = "Canceled"
+        return result
+
+    def __repr__(self):
+        return "<PlannedSubmission jobs=%d %s>" % (len(self.jobs), self.counts())
+
+
+class SubmissionPlanner(object):
+    """ Splits a task stream into jobs of at most max_tasks_per_job tasks and keeps at most max_submitted_jobs of
+    them queued or running at the same time.
+
+    server can be a WebAPI or a clusterpool.ClusterPool (only create_job_with_tasks, submit_job, get_job and
+    cancel_job are used).
+    """
+    def __init__(self, server, max_tasks_per_job=1000, max_submitted_jobs=4, concurrency=8, poll_interval=10.0,
+                 rate_limiter=None, from_xml=False):
+        """
+        :param server: WebAPI instance
+        :param max_tasks_per_job: Maximum number of tasks in one job
+        :param max_submitted_jobs: Maximum number of jobs of one submission that are queued or running
+        :param concurrency: Maximum number of add_task (and get_job) requests in flight
+        :param poll_interval: Time between polls of job states while waiting for a job to finish, in seconds
+        :param rate_limiter: (optional) retry.RateLimiter set as rate_limiter of the server (of every cluster
+                             server of a ClusterPool), replacing its rate limiter until close(). By default,
+                             servers without a rate limiter get their own RateLimiter(rate=20, target_latency=1.0)
+                             and servers with a rate limiter keep it. False leaves servers unchanged
+        :param from_xml: Create every job with its tasks by a single create_job_from_xml request
+                         (see WebAPI.create_job_with_tasks)
+        """
+        if max_tasks_per_job < 1 or max_submitted_jobs < 1:
+            raise ValueError("max_tasks_per_job and max_submitted_jobs must be positive")
+        self.server = server
+        self.max_tasks_per_job = max_tasks_per_job
+        self.max_submitted_jobs = max_submitted_jobs
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.from_xml = from_xml
+        # (WebAPI, previous rate limiter) of servers whose rate limiter was replaced
+        self._replaced = []
+        if rate_limiter is not False:
+            for instance in _webapi_instances(server):
+                if rate_limiter is None and instance.rate_limiter is not None:
+                    continue
+                self._replaced.append((instance, instance.rate_limiter))
+                instance.rate_limiter = rate_limiter if rate_limiter is not None else \
+                    RateLimiter(rate=20.0, target_latency=1.0)
+
+    def close(self):
+        """ Restore rate limiters replaced by the planner. Call after all submissions are complete """
+        for instance, previous in self._replaced:
+            instance.rate_limiter = previous
+        self._replaced = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, tasks, job_properties=None):
+        """ Start submission of tasks in a background thread
+        :param tasks: Iterable of dictionaries with task properties (consumed lazily, one job at a time)
+        :param job_properties: (optional) Dictionary of properties of every job. Part number is appended to Name
+        :return: PlannedSubmission
+        """
+        submission = PlannedSubmission(self)
+        submission._thread = threading.Thread(target=self._run, args=(submission, tasks, job_properties or {}))
+        submission._thread.daemon = True
+        submission._thread.start()
+        return submission
+
+    def _run(self, submission, tasks, job_properties):
+        try:
+            self._submit_jobs(submission, tasks, job_properties)
+        except Exception as e:
+            logger.exception("Submission failed")
+            submission.error = e
+
+    def _submit_jobs(self, submission, tasks, job_properties):
+        for index, chunk in enumerate(_chunks(tasks, self.max_tasks_per_job)):
+            if submission._stopped.is_set():
+                return
+            properties = dict(job_properties)
+            if properties.get("Name"):
+                properties["Name"] = "%s (%d)" % (properties["Name"], index + 1)
+            # The next job is created and populated while previous jobs run
+            job_id, results = self.server.create_job_with_tasks(chunk, properties, concurrency=self.concurrency,
+                                                                from_xml=self.from_xml)
+            job = SubJob(index, job_id, results)
+            with submission._lock:
+                submission.jobs.append(job)
+            if job_id is None:
+                submission.error = "Job %d could not be created" % (index + 1)
+                return
+            if not self._wait_for_slot(submission):
+                return
+            if not self.server.submit_job(job_id):
+                submission.error = "Job %s could not be submitted" % job_id
+                return
+            job.state = "Submitted"
+
+    def _wait_for_slot(self, submission):
+        # Wait until fewer than max_submitted_jobs jobs are active, False if the submission was cancelled
+        while submission.refresh() >= self.max_submitted_jobs:
+            if submission._stopped.wait(self.poll_interval):
+                return False
+        return not submission._stopped.is_set()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Retry policy, circuit breaker and rate limiter for requests to WinHPC WebAPI server
+
+    server = WebAPI(hostname, username, password,
+                    retry_policy=RetryPolicy(max_retries=5),
+                    circuit_breaker=CircuitBreaker(failure_threshold=10),
+                    failover_hosts=["headnode2.example.com"],
+                    rate_limiter=RateLimiter(rate=20, target_latency=1.0))
+"""
+import email.utils
+import random
+import threading
+import time
+
+
+class RetryPolicy(object):
+    """ When and how long to wait before repeating a failed request.
+
+    Idempotent requests (GET, PUT and POST requests that can be safely repeated, like cancel_job or submit_job)
+    are retried after connection errors and responses with status in retry_on_status.
+    Other requests (create_job, add_task, create_job_from_xml) are retried only if they certainly were not
+    processed by the server: connection to the server could not be established, or the server responded with
+    one of not_processed_status (503 Service Unavailable by default). This way a retry never creates
+    a duplicate job or task.
+    If the first attempt of an idempotent request succeeded, but its response was lost, the retry may fail
+    ("job is already submitted"); WebAPI.submit_job and WebAPI.cancel_job then check job state before
+    reporting failure.
+    """
+    def __init__(self,
+                 max_retries=3,
+                 backoff_factor=0.5,
+                 max_backoff=30.0,
+                 jitter=True,
+                 retry_on_status=(500, 502, 503, 504),
+                 not_processed_status=(503,),
+                 respect_retry_after=True,
+                 max_retry_after=120.0):
+        """
+        :param max_retries: Maximum number of retries of a single request
+        :param backoff_factor: Delay before n-th retry is backoff_factor * 2 ** (n - 1) seconds
+        :param max_backoff: Maximum delay between retries, in seconds
+        :param jitter: If True, delay is a random value between 0 and calculated backoff ("full jitter")
+        :param retry_on_status: HTTP status codes that cause idempotent requests to be retried
+        :param not_processed_status: HTTP status codes that cause non-idempotent requests to be retried
+        :param respect_retry_after: Use delay from Retry-After header if server sent it
+        :param max_retry_after: Maximum delay accepted from Retry-After header, in seconds
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on_status = frozenset(retry_on_status)
+        self.not_processed_status = frozenset(not_processed_status)
+        self.respect_retry_after = respect_retry_after
+        self.max_retry_after = max_retry_after
+
+    def should_retry(self, attempt, response, idempotent):
+        """ True if request should be repeated
+        :param attempt: Number of retries made so far
+        :param response: Response of the last attempt
+        :param idempotent: True if request can be safely repeated
+        """
+        if attempt >= self.max_retries or response.ok:
+            return False
+        if response.error is not None:
+            return idempotent or not response.request_sent
+        if idempotent:
+            return response.status_code in self.retry_on_status
+        return response.status_code in self.not_processed_status
+
+    def delay(self, attempt, response):
+        """ Time to wait before next retry, in seconds
+        :param attempt: Number of retries made so far
+        :param response: Response of the last attempt
+        """
+        if self.respect_retry_after:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.max_retry_after)
+        backoff = min(self.backoff_factor * (2 ** attempt), self.max_backoff)
+        if self.jitter:
+            return random.uniform(0, backoff)
+        return backoff
+
+
+def parse_retry_after(value):
+    """ Delay in seconds from Retry-After header value (number of seconds or HTTP date), None if not valid """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(email.utils.mktime_tz(parsed) - time.time(), 0.0)
+
+
+class CircuitBreaker(object):
+    """ Stops sending requests to a server after failure_threshold consecutive failures (connection errors or
+    5xx responses). After reset_timeout seconds one trial request is let through ("half-open" state);
+    the circuit is closed again if it succeeds.
+    WebAPI tries to find the active head node (see WebAPI.failover) every time the circuit opens.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param failure_threshold: Number of consecutive failures that opens the circuit
+        :param reset_timeout: Time (in seconds) before a trial request is sent to the server
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """ True if a request can be sent now """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                # Let one trial request through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """ Register failed request
+        :return: True if the circuit has just been opened
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or \
+                    (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def reset(self):
+        """ Close the circuit (for example, after switching to another head node) """
+        self.record_success()
+
+
+class RateLimiter(object):
+    """ Token bucket limiting the rate of requests sent to a server, shared by all threads using it.
+
+    If target_latency is set, the rate is adapted to the load of the head node (additive increase,
+    multiplicative decrease): every fast successful request adds increase / rate requests per second (about
+    `increase` per second at full rate), and a request slower than target_latency, a connection error or
+    a response with one of slow_down_status multiplies the rate by `decrease`. The rate is decreased at most
+    once per observed request time, so a burst of slow responses to requests sent at the old rate counts once.
+    """
+    def __init__(self, rate=20.0, burst=None, target_latency=None, min_rate=0.5, max_rate=None,
+                 increase=1.0, decrease=0.5, slow_down_status=(429, 503)):
+        """
+        :param rate: Initial number of requests per second
+        :param burst: Number of requests that can be sent at once after a pause, default is max(rate, 1)
+        :param target_latency: (optional) Request time (in seconds) above which the rate is decreased.
+                               If not set, the rate is constant
+        :param min_rate: Minimum rate the rate can be decreased to, requests per second
+        :param max_rate: (optional) Maximum rate the rate can be increased to, requests per second
+        :param increase: Rate increase per second of fast requests, requests per second
+        :param decrease: Rate multiplier applied after a slow or failed request
+        :param slow_down_status: HTTP status codes that cause the rate to decrease
+        """
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else max(self.rate, 1.0)
+        self.target_latency = target_latency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_down_status = frozenset(slow_down_status)
+        self.tokens = self.burst
+        self.waited = 0.0
+        self._updated_at = time.time()
+        self._decreased_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.tokens + (now - self._updated_at) * self.rate, self.burst)
+        self._updated_at = now
+
+    def acquire(self):
+        """ Take a token, waiting until it is available
+        :return: Time waited, in seconds
+        """
+        with self._lock:
+            self._refill(time.time())
+            # Token is reserved even if it is not available yet, so waiting threads are served in order
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += delay
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def set_rate(self, rate):
+        """ Change the number of requests per second """
+        with self._lock:
+            self._refill(time.time())
+            self.rate = float(rate)
+
+    def record(self, latency, response):
+        """ Adapt the rate to a completed request (called by WebAPI after every attempt)
+        :param latency: Request time, in seconds
+        :param response: transport.Response
+        """
+        if self.target_latency is None:
+            return
+        slow = response.error is not None or response.status_code in self.slow_down_status or \
+            latency > self.target_latency
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            if not slow:
+                self.rate += self.increase / self.rate
+                if self.max_rate is not None:
+                    self.rate = min(self.rate, self.max_rate)
+            elif now - self._decreased_at >= latency:
+                self.rate = max(self.rate * self.decrease, self.min_rate)
+                self._decreased_at = now
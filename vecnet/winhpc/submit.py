@@ -10,44 +10,269 @@
 
 
 """ Submit a job specified on the command line to Windows HPC cluster
-python -m vecnet.winhpc <hostname> <username> <password> "<command to submit>"
+python -m vecnet.winhpc.submit --hostname <hostname> --username <username> --password <password>
+                               --command "<command to submit>"
+
+Batch mode - submit many tasks from a JSONL or CSV file ("-" for stdin) in one process
+python -m vecnet.winhpc.submit --hostname <hostname> --username <username> --password <password>
+                               --batch tasks.jsonl --results results.jsonl [--resume]
+
+Every input record describes one task:
+    {"command": "model.exe 1", "workdir": "\\\\share\\run1", "env": {"SEED": "1"}, "job": "run1", "id": "t1"}
+Only "command" is required. Tasks with the same "job" value are added to the same job; tasks without "job"
+are grouped into jobs of --tasks-per-job tasks. "id" identifies the task in the results file (record number
+is used by default). In CSV files env is written as NAME=value;NAME2=value2
+
+Results file is a stream of JSON lines:
+    {"job": "run1", "job_id": "15", "submitted": false}     - job created
+    {"id": "t1", "job": "run1", "job_id": "15", "task_id": "1", "error": null}     - task added
+    {"job": "run1", "job_id": "15", "submitted": true}     - job submitted
+With --resume, submitted jobs and successfully added tasks found in the results file are skipped, and results
+are appended to the file.
+
+Cluster name (and HPC Pack version) is cached in ~/.vecnet.winhpc.cache.json (see cache.MetadataCache), so
+repeated launches don't look it up every time. Use --cluster-name to skip the lookup, --no-cache to disable
+the cache.
 """
+from __future__ import print_function
 import argparse
+import collections
+import csv
+import json
+import sys
+import threading
+from vecnet.winhpc.cache import MetadataCache
 from vecnet.winhpc.webapi import WebAPI
+from vecnet.winhpc.workers import bounded_imap
 
 
-def main(hostname, username, password, name, command, workdir, priority):
-    server = WebAPI(hostname, username, password)
+def _webapi(hostname, username, password, cluster_name=None, use_cache=True, **kwargs):
+    # Short-lived CLI processes read cluster metadata from the on-disk cache instead of discovering it
+    return WebAPI(hostname, username, password, hpc_cluster_name=cluster_name,
+                  metadata_cache=MetadataCache() if use_cache else None, **kwargs)
+
+
+def main(hostname, username, password, name, command, workdir, priority, cluster_name=None, use_cache=True):
+    server = _webapi(hostname, username, password, cluster_name, use_cache)
     job_id = server.create_job(name=name, priority=priority)
     if workdir is None:
         server.add_task(job_id,
                         name="Task created by vecnet.winhpc library",
                         commandLine=command)
     else:
-        print workdir
+        print(workdir)
         task_id = server.add_task(job_id,
                         name="Task created by vecnet.winhpc library",
                         commandLine=command,
                         WorkDirectory=workdir)
         if task_id is None:
-            print "Task creation failed"
-            print "Error: %s" % server.response
+            print("Task creation failed")
+            print("Error: %s" % server.response)
 
     if server.submit_job(job_id):
-        print "Successfully submitted job %s" % job_id
+        print("Successfully submitted job %s" % job_id)
     else:
-        print "Job submission failed, job_id %s" % job_id
+        print("Job submission failed, job_id %s" % job_id)
     return job_id
 
+
+def _parse_env(value):
+    # Environment variables in CSV file: NAME=value;NAME2=value2 (or JSON object)
+    if not value:
+        return None
+    if isinstance(value, dict):
+        return value
+    if value.lstrip().startswith("{"):
+        return json.loads(value)
+    env = {}
+    for pair in value.split(";"):
+        if pair.strip():
+            variable, _, variable_value = pair.partition("=")
+            env[variable.strip()] = variable_value
+    return env
+
+
+def read_records(fp, input_format="jsonl"):
+    """ Task definitions from JSONL or CSV file
+    :param fp: File object
+    :param input_format: "jsonl" or "csv"
+    :return: Generator of dictionaries with "command", "workdir", "env", "job" and "id" keys
+    """
+    if input_format == "csv":
+        rows = csv.DictReader(fp)
+    else:
+        rows = (json.loads(line) for line in fp if line.strip())
+    for number, row in enumerate(rows, 1):
+        if not row.get("command"):
+            raise ValueError("Record %s: command is missing" % number)
+        yield {
+            "id": row["id"] if row.get("id") not in (None, "") else number,
+            "command": row["command"],
+            "workdir": row.get("workdir") or None,
+            "env": _parse_env(row.get("env")),
+            "job": row.get("job") or None,
+            "name": row.get("name") or None,
+        }
+
+
+def group_records(records, tasks_per_job):
+    """ Group task definitions into jobs
+    :return: OrderedDict {job key: list of records}
+    """
+    jobs = collections.OrderedDict()
+    count = 0
+    for record in records:
+        job = record["job"]
+        if job is None:
+            job = "batch-%d" % (count // tasks_per_job + 1)
+            count += 1
+        jobs.setdefault(job, []).append(record)
+    return jobs
+
+
+def read_results(fp):
+    """ State of a previous run from its results file
+    :return: (jobs, done) tuple, where jobs is dictionary {job key: [job_id, submitted]} and done is a set of
+             IDs of tasks successfully added to jobs
+    """
+    jobs = {}
+    done = set()
+    for line in fp:
+        try:
+            result = json.loads(line)
+        except ValueError:
+            # Last line may be incomplete if previous run was interrupted
+            continue
+        if "task_id" in result:
+            if result.get("error") is None and result.get("task_id") is not None:
+                done.add("%s" % result["id"])
+        elif "submitted" in result:
+            state = jobs.setdefault(result["job"], [result["job_id"], False])
+            state[0] = result["job_id"]
+            state[1] = state[1] or result["submitted"]
+    return jobs, done
+
+
+def _task_properties(record):
+    properties = {"Name": record["name"] or "Task %s" % record["id"], "CommandLine": record["command"]}
+    if record["workdir"] is not None:
+        properties["WorkDirectory"] = record["workdir"]
+    if record["env"]:
+        properties["EnvironmentVariables"] = record["env"]
+    return properties
+
+
+def submit_batch(server, jobs, output, name, priority, previous_jobs=None, done=None,
+                 concurrency=16, job_concurrency=4):
+    """ Create jobs, add tasks and submit jobs, writing JSON results to output as they become available
+    :param server: WebAPI instance
+    :param jobs: OrderedDict {job key: list of task definitions}, see group_records
+    :param output: File object for results
+    :param name: Name of jobs (job key is appended)
+    :param priority: Priority of jobs
+    :param previous_jobs: (optional) Jobs created by previous run, see read_results
+    :param done: (optional) IDs of tasks added by previous run
+    :param concurrency: Maximum number of add_task requests in flight per job
+    :param job_concurrency: Maximum number of jobs created at the same time
+    :return: Number of tasks that failed
+    """
+    previous_jobs = previous_jobs or {}
+    done = done or set()
+    lock = threading.Lock()
+
+    def write(result):
+        with lock:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    def process(job):
+        job_id, submitted = previous_jobs.get(job, (None, False))
+        if submitted:
+            return 0
+        if job_id is None:
+            job_id = server.create_job(name="%s %s" % (name, job), priority=priority)
+            if job_id is None:
+                for record in jobs[job]:
+                    write({"id": record["id"], "job": job, "job_id": None, "task_id": None,
+                           "error": "Job creation failed: %s" % server.response})
+                return len(jobs[job])
+            write({"job": job, "job_id": job_id, "submitted": False})
+        records = [record for record in jobs[job] if "%s" % record["id"] not in done]
+        failed = 0
+        # Every result is written as soon as the task is added, so --resume doesn't add it again after a crash
+        results = server.iter_add_tasks(job_id, (_task_properties(record) for record in records), concurrency)
+        for index, result in enumerate(results):
+            record = records[index]
+            if not result.ok:
+                failed += 1
+            write({"id": record["id"], "job": job, "job_id": job_id, "task_id": result.task_id,
+                   "error": result.error})
+        # Job is not submitted if some of its tasks are missing, it can be completed with --resume
+        if failed == 0:
+            if server.submit_job(job_id):
+                write({"job": job, "job_id": job_id, "submitted": True})
+            else:
+                sys.stderr.write("Job submission failed, job_id %s: %s\n" % (job_id, server.response))
+        return failed
+
+    return sum(bounded_imap(process, list(jobs), job_concurrency))
+
+
+def main_batch(hostname, username, password, name, priority, batch, results=None, resume=False,
+               input_format=None, tasks_per_job=1000, concurrency=16, job_concurrency=4, cluster_name=None,
+               use_cache=True):
+    """ Submit tasks from JSONL or CSV file (see module docstring)
+    :return: Number of tasks that failed
+    """
+    if input_format is None:
+        input_format = "csv" if batch.lower().endswith(".csv") else "jsonl"
+    if batch == "-":
+        records = list(read_records(sys.stdin, input_format))
+    else:
+        with open(batch) as fp:
+            records = list(read_records(fp, input_format))
+    jobs = group_records(records, tasks_per_job)
+
+    previous_jobs, done = {}, set()
+    if resume:
+        if results is None:
+            raise ValueError("--resume requires --results")
+        try:
+            with open(results) as fp:
+                previous_jobs, done = read_results(fp)
+        except IOError:
+            pass
+
+    server = _webapi(hostname, username, password, cluster_name, use_cache,
+                     pool_connections=1, pool_maxsize=concurrency * job_concurrency)
+    output = sys.stdout if results is None else open(results, "a" if resume else "w")
+    try:
+        return submit_batch(server, jobs, output, name, priority,
+                            previous_jobs=previous_jobs, done=done,
+                            concurrency=concurrency, job_concurrency=job_concurrency)
+    finally:
+        server.close()
+        if output is not sys.stdout:
+            output.close()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--hostname")
     parser.add_argument("--username")
     parser.add_argument("--password")
+    parser.add_argument("--cluster-name", help="HPC cluster name, discovered (and cached) if not specified")
+    parser.add_argument("--no-cache", action="store_true", help="Don't use cached cluster metadata")
     parser.add_argument("--command")
     parser.add_argument("--name")
     parser.add_argument("--priority")
     parser.add_argument("--workdir")
+    parser.add_argument("--batch", help="JSONL or CSV file with task definitions, - for stdin")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Format of --batch file")
+    parser.add_argument("--results", help="Results file (JSONL), default is stdout")
+    parser.add_argument("--resume", action="store_true", help="Skip tasks found in --results file")
+    parser.add_argument("--tasks-per-job", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16, help="Parallel add_task requests per job")
+    parser.add_argument("--job-concurrency", type=int, default=4, help="Jobs created at the same time")
 
     args = parser.parse_args()
     hostname = args.hostname
@@ -57,4 +282,12 @@ if __name__ == "__main__":
     name = args.name or "Job submitted by vecnet.winhpc library"
     priority = args.priority or "Normal"
     workdir = args.workdir
-    main(hostname, username, password, name, command, workdir, priority)
+    if args.batch is not None:
+        failed = main_batch(hostname, username, password, name, priority, args.batch,
+                            results=args.results, resume=args.resume, input_format=args.format,
+                            tasks_per_job=args.tasks_per_job, concurrency=args.concurrency,
+                            job_concurrency=args.job_concurrency, cluster_name=args.cluster_name,
+                            use_cache=not args.no_cache)
+        sys.exit(1 if failed else 0)
+    main(hostname, username, password, name, command, workdir, priority,
+         cluster_name=args.cluster_name, use_cache=not args.no_cache)
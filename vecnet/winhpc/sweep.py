@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Expansion of task templates for parameter sweeps.
+
+Task template is a dictionary of task properties, where {parameter_name} placeholders are replaced
+by parameter values, for example
+    {"commandLine": "model.exe --seed {seed} --beta {beta}", "EnvironmentVariables": {"BETA": "{beta}"}}
+
+Parameters are either a grid - dictionary {parameter_name: list of values}, expanded into all combinations,
+or an iterable of dictionaries {parameter_name: value}, one per sweep point.
+"""
+import itertools
+
+# Task properties where HPC scheduler replaces * with the index of a parametric sweep instance
+# http://technet.microsoft.com/en-us/library/ff919664(v=ws.10).aspx
+SWEEP_FIELDS = ("commandline", "workdirectory", "stdin", "stdout", "stderr")
+
+
+def _substitute(value, parameters):
+    # str.format is not used, so other curly braces in command lines are preserved
+    if isinstance(value, dict):
+        return dict((name, _substitute(value[name], parameters)) for name in value)
+    if not isinstance(value, (type(u""), str)):
+        return value
+    for name in parameters:
+        value = value.replace(u"{%s}" % name, u"%s" % parameters[name])
+    return value
+
+
+def iter_points(parameters):
+    """ Sweep points
+    :param parameters: Dictionary {parameter_name: list of values} or iterable of dictionaries
+    :return: Generator of dictionaries {parameter_name: value}
+    """
+    if not isinstance(parameters, dict):
+        for point in parameters:
+            yield point
+        return
+    names = sorted(parameters)
+    for values in itertools.product(*[parameters[name] for name in names]):
+        yield dict(zip(names, values))
+
+
+def expand(template, parameters):
+    """ Task definitions for every sweep point
+    :param template: Dictionary of task properties with {parameter_name} placeholders
+    :param parameters: Dictionary {parameter_name: list of values} or iterable of dictionaries
+    :return: Generator of dictionaries with task properties
+    """
+    for point in iter_points(parameters):
+        yield _substitute(template, point)
+
+
+def parametric_sweep_task(template, parameters):
+    """ Single HPC parametric sweep task equivalent to the sweep, if possible.
+    This is the case if the grid has a single integer parameter with evenly spaced increasing values,
+    which is used only in the properties where HPC scheduler substitutes sweep index (CommandLine,
+    WorkDirectory, StdIn, StdOut and StdErr).
+
+    :param template: Dictionary of task properties with {parameter_name} placeholders
+    :param parameters: Dictionary {parameter_name: list of values} or iterable of dictionaries
+    :return: Dictionary with properties of ParametricSweep task, None if the sweep can't be expressed this way
+    """
+    if not isinstance(parameters, dict) or len(parameters) != 1:
+        return None
+    name = list(parameters)[0]
+    values = list(parameters[name])
+    if not values:
+        return None
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, int):
+            return None
+    increment = values[1] - values[0] if len(values) > 1 else 1
+    if increment <= 0:
+        return None
+    for i in range(1, len(values)):
+        if values[i] - values[i - 1] != increment:
+            return None
+
+    placeholder = u"{%s}" % name
+    task = {}
+    for property_name in template:
+        value = template[property_name]
+        if property_name.lower() in SWEEP_FIELDS and isinstance(value, (type(u""), str)):
+            if u"*" in value:
+                # Literal * would be replaced by the scheduler
+                return None
+            value = value.replace(placeholder, u"*")
+        elif placeholder in u"%s" % (value,):
+            return None
+        task[property_name] = value
+    task["Type"] = "ParametricSweep"
+    task["StartValue"] = values[0]
+    task["EndValue"] = values[-1]
+    task["IncrementValue"] = increment
+    return task
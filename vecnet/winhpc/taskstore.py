@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Compact in-memory store of task states for monitoring large jobs.
+
+A dictionary of strings per task takes 0.5-1 KB; TaskStore keeps task state in typed arrays (about 140 bytes
+per task, most of it the index of task IDs) and computes per-job summaries without creating per-task objects:
+    store = TaskStore()
+    server = WebAPI(hostname, username, password, task_store=store)    # get_task and iter_tasks feed the store
+    store.load(server, job_id)
+    store.counts()          # {job_id: {"Running": 10, "Finished": 90}}
+    store.summary(job_id)   # counts, runtime percentiles and failed tasks
+
+It can also be fed by JobWatcher: watcher.subscribe(store.on_change)
+"""
+import calendar
+import collections
+import logging
+import math
+import re
+import sys
+import threading
+from array import array
+
+from .metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+# Task states of HPC Pack scheduler. States are stored as indexes in this list, unknown states are appended.
+TASK_STATES = ("Configuring", "Submitted", "Validating", "Queued", "Dispatching", "Running", "Finishing",
+               "Finished", "Failed", "Canceled", "Canceling")
+
+# Properties requested by TaskStore.load
+TASK_PROPERTIES = ("TaskId", "State", "StartTime", "EndTime", "ExitCode")
+
+NO_EXIT_CODE = -2 ** 31
+# State code of tasks whose State has not been seen yet (properties without State); not counted by counts()
+UNKNOWN_STATE = 255
+
+_TIME = re.compile(r"^(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(\.\d+)?(Z|[+-]\d\d:?\d\d)?$")
+
+
+def parse_time(value):
+    """ Seconds since epoch from ISO 8601 time returned by the server, NaN if value is empty or not valid.
+    Time without time zone is treated as UTC
+    """
+    if not value:
+        return float("nan")
+    match = _TIME.match(value.strip())
+    if match is None:
+        return float("nan")
+    seconds = calendar.timegm(tuple(int(match.group(i)) for i in range(1, 7)) + (0, 0, 0))
+    if match.group(7):
+        seconds += float(match.group(7))
+    zone = match.group(8)
+    if zone and zone != "Z":
+        offset = int(zone[1:3]) * 3600 + int(zone[-2:]) * 60
+        seconds += -offset if zone[0] == "+" else offset
+    return float(seconds)
+
+
+def _exit_code(value):
+    # Exit code as a signed 32-bit number, None if value is empty or not a number
+    if value is None:
+        return None
+    try:
+        exit_code = int(("%s" % value).strip())
+    except ValueError:
+        return None
+    # Windows exit codes are unsigned 32-bit numbers (0xC0000005), they are stored as signed
+    if exit_code >= 2 ** 31:
+        exit_code -= 2 ** 32
+    if not -2 ** 31 < exit_code < 2 ** 31:
+        return None
+    return exit_code
+
+
+class TaskStore(object):
+    """ Column store of task states: job ID, task ID, state, start time, end time and exit code. Thread-safe. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.states = list(TASK_STATES)
+        self._state_codes = dict((state, code) for code, state in enumerate(self.states))
+        # "i" is 4 bytes on all supported platforms ("l" is 8 bytes on 64-bit Linux)
+        self.job_ids = array("i")
+        self.task_ids = array("i")
+        self.state_codes = array("B")
+        self.start_times = array("d")
+        self.end_times = array("d")
+        self.exit_codes = array("i")
+        # (job_id << 32 | task_id) -> row
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.job_ids)
+
+    def _state_code(self, state):
+        code = self._state_codes.get(state)
+        if code is None:
+            if len(self.states) >= UNKNOWN_STATE:
+                raise ValueError("Too many distinct task states")
+            code = self._state_codes[state] = len(self.states)
+            self.states.append(state)
+        return code
+
+    def update(self, job_id, task_id, properties):
+        """ Save task properties (State, StartTime, EndTime, ExitCode; missing properties are not changed)
+        :param job_id: Job ID
+        :param task_id: Task ID
+        :param properties: Dictionary of task properties, as returned by WebAPI.get_task
+        :return: False if job ID or task ID is not a valid number (the task is not stored)
+        """
+        # The store is fed by WebAPI.get_task and iter_tasks; unexpected values must not break these calls
+        try:
+            job_id = int(job_id)
+            task_id = int(task_id)
+            if not (0 <= job_id < 2 ** 31 and 0 <= task_id < 2 ** 31):
+                raise ValueError()
+        except (TypeError, ValueError):
+            logger.warning("Task %s of job %s is not stored: ID is not a valid number", task_id, job_id)
+            return False
+        exit_code = _exit_code(properties.get("ExitCode"))
+        key = job_id << 32 | task_id
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = self._rows[key] = len(self.job_ids)
+                self.job_ids.append(job_id)
+                self.task_ids.append(task_id)
+                self.state_codes.append(UNKNOWN_STATE)
+                self.start_times.append(float("nan"))
+                self.end_times.append(float("nan"))
+                self.exit_codes.append(NO_EXIT_CODE)
+            if properties.get("State") is not None:
+                try:
+                    self.state_codes[row] = self._state_code(properties["State"])
+                except ValueError as e:
+                    logger.warning("State of task %s of job %s is not stored: %s", task_id, job_id, e)
+            if "StartTime" in properties:
+                self.start_times[row] = parse_time(properties["StartTime"])
+            if "EndTime" in properties:
+                self.end_times[row] = parse_time(properties["EndTime"])
+            if exit_code is not None:
+                self.exit_codes[row] = exit_code
+        return True
+
+    def feed(self, job_id, tasks):
+        """ Save properties of tasks while they are consumed
+        :param job_id: Job ID
+        :param tasks: Iterable of dictionaries of task properties with TaskId (for example, WebAPI.iter_tasks)
+        :return: Generator of the same dictionaries
+        """
+        for properties in tasks:
+            if properties.get("TaskId") is not None:
+                self.update(job_id, properties["TaskId"], properties)
+            yield properties
+
+    def load(self, server, job_id):
+        """ Retrieve states of all tasks of the job by Get Task List requests
+        :param server: WebAPI instance
+        :param job_id: Job ID
+        :return: Number of tasks
+        """
+        count = 0
+        for properties in server.iter_tasks(job_id, list(TASK_PROPERTIES)):
+            # WebAPI with task_store feeds the store itself
+            if getattr(server, "task_store", None) is not self:
+                self.update(job_id, properties["TaskId"], properties)
+            count += 1
+        return count
+
+    def on_change(self, change):
+        """ JobWatcher subscriber (watcher.subscribe(store.on_change)), saves task changes """
+        if change.task_id is not None:
+            self.update(change.job_id, change.task_id, change.properties)
+
+    def remove_job(self, job_id):
+        """ Remove all tasks of the job """
+        job_id = int(job_id)
+        with self._lock:
+            keep = [row for row, row_job_id in enumerate(self.job_ids) if row_job_id != job_id]
+            if len(keep) == len(self.job_ids):
+                return
+            for name in ("job_ids", "task_ids", "state_codes", "start_times", "end_times", "exit_codes"):
+                column = getattr(self, name)
+                setattr(self, name, array(column.typecode, [column[row] for row in keep]))
+            self._rows = dict((row_job_id << 32 | task_id, row)
+                              for row, (row_job_id, task_id) in enumerate(zip(self.job_ids, self.task_ids)))
+
+    def memory_usage(self):
+        """ Approximate size of the store in bytes, including keys and values of the task ID index """
+        with self._lock:
+            return (sum(column.itemsize * len(column) for column in (
+                self.job_ids, self.task_ids, self.state_codes, self.start_times, self.end_times, self.exit_codes))
+                + sys.getsizeof(self._rows)
+                + sum(sys.getsizeof(key) + sys.getsizeof(row) for key, row in self._rows.items()))
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Queries
+    # ---------------------------------------------------------------------------------------------- #
+    def get(self, job_id, task_id):
+        """ Stored properties of the task (State is None if it is not known), None if the task is not in the store """
+        with self._lock:
+            row = self._rows.get(int(job_id) << 32 | int(task_id))
+            if row is None:
+                return None
+            code = self.state_codes[row]
+            return {"State": self.states[code] if code != UNKNOWN_STATE else None,
+                    "StartTime": self.start_times[row],
+                    "EndTime": self.end_times[row],
+                    "ExitCode": None if self.exit_codes[row] == NO_EXIT_CODE else self.exit_codes[row]}
+
+    def counts(self, job_id=None):
+        """ Number of tasks in every state. Tasks whose state is not known are not counted
+        :param job_id: (optional) Count tasks of this job only
+        :return: Dictionary {job_id: {state: number of tasks}}
+        """
+        with self._lock:
+            counter = collections.Counter(zip(self.job_ids, self.state_codes))
+        result = {}
+        for (row_job_id, code), count in counter.items():
+            if code == UNKNOWN_STATE:
+                continue
+            if job_id is None or row_job_id == int(job_id):
+                result.setdefault(row_job_id, {})[self.states[code]] = count
+        return result
+
+    def runtimes(self, job_id, state="Finished"):
+        """ Sorted run times (EndTime - StartTime, in seconds) of tasks of the job in the given state """
+        job_id = int(job_id)
+        code = self._state_codes.get(state)
+        with self._lock:
+            values = [end - start for row_job_id, row_code, start, end
+                      in zip(self.job_ids, self.state_codes, self.start_times, self.end_times)
+                      if row_job_id == job_id and row_code == code]
+        return sorted(value for value in values if not math.isnan(value))
+
+    def failures(self, job_id=None):
+        """ Failed tasks
+        :param job_id: (optional) Failed tasks of this job only
+        :return: List of (job_id, task_id, exit code) tuples
+        """
+        code = self._state_codes["Failed"]
+        with self._lock:
+            return [(row_job_id, task_id, None if exit_code == NO_EXIT_CODE else exit_code)
+                    for row_job_id, task_id, row_code, exit_code
+                    in zip(self.job_ids, self.task_ids, self.state_codes, self.exit_codes)
+                    if row_code == code and (job_id is None or row_job_id == int(job_id))]
+
+    def summary(self, job_id):
+        """ Summary of the job: task counts per state, run time percentiles of finished tasks and failed tasks
+        :return: Dictionary with "counts", "tasks", "runtime_p50", "runtime_p95", "runtime_max" and "failed" keys
+        """
+        counts = self.counts(job_id).get(int(job_id), {})
+        runtimes = self.runtimes(job_id)
+        return {
+            "tasks": sum(counts.values()),
+            "counts": counts,
+            "runtime_p50": percentile(runtimes, 50),
+            "runtime_p95": percentile(runtimes, 95),
+            "runtime_max": runtimes[-1] if runtimes else None,
+            "failed": [(task_id, exit_code) for job, task_id, exit_code in self.failures(job_id)],
+        }
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" HTTP transport used by WebAPI: a requests.Session with a connection pool per host
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """ HTTPAdapter that counts how many TCP connections were opened and how many requests
+    were sent over an already open (keep-alive) connection
+    """
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        # Number of connections opened by each urllib3 connection pool at the time of last check
+        self._seen_connections = {}
+        self.connections_opened = 0
+        self.requests_sent = 0
+        super(PooledHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        try:
+            return super(PooledHTTPAdapter, self).send(request, **kwargs)
+        finally:
+            self._update_stats()
+
+    def _update_stats(self):
+        pools = self.poolmanager.pools
+        with self._stats_lock:
+            self.requests_sent += 1
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    # Pool has been evicted in the meantime
+                    continue
+                opened = pool.num_connections
+                self.connections_opened += opened - self._seen_connections.get(pool, 0)
+                self._seen_connections[pool] = opened
+
+    @property
+    def connections_reused(self):
+        return max(self.requests_sent - self.connections_opened, 0)
+
+    def stats(self):
+        """ Connection reuse counters
+        :return: Dictionary with "requests", "connections_opened" and "connections_reused" keys
+        """
+        with self._stats_lock:
+            return {
+                "requests": self.requests_sent,
+                "connections_opened": self.connections_opened,
+                "connections_reused": max(self.requests_sent - self.connections_opened, 0),
+            }
+
+    def close(self):
+        super(PooledHTTPAdapter, self).close()
+        with self._stats_lock:
+            self._seen_connections = {}
+
+
+def create_session(pool_connections=10, pool_maxsize=10, pool_block=False):
+    """ Create requests.Session that reuses connections (HTTP keep-alive) to WinHPC WebAPI server
+    :param pool_connections: Number of hosts to keep connection pools for
+    :param pool_maxsize: Maximum number of connections kept open per host
+    :param pool_block: If True, wait for a free connection instead of opening an extra one
+    :return: (session, adapter) tuple
+    """
+    adapter = PooledHTTPAdapter(pool_connections=pool_connections,
+                                pool_maxsize=pool_maxsize,
+                                pool_block=pool_block)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session, adapter
+
+
+class Response(object):
+    """ Response of WinHPC WebAPI server to a single HTTP request.
+    Every request gets its own Response object, so it can be safely used from several threads.
+    """
+    def __init__(self, status_code=None, text=u"", headers=None, elapsed=0.0, error=None,
+                 bytes_sent=0, bytes_received=0, request_sent=True):
+        """
+        :param status_code: HTTP status code, None if request could not be sent
+        :param text: Response body (or error message if request could not be sent)
+        :param headers: Dictionary of response headers
+        :param elapsed: Time (in seconds) between sending the request and receiving the response. For retried
+                        requests, sum of all attempts (without waiting between them)
+        :param error: Error message if request could not be sent
+        :param bytes_sent: Size of request body
+        :param bytes_received: Size of response body
+        :param request_sent: False if the request certainly did not reach the server (connection failed)
+        """
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers if headers is not None else {}
+        self.elapsed = elapsed
+        self.error = error
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.request_sent = request_sent
+        # Number of times the request was repeated and time spent waiting between attempts, in seconds
+        # (see retry.RetryPolicy)
+        self.retries = 0
+        self.retry_delay = 0.0
+        # Time spent waiting for the rate limiter, in seconds (see retry.RateLimiter)
+        self.throttled = 0.0
+        # Parsed response body and time spent parsing it (see WebAPI.send)
+        self.value = None
+        self.parse_time = 0.0
+
+    @property
+    def ok(self):
+        """ True if request was completed successfully (HTTP 200 OK) """
+        return self.error is None and self.status_code == 200
+
+    def __repr__(self):
+        return "<Response [%s]>" % (self.status_code if self.error is None else self.error)
+
+
+class CountingIterable(object):
+    """ Wrapper of a streaming request body that counts bytes sent """
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+
+def body_size(data):
+    """ Size of request body, None for streaming (iterable) bodies """
+    if data is None:
+        return 0
+    if isinstance(data, (bytes, type(u""))):
+        return len(data)
+    return None
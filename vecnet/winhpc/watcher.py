@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Job state change watcher - a single poll stream shared by many consumers.
+
+JobWatcher polls states of the watched jobs (and optionally their tasks) in batches and publishes only
+changes to subscribers:
+    watcher = JobWatcher(server, interval=5)
+    watcher.subscribe(lambda change: print(change))
+    watcher.watch(job_id, tasks=True)
+    watcher.start()
+
+Jobs are polled by Get Job requests while there are few of them, and by a single Get Job List stream of
+unfinished jobs otherwise (jobs missing from the list are then polled by Get Job); tasks of a job are polled by
+a single Get Task List stream.
+
+Changes can also be published to local processes over a Unix socket, one JSON object per line:
+    python -m vecnet.winhpc.watcher --hostname <hostname> --username <username> --password <password>
+                                    --socket /tmp/winhpc-watcher.sock
+    for change in feed("/tmp/winhpc-watcher.sock", watch=[job_id]):
+        ...
+"""
+from __future__ import print_function
+import argparse
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+
+from .webapi import JOB_TERMINAL_STATES, WebAPI
+from .workers import bounded_imap
+
+logger = logging.getLogger(__name__)
+
+# Get Job List filter used when many jobs are watched: only jobs that are not finished are listed
+ACTIVE_JOBS_FILTER = {"JobState": "Configuring,Submitted,Validating,ExternalValidation,Queued,Running,Finishing,"
+                                  "Canceling"}
+
+
+class JobChange(namedtuple("JobChange", ["job_id", "task_id", "old_state", "new_state", "properties"])):
+    """ Change of job or task properties
+    task_id is None for job changes. old_state is None when the job or task is seen for the first time.
+    properties is a dictionary of the watched properties
+    """
+    __slots__ = ()
+
+    def to_json(self):
+        return json.dumps(self._asdict(), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(**json.loads(data))
+
+
+class JobWatcher(object):
+    """ Polls states of watched jobs and tasks, and publishes changes to subscribers. Thread-safe. """
+    def __init__(self, server, interval=5.0, requested_properties=("State",), concurrency=8, list_threshold=20,
+                 unwatch_finished=True, list_filter=None):
+        """
+        :param server: WebAPI instance
+        :param interval: Time between polls, in seconds
+        :param requested_properties: Properties of jobs and tasks that are watched for changes
+        :param concurrency: Maximum number of requests in flight during a poll
+        :param list_threshold: If more jobs are watched, they are polled by a single Get Job List stream
+        :param unwatch_finished: Stop watching jobs when they reach a terminal state (and all their watched tasks)
+        :param list_filter: (optional) Get Job List query parameters used when more than list_threshold jobs are
+                            watched, default is ACTIVE_JOBS_FILTER. Adding Owner further reduces the list
+        """
+        self.server = server
+        self.interval = interval
+        self.requested_properties = list(requested_properties)
+        if "State" not in self.requested_properties:
+            self.requested_properties.append("State")
+        self.concurrency = concurrency
+        self.list_threshold = list_threshold
+        self.unwatch_finished = unwatch_finished
+        self.list_filter = dict(list_filter) if list_filter is not None else dict(ACTIVE_JOBS_FILTER)
+        self._lock = threading.RLock()
+        # job_id -> True if tasks of the job are watched
+        self._jobs = {}
+        # (job_id, task_id) -> properties
+        self._states = {}
+        self._subscribers = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._socket = None
+        # client socket -> lock serializing writes to it
+        self._clients = {}
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Watch list and subscribers
+    # ---------------------------------------------------------------------------------------------- #
+    def watch(self, job_id, tasks=False):
+        """ Start watching the job
+        :param job_id: Job ID
+        :param tasks: Watch states of tasks of the job too
+        """
+        with self._lock:
+            job_id = "%s" % job_id
+            self._jobs[job_id] = self._jobs.get(job_id, False) or tasks
+
+    def unwatch(self, job_id):
+        """ Stop watching the job and its tasks """
+        with self._lock:
+            job_id = "%s" % job_id
+            self._jobs.pop(job_id, None)
+            for key in [key for key in self._states if key[0] == job_id]:
+                del self._states[key]
+
+    def watched(self):
+        """ IDs of watched jobs """
+        with self._lock:
+            return list(self._jobs)
+
+    def states(self, job_id=None):
+        """ Last known properties of watched jobs and tasks
+        :param job_id: (optional) Return properties of this job and its tasks only
+        :return: Dictionary {(job_id, task_id): properties}, task_id is None for jobs
+        """
+        with self._lock:
+            return dict((key, dict(properties)) for key, properties in self._states.items()
+                        if job_id is None or key[0] == "%s" % job_id)
+
+    def subscribe(self, callback):
+        """ Call callback(JobChange) for every change. Callbacks are called from the polling thread """
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def subscribe_queue(self, queue, loop=None):
+        """ Put every change into asyncio.Queue, in a thread-safe way (Python 3.4+)
+        :param queue: asyncio.Queue
+        :param loop: (optional) Event loop of the queue, default is the current event loop
+        :return: Callback that can be passed to unsubscribe
+        """
+        if loop is None:
+            import asyncio
+            loop = asyncio.get_event_loop()
+        return self.subscribe(lambda change: loop.call_soon_threadsafe(queue.put_nowait, change))
+
+    def _publish(self, change):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(change)
+            except Exception:
+                logger.exception("Subscriber %r failed", callback)
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Polling
+    # ---------------------------------------------------------------------------------------------- #
+    def _poll_jobs(self, job_ids):
+        # job_id -> properties, jobs that could not be retrieved are missing
+        jobs = {}
+        if len(job_ids) > self.list_threshold:
+            wanted = set(job_ids)
+            properties = self.requested_properties if "Id" in self.requested_properties \
+                else ["Id"] + self.requested_properties
+            for job in self.server.iter_jobs(filter=self.list_filter, requested_properties=properties):
+                if job.get("Id") in wanted:
+                    jobs[job["Id"]] = dict((name, job.get(name)) for name in self.requested_properties)
+            # Jobs that are not listed have finished since the last poll (or don't match list_filter)
+            job_ids = [job_id for job_id in job_ids if job_id not in jobs]
+        results = bounded_imap(lambda job_id: self.server.get_job(job_id, self.requested_properties),
+                               job_ids, self.concurrency)
+        jobs.update((job_id, properties) for job_id, properties in zip(job_ids, results) if properties)
+        return jobs
+
+    def _poll_tasks(self, job_id):
+        properties = self.requested_properties if "TaskId" in self.requested_properties \
+            else ["TaskId"] + self.requested_properties
+        tasks = {}
+        for task in self.server.iter_tasks(job_id, requested_properties=properties):
+            tasks[task.get("TaskId")] = dict((name, task.get(name)) for name in self.requested_properties)
+        return tasks
+
+    def _update(self, key, properties, changes):
+        old = self._states.get(key)
+        if old != properties:
+            self._states[key] = properties
+            changes.append(JobChange(key[0], key[1], old.get("State") if old else None,
+                                     properties.get("State"), properties))
+
+    def poll(self):
+        """ Poll states of all watched jobs and tasks once and publish changes
+        :return: List of JobChange
+        """
+        with self._lock:
+            jobs = dict(self._jobs)
+        if not jobs:
+            return []
+        try:
+            job_states = self._poll_jobs(sorted(jobs))
+        except RuntimeError as e:
+            logger.warning("Polling jobs failed: %s", e)
+            return []
+        task_jobs = [job_id for job_id in sorted(jobs) if jobs[job_id]]
+
+        def poll_tasks(job_id):
+            try:
+                return self._poll_tasks(job_id)
+            except RuntimeError as e:
+                logger.warning("Polling tasks of job %s failed: %s", job_id, e)
+                return None
+        task_states = dict(zip(task_jobs, bounded_imap(poll_tasks, task_jobs, self.concurrency)))
+
+        changes = []
+        finished = []
+        with self._lock:
+            for job_id in sorted(job_states):
+                if job_id not in self._jobs:
+                    # Unwatched during the poll
+                    continue
+                self._update((job_id, None), job_states[job_id], changes)
+                tasks = task_states.get(job_id)
+                # Task IDs are numbers
+                for task_id in sorted(tasks or {}, key=lambda task_id: (len("%s" % task_id), "%s" % task_id)):
+                    self._update((job_id, task_id), tasks[task_id], changes)
+                if job_states[job_id].get("State") in JOB_TERMINAL_STATES and (
+                        not jobs[job_id] or (tasks is not None and all(
+                            task.get("State") in JOB_TERMINAL_STATES for task in tasks.values()))):
+                    finished.append(job_id)
+        for change in changes:
+            self._publish(change)
+        if self.unwatch_finished:
+            for job_id in finished:
+                self.unwatch(job_id)
+        return changes
+
+    def start(self):
+        """ Start polling in a background thread """
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Polling failed")
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        """ Stop polling and close the socket feed """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients:
+            client.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # ---------------------------------------------------------------------------------------------- #
+    # Unix socket feed
+    # ---------------------------------------------------------------------------------------------- #
+    def serve(self, path):
+        """ Publish changes to local processes connected to Unix socket at path (see feed()).
+        Clients send commands, one JSON object per line: {"watch": job_id, "tasks": true} or {"unwatch": job_id}.
+        The last known state of a job and its tasks is sent back when it is watched.
+        """
+        if not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("Unix sockets are not supported on this platform")
+        if os.path.exists(path):
+            os.remove(path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        self._socket.listen(16)
+        self.subscribe(self._send_to_clients)
+        thread = threading.Thread(target=self._accept, args=(self._socket,))
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self, server_socket):
+        while True:
+            try:
+                client, address = server_socket.accept()
+            except (socket.error, OSError):
+                # Socket closed by stop()
+                return
+            with self._lock:
+                self._clients[client] = threading.Lock()
+            thread = threading.Thread(target=self._read_commands, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def _read_commands(self, client):
+        try:
+            for line in client.makefile("rb"):
+                try:
+                    command = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    continue
+                if "watch" in command:
+                    self.watch(command["watch"], tasks=command.get("tasks", False))
+                    for (job_id, task_id), properties in sorted(self.states(command["watch"]).items()):
+                        self._send(client, JobChange(job_id, task_id, None, properties.get("State"), properties))
+                elif "unwatch" in command:
+                    self.unwatch(command["unwatch"])
+        except (socket.error, OSError):
+            pass
+        self._drop(client)
+
+    def _send(self, client, change):
+        with self._lock:
+            client_lock = self._clients.get(client)
+        if client_lock is None:
+            # Client disconnected
+            return
+        try:
+            # Changes are sent by the polling thread and by the thread reading commands of this client,
+            # a message must not be interleaved with another one
+            with client_lock:
+                client.sendall((change.to_json() + "\n").encode("utf-8"))
+        except (socket.error, OSError):
+            self._drop(client)
+
+    def _send_to_clients(self, change):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            self._send(client, change)
+
+    def _drop(self, client):
+        with self._lock:
+            self._clients.pop(client, None)
+        client.close()
+
+
+def feed(path, watch=None, tasks=False):
+    """ Changes published by JobWatcher.serve over Unix socket (of all watched jobs, not only jobs in watch)
+    :param path: Path of the socket
+    :param watch: (optional) IDs of jobs to be watched
+    :param tasks: Watch tasks of these jobs too
+    :return: Generator of JobChange
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    try:
+        for job_id in watch or []:
+            client.sendall((json.dumps({"watch": "%s" % job_id, "tasks": tasks}) + "\n").encode("utf-8"))
+        for line in client.makefile("rb"):
+            yield JobChange.from_json(line.decode("utf-8"))
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish job state changes over Unix socket")
+    parser.add_argument("--hostname")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--port", type=int, default=443)
+    parser.add_argument("--socket", required=True, help="Path of Unix socket")
+    parser.add_argument("--interval", type=float, default=5.0, help="Time between polls, in seconds")
+    args = parser.parse_args()
+
+    server = WebAPI(args.hostname, args.username, args.password, port=args.port)
+    watcher = JobWatcher(server, interval=args.interval)
+    watcher.serve(args.socket)
+    watcher.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+if __name__ == "__main__":
+    main()
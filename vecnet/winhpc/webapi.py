@@ -7,33 +7,85 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License (MPL), version 2.0.  If a copy of the MPL was not distributed
 # with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
-from StringIO import StringIO
-from xml.etree import ElementTree
-from xml.dom import minidom
-import requests
+from collections import OrderedDict, namedtuple
+import logging
+import threading
+import time
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
 from requests.auth import HTTPBasicAuth
-from requests.exceptions import ConnectionError, HTTPError
+from requests.exceptions import ConnectionError, ConnectTimeout, RequestException, Timeout
+from requests.packages.urllib3.exceptions import ConnectTimeoutError, MaxRetryError
+from . import metrics, operations, sweep, xmlutils
+from .metrics import endpoint_from_url
+from .transport import create_session, body_size, CountingIterable, Response
+from .workers import WorkerPool, bounded_imap
 
 
+logger = logging.getLogger(__name__)
+
 HPC_Pack_2012 = "2012-11-01.4.0"
 HPC_Pack_2008_R2_SP4 = "2012-03-31.3.4"
 HPC_Pack_2008_R2_SP3 = "2011-11-01"
 
+# Job states after which job state no longer changes (unless the job is requeued)
+JOB_TERMINAL_STATES = ("Finished", "Failed", "Canceled")
+# Endpoints that exist on every cluster: 404 response means that cluster name (cached metadata) is wrong
+CLUSTER_ENDPOINTS = ("Version", "Jobs", "Jobs/JobFile", "ActiveHeadnode")
+# Job states after a successful Submit Job request
+JOB_SUBMITTED_STATES = ("Submitted", "Validating", "ExternalValidation", "Queued", "Running", "Finishing",
+                        "Finished", "Failed", "Canceled", "Canceling")
+# Job states after a successful Cancel Job request
+JOB_CANCELED_STATES = ("Canceled", "Canceling")
+# State reported by wait_for_jobs for jobs that don't exist (deleted or wrong ID)
+JOB_NOT_FOUND = "NotFound"
+# Number of consecutive 404 responses after which wait_for_jobs stops waiting for a job
+JOB_NOT_FOUND_POLLS = 2
+
+
+class TaskResult(namedtuple("TaskResult", ["task_id", "error"])):
+    """ Outcome of creating a single task in add_tasks().
+    error contains server response or exception message if task creation (or setting its environment variables)
+    failed; task_id is None if the task was not created
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
 
-class WebAPI:
+class WebAPI(object):
     def __init__(self,
                  host,
                  username,
                  password,
                  port=443,
                  hpc_cluster_name=None,
-                 api_version=HPC_Pack_2008_R2_SP3):
+                 api_version=HPC_Pack_2008_R2_SP3,
+                 pool_connections=10,
+                 pool_maxsize=10,
+                 pool_block=False,
+                 metadata_cache=None,
+                 hooks=None,
+                 retry_policy=None,
+                 circuit_breaker=None,
+                 failover_hosts=None,
+                 property_cache=None,
+                 scheme="https",
+                 task_store=None,
+                 rate_limiter=None):
         self.host = host
         self.username = username
         self.password = password
         self.port = port
+        # "http" can be used with a local test server (see mockserver.MockHPCServer)
+        self.scheme = scheme
         self.api_version = api_version
-        self.response = None
+        # Last response is tracked per thread, so one WebAPI instance can be shared by several threads
+        self._local = threading.local()
         # HTTP Request headers
         self.headers = {"Content-type": "application/xml"}
         if self.api_version is not None:
@@ -43,48 +95,186 @@ class WebAPI:
             "auth": HTTPBasicAuth(self.username, self.password),
             "verify": False
         }
+        # Failed requests are repeated according to retry_policy (retry.RetryPolicy). If circuit_breaker
+        # (retry.CircuitBreaker) opens, the active head node is looked up among host and failover_hosts
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.failover_hosts = list(failover_hosts) if failover_hosts is not None else []
+        # All head nodes in the configured order; self.host is changed by failover, this list is not
+        self._hosts = [host] + [failover_host for failover_host in self.failover_hosts if failover_host != host]
+        # Every request (including retries) waits for a token of rate_limiter (retry.RateLimiter), if provided
+        self.rate_limiter = rate_limiter
+        self._failover_lock = threading.Lock()
+        # Functions called with metrics.RequestEvent after each request (see metrics.MetricsCollector)
+        self.hooks = list(hooks) if hooks is not None else []
+        # Keep-alive connections to the head node are reused between requests made by this instance
+        self.session, self.adapter = create_session(pool_connections=pool_connections,
+                                                    pool_maxsize=pool_maxsize,
+                                                    pool_block=pool_block)
 
-        if hpc_cluster_name is not None:
-            self.hpc_cluster_name = hpc_cluster_name
-        else:
-            clusters = self.get_clusters()
-            if clusters:
-                self.hpc_cluster_name = clusters[0]
-            else:
-                self.hpc_cluster_name = None
+        # HPC cluster name is discovered on first use of base_url (or hpc_cluster_name) if not specified.
+        # Cluster name, version and active head node are saved in metadata_cache (MetadataCache), if provided
+        self.metadata_cache = metadata_cache
+        self._metadata_lock = threading.RLock()
+        self._metadata_from_cache = False
+        self._cluster_discovered = hpc_cluster_name is not None
+        self._hpc_cluster_name = hpc_cluster_name
+        self._base_url = None
+        # Job and task properties are read from property_cache (cache.PropertyCache), if provided.
+        # Cached properties of a job or a task are invalidated when this instance modifies it
+        self.property_cache = property_cache
+        # Task properties returned by get_task and iter_tasks are saved in task_store (taskstore.TaskStore)
+        self.task_store = task_store
+
+    @property
+    def hpc_cluster_name(self):
+        """ Name of HPC cluster, discovered by get_clusters() on first use if not specified in constructor """
+        if not self._cluster_discovered:
+            with self._metadata_lock:
+                if not self._cluster_discovered:
+                    self._hpc_cluster_name = self._discover_cluster_name()
+                    self._cluster_discovered = True
+        return self._hpc_cluster_name
+
+    @hpc_cluster_name.setter
+    def hpc_cluster_name(self, value):
+        self._hpc_cluster_name = value
+        self._cluster_discovered = True
 
-        self.base_url = "https://{host}:{port}/WindowsHPC/{HPC_cluster_name}/".format(
+    @property
+    def base_url(self):
+        """ URL of HPC Web Service API for the cluster """
+        if self._base_url is not None:
+            return self._base_url
+        return "{scheme}://{host}:{port}/WindowsHPC/{HPC_cluster_name}/".format(
+            scheme=self.scheme,
             host=self.host,
             port=self.port,
             HPC_cluster_name=self.hpc_cluster_name,
         )
 
+    @base_url.setter
+    def base_url(self, value):
+        self._base_url = value
+
+    def _discover_cluster_name(self):
+        cluster_name = self._get_cached_metadata("cluster_name")
+        if cluster_name is not None:
+            return cluster_name
+        clusters = self.get_clusters()
+        if not clusters:
+            return None
+        self._set_cached_metadata("cluster_name", clusters[0])
+        return clusters[0]
+
+    @property
+    def _metadata_cache_key(self):
+        return "%s:%s" % (self.host, self.port)
+
+    def _get_cached_metadata(self, field):
+        if self.metadata_cache is None:
+            return None
+        value = self.metadata_cache.get(self._metadata_cache_key, field)
+        if value is not None:
+            self._metadata_from_cache = True
+        return value
+
+    def _set_cached_metadata(self, field, value):
+        if self.metadata_cache is not None and value is not None:
+            self.metadata_cache.set(self._metadata_cache_key, field, value)
+
+    def _refresh_metadata(self):
+        # Called when a request fails - cached metadata may be outdated (for example, after head node failover)
+        with self._metadata_lock:
+            if not self._metadata_from_cache:
+                return
+            self._metadata_from_cache = False
+            self.metadata_cache.invalidate(self._metadata_cache_key)
+            if self._base_url is None:
+                # Cluster name will be discovered again on next use of base_url
+                self._cluster_discovered = False
+
+    @property
+    def last_response(self):
+        """ Response object of the last request sent by the current thread (None if no requests were sent) """
+        return getattr(self._local, "last_response", None)
+
+    @property
+    def response(self):
+        """ Body of the last response (or error message) received by the current thread.
+        Kept for backward compatibility, use return value of send() or last_response instead.
+        """
+        return getattr(self._local, "response", None)
+
+    @response.setter
+    def response(self, value):
+        self._local.response = value
+
+    def close(self):
+        """ Close all pooled connections to WinHPC WebAPI server """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connection_stats(self):
+        """ Number of requests sent and connections opened/reused by this instance
+        :return: Dictionary with "requests", "connections_opened" and "connections_reused" keys
+        """
+        return self.adapter.stats()
+
     # ---------------------------------------------------------------------------------------------- #
     # Helper functions
     # ---------------------------------------------------------------------------------------------- #
     @staticmethod
     def _xml_from_properties(**properties):
-        xml = "<ArrayOfProperty xmlns=\"http://schemas.microsoft.com/HPCS2008R2/common\">"
-        for property_name in properties:
-            xml += "<Property><Name>%s</Name><Value>%s</Value></Property>" % (property_name, properties[property_name])
-        xml += "</ArrayOfProperty>"
-        return xml
+        return xmlutils.properties_to_xml(properties)
 
     def _get_string_from_response(self, xml=None):
         if xml is None:
             xml = self.response
-        tree = ElementTree.parse(StringIO(xml))
-        root = tree.getroot()
-        return root.text
+        return xmlutils.parse_string(xml)
+
+    @staticmethod
+    def _get_clusters_from_xml(xml):
+        return xmlutils.parse_clusters(xml)
 
     def _requested_properties_to_string(self, requested_properties):
-        assert isinstance(requested_properties, list)
-        url = ""
-        for property_name in requested_properties:
-            url += property_name + ","
-            # Remove trailing comma
-            url = url[:-1]
-        return url
+        return operations.names_to_string(requested_properties)
+
+    @staticmethod
+    def _query_string(params):
+        # Commas in property lists are kept as is
+        return "&".join("%s=%s" % (name, quote(("%s" % value).encode("utf-8"), safe=",")) for name, value in params)
+
+    def _iter_objects(self, url, params):
+        """ Objects returned by a list operation (Get Job List, Get Task List), following continuation tokens.
+        Each page is parsed while objects are consumed, so memory usage doesn't depend on the total number of objects.
+        :param url: URL of the list operation
+        :param params: List of (name, value) query parameters
+        :raises: RuntimeError if a page could not be retrieved
+        :return: Generator of dictionaries of object properties
+        """
+        query_id = None
+        while True:
+            page_params = list(params)
+            if query_id is not None:
+                page_params.append(("QueryId", query_id))
+            page_url = url
+            if page_params:
+                page_url += "?" + self._query_string(page_params)
+            r = self.send("get", page_url)
+            if not r.ok:
+                raise RuntimeError("Request %s failed: %s" % (page_url, r.text))
+            for properties in xmlutils.iter_objects(r.text):
+                yield properties
+            # Server sets continuation header if there are more objects to return
+            query_id = r.headers.get("x-ms-continuation-QueryId")
+            if not query_id:
+                return
 
     def _get_properties_from_xml(self, xml=None):
         """ List of properties in xml response from WebAPI
@@ -103,73 +293,246 @@ class WebAPI:
         <ArrayOfProperty>
 
         :param xml: (optional) xml to be parse. If None, self.response is used
-        :raises: AttributeError if xml document is malformed
+        :raises: ParseError if xml document is malformed
         :return: Dictionary of properties
         """
         if xml is None:
             xml = self.response
-        properties = {}
-        # tree = ElementTree.parse(StringIO(xml))
-        # root = tree.getroot()
-        parsed_xml = minidom.parse(StringIO(xml))
-
-        for property_tag in parsed_xml.getElementsByTagName('Property'):
-            # Get content of <name> and <value> tags in <Property>
-            name = property_tag.getElementsByTagName('Name')[0].firstChild.data
-            try:
-                value = property_tag.getElementsByTagName('Value')[0].firstChild.data
-            except AttributeError:
-                # <value/> tag found, settings attribute value is None
-                value = None
-            properties[name] = value
+        return xmlutils.parse_properties(xml)
+
+    def _cached_properties(self, key, requested_properties, fetch):
+        # Properties from property_cache; only missing or expired properties are requested from the server.
+        # fetch(requested_properties) must return dictionary of properties or None
+        if self.property_cache is None:
+            return fetch(requested_properties)
+        cached, missing = self.property_cache.lookup(key, requested_properties)
+        if missing is not None and len(missing) == 0:
+            return cached
+        # Properties read before a concurrent modification of the job are not cached
+        generation = self.property_cache.generation(key)
+        properties = fetch(missing)
+        if properties is None:
+            return None
+        self.property_cache.store(key, properties, complete=missing is None, generation=generation)
+        if cached:
+            cached.update(properties)
+            return cached
         return properties
 
-    def request(self, method, url, data=None, headers=None):
-        """ Send HTTP request to WinHPC WebAPI server using correct headers, api-version and credentials
+    def _invalidate_job(self, job_id, tasks=False):
+        if self.property_cache is not None:
+            if tasks:
+                self.property_cache.invalidate_job(job_id)
+            else:
+                self.property_cache.invalidate(("job", "%s" % job_id))
+
+    def _invalidate_task(self, job_id, task_id):
+        if self.property_cache is not None:
+            self.property_cache.invalidate(("task", "%s" % job_id, "%s" % task_id))
+
+    def _applied_after_retry(self, job_id, states):
+        # Retry of a request whose first attempt succeeded, but the response was lost, fails
+        # ("job is already submitted"). Check if the job is in one of the states the request leads to.
+        response = self.last_response
+        if response is None or response.retries == 0:
+            return False
+        properties = self.get_job(job_id, ["State"])
+        return bool(properties) and properties.get("State") in states
+
+    def _batch(self, func, ids, concurrency):
+        # Call func(id) for every id by up to `concurrency` parallel requests, return dictionary {id: result}
+        ids = list(ids)
+
+        def call(item_id):
+            try:
+                return func(item_id)
+            except Exception:
+                logger.exception("Request for %s failed", item_id)
+                return False
+
+        return dict(zip(ids, bounded_imap(call, ids, concurrency)))
+
+    def send(self, method, url, data=None, headers=None, parser=None, idempotent=None):
+        """ Send HTTP request to WinHPC WebAPI server using correct headers, api-version and credentials.
+        Safe to call from several threads at the same time.
         :param method: HTTP method (GET, POST or PUT)
         :param url: URL to post
         :param data: (optional) Data to be posted
         :param headers: (optional) Additional headers if necessary
+        :param parser: (optional) Function to parse body of successful response, result is saved in response.value
+        :param idempotent: (optional) True if request can be safely repeated (see retry.RetryPolicy).
+                           Default is True for GET and PUT requests, False for POST requests
 
-        :return: True if request successfully completed
-        :return: False if error happened
+        :return: Response object
         """
         if headers is None:
             headers = self.headers
         else:
-            headers = dict(self.headers.items() + headers.items())
-
-        if method == "post":
-            http = requests.post
-        elif method == "get":
-            http = requests.get
-        elif method == "put":
-            http = requests.put
-        else:
+            merged_headers = dict(self.headers)
+            merged_headers.update(headers)
+            headers = merged_headers
+
+        if method not in ("post", "get", "put"):
             raise RuntimeError("HTTP method %s is not supported" % method)
+        if idempotent is None:
+            idempotent = method in ("get", "put")
+
+        bytes_sent = body_size(data)
+        if bytes_sent is None:
+            data = CountingIterable(data)
+        started = time.time()
+        throttled = 0.0
+        retry_delay = 0.0
+        host = self.host
+        attempt = 0
+        while True:
+            rate_limiter = self.rate_limiter
+            if rate_limiter is not None:
+                throttled += rate_limiter.acquire()
+            attempt_started = time.time()
+            response = self._send_once(method, url, data, headers)
+            if rate_limiter is not None:
+                rate_limiter.record(time.time() - attempt_started, response)
+            # Streaming request body can't be sent again
+            if self.retry_policy is None or bytes_sent is None or \
+                    not self.retry_policy.should_retry(attempt, response, idempotent):
+                break
+            sleep_started = time.time()
+            time.sleep(self.retry_policy.delay(attempt, response))
+            retry_delay += time.time() - sleep_started
+            attempt += 1
+            if self.host != host:
+                # Active head node has changed (see failover)
+                url = url.replace("://%s:" % host, "://%s:" % self.host, 1)
+                host = self.host
+        response.retries = attempt
+        # Time spent waiting for rate_limiter or between retries is not part of request time
+        response.elapsed = time.time() - started - throttled - retry_delay
+        response.throttled = throttled
+        response.retry_delay = retry_delay
+        response.bytes_sent = bytes_sent if bytes_sent is not None else data.bytes_sent
+        if self._metadata_from_cache and _metadata_outdated(url, response):
+            self._refresh_metadata()
+        self._local.last_response = response
+        self._local.response = response.text
+        try:
+            if parser is not None and response.ok:
+                started = time.time()
+                response.value = parser(response.text)
+                response.parse_time = time.time() - started
+        finally:
+            if self.hooks:
+                metrics.emit(self.hooks, method, url, response)
+        return response
 
+    def _send_once(self, method, url, data, headers):
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow():
+            message = "Circuit breaker is open, request to %s was not sent" % self.host
+            return Response(text=message, error=message, request_sent=False)
         try:
-            r = http(url,
-                     data=data,
-                     headers=headers,
-                     **self.requests_kwargs)
-            self.response = r.text
+            r = self.session.request(method,
+                                     url,
+                                     data=data,
+                                     headers=headers,
+                                     **self.requests_kwargs)
+            response = Response(status_code=r.status_code,
+                                text=r.text,
+                                headers=r.headers,
+                                bytes_received=len(r.content))
+        except (ConnectionError, Timeout) as e:
+            response = Response(text="%s" % e, error="%s" % e, request_sent=not _is_connect_error(e))
+        if self.circuit_breaker is not None:
+            if response.error is not None or response.status_code >= 500:
+                if self.circuit_breaker.record_failure():
+                    self.failover()
+            else:
+                self.circuit_breaker.record_success()
+        return response
+
+    def failover(self):
+        """ Find the active head node and send further requests to it.
+        ActiveHeadnode of host and each of failover_hosts is queried until one of them responds. If the active head
+        node can't be determined (it requires HPC Pack 2008 R2 SP4 or later), the next host in the list is used.
+
+        :return: Host name used for further requests
+        """
+        with self._failover_lock:
+            # Current host first, then the other head nodes in the configured order (wrapping around),
+            # so the client can return to the original host after it has switched to a failover host
+            hosts = self._hosts if self.host in self._hosts else [self.host] + self._hosts
+            index = hosts.index(self.host)
+            candidates = hosts[index:] + hosts[:index]
+            for candidate in candidates:
+                head_node = self._query_active_head_node(candidate)
+                if head_node:
+                    new_host = self._host_for_head_node(head_node, candidates)
+                    break
+            else:
+                new_host = candidates[1] if len(candidates) > 1 else self.host
+            if new_host != self.host:
+                if self.metadata_cache is not None:
+                    self.metadata_cache.invalidate(self._metadata_cache_key)
+                self.host = new_host
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.reset()
+            return self.host
+
+    def _query_active_head_node(self, host):
+        # Bypasses send() - this request must not be retried or affect the circuit breaker
+        # http://msdn.microsoft.com/en-us/library/dn275935(v=vs.85).aspx
+        if self.api_version is None or self.api_version < HPC_Pack_2008_R2_SP4:
+            return None
+        url = "%s://%s:%s/WindowsHPC/%s/ActiveHeadnode" % (self.scheme, host, self.port, self._hpc_cluster_name)
+        kwargs = dict(self.requests_kwargs)
+        kwargs.setdefault("timeout", 10)
+        try:
+            r = self.session.request("get", url, headers=self.headers, **kwargs)
             if r.status_code != 200:
-                return False
-        except ConnectionError as e:
-            self.response = "%s" % e
-            return False
-        return True
+                return None
+            return self._get_string_from_response(r.text)
+        except (RequestException, SyntaxError):
+            return None
+
+    def _host_for_head_node(self, head_node, candidates):
+        for candidate in candidates:
+            if candidate.lower() in (head_node.lower(), head_node.lower() + "." + candidate.lower().partition(".")[2]):
+                return candidate
+        if "." not in head_node and "." in self.host and not self.host.replace(".", "").isdigit():
+            # Use domain of the current host for short head node name
+            return head_node + self.host[self.host.index("."):]
+        return head_node
+
+    def request(self, method, url, data=None, headers=None, idempotent=None):
+        """ Send HTTP request to WinHPC WebAPI server using correct headers, api-version and credentials
+        :param method: HTTP method (GET, POST or PUT)
+        :param url: URL to post
+        :param data: (optional) Data to be posted
+        :param headers: (optional) Additional headers if necessary
+        :param idempotent: (optional) True if request can be safely repeated, see send()
 
-    def post(self, url, data, headers=None):
+        :return: True if request successfully completed
+        :return: False if error happened
+        """
+        return self.send(method, url, data, headers, idempotent=idempotent).ok
+
+    def send_operation(self, operation):
+        """ Send request of HPC Web Service API operation (see operations module)
+        :param operation: operations.Operation
+        :return: Response object, response.value is the parsed response body
+        """
+        return self.send(operation.method, self.base_url + operation.path, operation.data, operation.headers,
+                         parser=operation.parser, idempotent=operation.idempotent)
+
+    def post(self, url, data, headers=None, idempotent=False):
         """ Send HTTP Post request to WinHPC WebAPI server using correct headers, api-version and credentials
         :param url: URL to post
         :param data: Data to be posted
         :param headers: (optional) Additional headers if necessary
+        :param idempotent: True if request can be safely repeated
         :return: True if request successfully completed
         :return: False if error happened
         """
-        return self.request("post", url, data, headers=headers)
+        return self.request("post", url, data, headers=headers, idempotent=idempotent)
 
     def get(self, url):
         """ Send HTTP Get request to WinHPC WebAPI server using correct headers, api-version and credentials
@@ -196,115 +559,239 @@ class WebAPI:
     def add_task(self, job_id, **properties):
         # Adds a task to a job.
         # http://msdn.microsoft.com/en-us/library/hh560262(v=vs.85).aspx
-        url = self.base_url + "/Job/%s/Tasks" % job_id
-        xml = self._xml_from_properties(**properties)
-        if not self.post(url, xml):
+        r = self.send_operation(operations.add_task(job_id, properties))
+        if not r.ok:
             return None
         # Extract task_id from xml response
-        return self._get_string_from_response()
+        return r.value
+
+    def add_tasks(self, job_id, tasks, concurrency=8):
+        """ Add many tasks to a job. Tasks are created by up to `concurrency` parallel requests
+        sharing connection pool of this WebAPI instance.
+
+        :param job_id: Job ID
+        :param tasks: Iterable (for example, a generator) of dictionaries with task properties.
+                      Environment variables of a task can be specified as a dictionary in "EnvironmentVariables"
+                      property, they are set by a separate request after the task is created
+        :param concurrency: Maximum number of add_task requests in flight
+        :return: List of TaskResult (task_id, error), in the same order as tasks
+        """
+        return list(self.iter_add_tasks(job_id, tasks, concurrency))
+
+    def iter_add_tasks(self, job_id, tasks, concurrency=8):
+        """ Same as add_tasks, but results are returned as soon as they are available (so they can be saved
+        while tasks are still being added)
+        :return: Generator of TaskResult (task_id, error), in the same order as tasks
+        """
+        def add_task(properties):
+            task_id = None
+            try:
+                properties, env_variables = operations.split_environment_variables(properties)
+                r = self.send_operation(operations.add_task(job_id, properties))
+                if not r.ok:
+                    return TaskResult(None, r.text)
+                task_id = r.value
+                if env_variables:
+                    r = self.send_operation(operations.set_task_environment_variables(job_id, task_id,
+                                                                                      env_variables))
+                    if not r.ok:
+                        return TaskResult(task_id, r.text)
+                return TaskResult(task_id, None)
+            except Exception as e:
+                return TaskResult(task_id, "%s" % e)
+
+        return bounded_imap(add_task, tasks, concurrency)
+
+    def add_sweep(self, job_id, template, parameters, concurrency=8):
+        """ Add tasks of a parameter sweep to a job.
+        If the sweep is a single evenly spaced integer parameter used only in command line, work directory or
+        standard input/output, a single HPC parametric sweep task is created. Otherwise, one task per sweep point
+        is created by add_tasks.
+
+        :param job_id: Job ID
+        :param template: Dictionary of task properties with {parameter_name} placeholders
+                         (see vecnet.winhpc.sweep for details)
+        :param parameters: Dictionary {parameter_name: list of values} (all combinations are submitted)
+                           or iterable of dictionaries {parameter_name: value}
+        :param concurrency: Maximum number of add_task requests in flight
+        :return: List of TaskResult (task_id, error), one per created task
+        """
+        task = sweep.parametric_sweep_task(template, parameters)
+        if task is not None:
+            return self.add_tasks(job_id, [task], concurrency=1)
+        return self.add_tasks(job_id, sweep.expand(template, parameters), concurrency=concurrency)
 
     def cancel_job(self, job_id,
                    forced=False,
                    message=""):
         # Cancel the specified job
         # http://msdn.microsoft.com/en-us/library/hh560253(v=vs.85).aspx
-        url = self.base_url + "/Job/%s/Cancel" % job_id
-        xml = "<string xmlns=\"http://schemas.microsoft.com/2003/10/Serialization/\">%s</string>" % message
-        headers = {"forced": forced}
-        return self.post(url, xml, headers=headers)
+        r = self.send_operation(operations.cancel_job(job_id, forced, message)).ok
+        self._invalidate_job(job_id, tasks=True)
+        if not r:
+            return self._applied_after_retry(job_id, JOB_CANCELED_STATES)
+        return r
+
+    def cancel_jobs(self, job_ids, forced=False, message="", concurrency=8):
+        """ Cancel many jobs by up to `concurrency` parallel requests
+        :param job_ids: Iterable of job IDs
+        :param forced: Cancel jobs immediately, without running node release tasks
+        :param message: Cancellation message
+        :param concurrency: Maximum number of requests in flight
+        :return: Dictionary {job_id: True if the job was cancelled, False otherwise}
+        """
+        return self._batch(lambda job_id: self.cancel_job(job_id, forced=forced, message=message),
+                           job_ids, concurrency)
 
     def cancel_task(self, job_id, task_id, forced=False, message=""):
         # Cancels the specified task.
         # http://msdn.microsoft.com/en-us/library/hh560264(v=vs.85).aspx
-        url = self.base_url + "Job/%s/Task/%s/Cancel" % (job_id, task_id)
-        xml = "<string xmlns=\"http://schemas.microsoft.com/2003/10/Serialization/\">%s</string>" % message
-        if forced:
-            url += "?Forced=True"
-        return self.post(url, xml)
+        r = self.send_operation(operations.cancel_task(job_id, task_id, forced, message)).ok
+        self._invalidate_task(job_id, task_id)
+        self._invalidate_job(job_id)
+        return r
+
+    def cancel_tasks(self, job_id, task_ids, forced=False, message="", concurrency=8):
+        """ Cancel many tasks of a job by up to `concurrency` parallel requests.
+        Note that HPC Web Service API can't cancel a subset of tasks in one request;
+        use cancel_job to cancel all tasks of the job at once.
+
+        :param job_id: Job ID
+        :param task_ids: Iterable of task IDs
+        :param forced: Cancel tasks immediately, without running node release tasks
+        :param message: Cancellation message
+        :param concurrency: Maximum number of requests in flight
+        :return: Dictionary {task_id: True if the task was cancelled, False otherwise}
+        """
+        return self._batch(lambda task_id: self.cancel_task(job_id, task_id, forced=forced, message=message),
+                           task_ids, concurrency)
 
     def create_job(self, **properties):
         # Creates a new job on the HPC cluster, for which the specified properties have the specified values.
         # http://msdn.microsoft.com/en-us/library/hh560265(v=vs.85).aspx
-        url = self.base_url + "/Jobs"
-
-        xml = self._xml_from_properties(**properties)
-        if not self.post(url, xml):
+        r = self.send_operation(operations.create_job(properties))
+        if not r.ok:
             return None
 
         # Extract job_id from xml response
-        return self._get_string_from_response()
+        return r.value
+
+    def create_job_with_tasks(self, tasks, job_properties=None, concurrency=8, from_xml=False):
+        """ Create a new job and populate it with tasks. The job is not submitted.
+
+        :param tasks: Iterable of dictionaries with task properties
+        :param job_properties: (optional) Dictionary of job properties
+        :param concurrency: Maximum number of add_task requests in flight
+        :param from_xml: If True, the job and all its tasks are created by a single create_job_from_xml
+                         request. This is usually faster for large jobs, but per-task errors are not available
+                         (task IDs are assigned by the scheduler sequentially, starting from 1)
+        :return: (job_id, list of TaskResult) tuple, one TaskResult per task. job_id is None if job creation
+                 failed, all tasks have then task_id None and the error
+        """
+        if job_properties is None:
+            job_properties = {}
+        if from_xml:
+            job_xml = xmlutils.JobXml(job_properties, tasks)
+            job_id = self.create_job_from_xml(job_xml)
+            if job_id is None:
+                return None, _failed_task_results(tasks, job_xml.task_count, self.response)
+            return job_id, [TaskResult("%s" % (i + 1), None) for i in range(job_xml.task_count)]
+
+        job_id = self.create_job(**job_properties)
+        if job_id is None:
+            return None, _failed_task_results(tasks, 0, self.response)
+        return job_id, self.add_tasks(job_id, tasks, concurrency=concurrency)
+
+    def create_sweep_job(self, template, parameters, job_properties=None, concurrency=8, from_xml=True):
+        """ Create a new job with tasks of a parameter sweep. The job is not submitted.
+        A single HPC parametric sweep task is created when possible (see add_sweep), otherwise all tasks are created
+        by create_job_with_tasks - by default, in a single create_job_from_xml request.
+
+        :param template: Dictionary of task properties with {parameter_name} placeholders
+        :param parameters: Dictionary {parameter_name: list of values} or iterable of dictionaries
+        :param job_properties: (optional) Dictionary of job properties
+        :param concurrency: Maximum number of add_task requests in flight
+        :param from_xml: Create tasks of non-parametric sweeps with create_job_from_xml
+        :return: (job_id, list of TaskResult) tuple, job_id is None if job creation failed
+        """
+        task = sweep.parametric_sweep_task(template, parameters)
+        if task is not None:
+            return self.create_job_with_tasks([task], job_properties, concurrency=1)
+        return self.create_job_with_tasks(sweep.expand(template, parameters), job_properties,
+                                          concurrency=concurrency, from_xml=from_xml)
 
     def create_job_from_xml(self, xml):
         # Creates a new job on the HPC cluster by using the information in the specified job XML string.
         # http://msdn.microsoft.com/en-us/library/hh560266(v=vs.85).aspx
-        url = self.base_url + "Jobs/JobFile"
-        if not self.post(url, xml):
+        # xml can also be an iterable of byte strings (for example, xmlutils.JobXml), which is sent
+        # to the server as a chunked request body without building the whole document in memory
+        r = self.send_operation(operations.create_job_from_xml(xml))
+        if not r.ok:
             return None
         # Extract job_id from xml response
-        return self._get_string_from_response()
+        return r.value
 
     def get_active_head_node(self):
         # Gets the name of the active head node of the HPC cluster.
         # http://msdn.microsoft.com/en-us/library/dn275935(v=vs.85).aspx
         if self.api_version < HPC_Pack_2008_R2_SP4:
             raise NotImplementedError("Minimum api-version supported is %s" % HPC_Pack_2008_R2_SP4)
-        url = self.base_url + "ActiveHeadnode"
-        if not self.get(url):
+        head_node = self._get_cached_metadata("active_head_node")
+        if head_node is not None:
+            return head_node
+        r = self.send_operation(operations.get_active_head_node())
+        if not r.ok:
             return None
         # Extract headnode name from xml response
         # <string xmlns="http://schemas.microsoft.com/2003/10/Serialization/">active_head_node_name</string>
-        return self._get_string_from_response()
+        head_node = r.value
+        self._set_cached_metadata("active_head_node", head_node)
+        return head_node
 
     def get_clusters(self):
         # Gets the name of the cluster that hosts the instance of the REST web service.
         # http://msdn.microsoft.com/en-us/library/hh770490(v=vs.85).aspx
-        url = "https://%s:%s/WindowsHPC/Clusters" % (self.host, self.port)
+        url = operations.clusters_url(self.scheme, self.host, self.port)
 
-        if not self.get(url):
+        r = self.send("get", url, parser=self._get_clusters_from_xml)
+        if not r.ok:
             return None
 
         # Parse response and return list of clusters
-        clusters = []
-        tree = ElementTree.parse(StringIO(self.response))
-        root = tree.getroot()
-        if True:
-            for clusters_in_xml in root[0][0]:
-                clusters.append(clusters_in_xml[1].text)
-        return clusters
+        return r.value
 
     def get_job(self, job_id, requested_properties=None):
         # Get information about the specified job
         # http://msdn.microsoft.com/en-us/library/hh529653(v=vs.85).aspx
-        url = self.base_url + "Job/%s" % job_id
-        if requested_properties is not None:
-            # Convert a list of properties requested by user into a string in GET request
-            url += "?properties=" + self._requested_properties_to_string(requested_properties)
-        if not self.get(url):
-            return None
+        def fetch(requested_properties):
+            r = self.send_operation(operations.get_job(job_id, requested_properties))
+            if not r.ok:
+                return None
 
-        # Parse response and return list of job properties
-        return self._get_properties_from_xml()
+            # Parse response and return list of job properties
+            return r.value
+        return self._cached_properties(("job", "%s" % job_id), requested_properties, fetch)
 
     def get_job_as_xml(self, job_id):
         # Gets information about the specified job.
         # http://msdn.microsoft.com/en-us/library/hh529653(v=vs.85).aspx
         # This is a get_job call with render = HpcJobXml
         # Returns XML formatted as found in the Create Job From XML operation.
-        url = self.base_url + "Job/%s" % job_id + "?Render=HpcJobXml"
-        if not self.get(url):
+        r = self.send_operation(operations.get_job_as_xml(job_id))
+        if not r.ok:
             return None
-        return self.response
+        return r.text
 
     def get_job_custom_properties(self, job_id, requested_properties=None):
         # Gets the values of the specified custom properties for the job,
         # or the values of all of the properties if none are specified.
         # http://msdn.microsoft.com/en-us/library/hh560267(v=vs.85).aspx
-        url = self.base_url + "Job/%s/CustomProperties" % job_id
-        if requested_properties is not None:
-            url += "?Names=" + self._requested_properties_to_string(requested_properties)
-        if not self.get(url):
-            return None
-        return self._get_properties_from_xml()
+        def fetch(requested_properties):
+            r = self.send_operation(operations.get_job_custom_properties(job_id, requested_properties))
+            if not r.ok:
+                return None
+            return r.value
+        return self._cached_properties(("job_custom", "%s" % job_id), requested_properties, fetch)
 
     def get_job_property(self, job_id, property_name):
         # Get single property of the job (State, Name)
@@ -318,25 +805,21 @@ class WebAPI:
         # Gets the values of the specified environment variables for the job,
         # or the values of all of the environment variables if none are specified.
         # http://msdn.microsoft.com/en-us/library/hh560268(v=vs.85).aspx
-        url = self.base_url + "Job/%s/EnvVariables" % job_id
-        if requested_variables is not None:
-            url += "?properties=" + self._requested_properties_to_string(requested_variables)
-        if not self.get(url):
+        r = self.send_operation(operations.get_job_environment_variables(job_id, requested_variables))
+        if not r.ok:
             return None
 
-        # Parse list of env variables in self.response
-        return self._get_properties_from_xml()
+        # Parse list of env variables in the response
+        return r.value
 
     def get_subtask(self, job_id, task_id, subtask_id, requested_properties=None):
         # Gets the values of the specified properties for the specified subtask,
         # or the values of all of the properties if no properties are specified.
         # http://msdn.microsoft.com/en-us/library/hh529655(v=vs.85).aspx
-        url = self.base_url + "Job/%s/Task/%s/SubTask/%s" % (job_id, task_id, subtask_id)
-        if requested_properties is not None:
-            url += "?Properties=" + self._requested_properties_to_string(requested_properties)
-        if not self.get(url):
+        r = self.send_operation(operations.get_subtask(job_id, task_id, subtask_id, requested_properties))
+        if not r.ok:
             return None
-        return self._get_properties_from_xml()
+        return r.value
 
     def get_subtask_as_xml(self, job_id, task_id, subtask_id):
         # Gets the values of the specified properties for the specified subtask,
@@ -344,41 +827,81 @@ class WebAPI:
         # http://msdn.microsoft.com/en-us/library/hh529655(v=vs.85).aspx
         # This is a get_subtask call with render = HpcJobXml
         # Returns Subtask in XML format
-        url = self.base_url + "Job/%s/Task/%s/SubTask/%s?Render=HpcJobXml" % (job_id, task_id, subtask_id)
-        if not self.get(url):
+        r = self.send_operation(operations.get_subtask_as_xml(job_id, task_id, subtask_id))
+        if not r.ok:
             return None
-        return self.response
+        return r.text
 
     def get_task(self, job_id, task_id, requested_properties=None):
         # Gets the values of the specified properties for the specified task,
         # or the values of all of the properties if no properties are specified.
         # http://msdn.microsoft.com/en-us/library/hh529656(v=vs.85).aspx
-        url = self.base_url + "Job/%s/Task/%s" % (job_id, task_id)
-        if requested_properties is not None:
-            url += "?Properties=" + self._requested_properties_to_string(requested_properties)
-        if not self.get(url):
-            return None
-        return self._get_properties_from_xml()
+        def fetch(requested_properties):
+            r = self.send_operation(operations.get_task(job_id, task_id, requested_properties))
+            if not r.ok:
+                return None
+            return r.value
+        properties = self._cached_properties(("task", "%s" % job_id, "%s" % task_id), requested_properties, fetch)
+        if properties and self.task_store is not None:
+            self.task_store.update(job_id, task_id, properties)
+        return properties
 
     def get_task_environment_variables(self, job_id, task_id, requested_env_variables=None):
         # Gets the values of the specified environment variables for the task,
         # or the values of all of the environment variables if none are specified.
         # http://msdn.microsoft.com/en-us/library/hh529657(v=vs.85).aspx
-        url = self.base_url + "Job/%s/Task/%s/EnvVariables" % (job_id, task_id)
-        if requested_env_variables is not None:
-            url += "?Names=" + self._requested_properties_to_string(requested_env_variables)
-        if not self.get(url):
+        r = self.send_operation(operations.get_task_environment_variables(job_id, task_id, requested_env_variables))
+        if not r.ok:
             return None
-        return self._get_properties_from_xml()
+        return r.value
 
     def get_version(self):
         # Gets the version of Microsoft HPC Pack that is installed on the HPC cluster that hosts the web service.
         # http://msdn.microsoft.com/en-us/library/hh560257(v=vs.85).aspx
-        url = self.base_url + "Version"
-        if not self.get(url):
+        version = self._get_cached_metadata("version")
+        if version is not None:
+            return version
+        r = self.send_operation(operations.get_version())
+        if not r.ok:
             return None
         # Extract version from xml response
-        return self._get_string_from_response()
+        version = r.value
+        self._set_cached_metadata("version", version)
+        return version
+
+    def iter_jobs(self, filter=None, requested_properties=None):
+        """ Enumerate jobs on the cluster (Get Job List operation), page by page
+        :param filter: (optional) Dictionary of query parameters of Get Job List operation,
+                       for example {"Owner": "DOMAIN\\user", "JobState": "Running,Queued"}
+        :param requested_properties: (optional) List of job properties to return, for example ["Id", "State"]
+        :raises: RuntimeError if request failed
+        :return: Generator of dictionaries of job properties
+        """
+        url = self.base_url + "Jobs"
+        params = []
+        if requested_properties is not None:
+            params.append(("Properties", self._requested_properties_to_string(requested_properties)))
+        if filter is not None:
+            params.extend(sorted(filter.items()))
+        return self._iter_objects(url, params)
+
+    def iter_tasks(self, job_id, requested_properties=None, filter=None):
+        """ Enumerate tasks of the job (Get Task List operation), page by page
+        :param job_id: Job ID
+        :param requested_properties: (optional) List of task properties to return, for example ["TaskId", "State"]
+        :param filter: (optional) Dictionary of additional query parameters of Get Task List operation
+        :raises: RuntimeError if request failed
+        :return: Generator of dictionaries of task properties
+        """
+        url = self.base_url + "Job/%s/Tasks" % job_id
+        params = []
+        if requested_properties is not None:
+            params.append(("Properties", self._requested_properties_to_string(requested_properties)))
+        if filter is not None:
+            params.extend(sorted(filter.items()))
+        if self.task_store is not None:
+            return self.task_store.feed(job_id, self._iter_objects(url, params))
+        return self._iter_objects(url, params)
 
     def requeue_job(self, job_id):
         # Resubmits the specified job to the queue.
@@ -386,49 +909,186 @@ class WebAPI:
         # Only jobs that are in the Canceled or Failed state can be requeued.
         # To create a new job that is based on a Finished or Running job, save the job as an XML file
         # using get_job_as_xml() and create a new job using create_job_from_xml()
-        url = self.base_url + "Job/%s/Requeue" % job_id
-        return self.post(url, '<ArrayOfProperty xmlns="http://schemas.microsoft.com/HPCS2008R2/common" />')
+        r = self.send_operation(operations.requeue_job(job_id)).ok
+        self._invalidate_job(job_id, tasks=True)
+        return r
+
+    def requeue_jobs(self, job_ids, concurrency=8):
+        """ Resubmit many Canceled or Failed jobs by up to `concurrency` parallel requests
+        :param job_ids: Iterable of job IDs
+        :param concurrency: Maximum number of requests in flight
+        :return: Dictionary {job_id: True if the job was requeued, False otherwise}
+        """
+        return self._batch(self.requeue_job, job_ids, concurrency)
 
     def set_job_environment_variables(self, job_id, **variables):
         # Sets the value of one or more environment variables for a job.
         # http://msdn.microsoft.com/en-us/library/hh529663(v=vs.85).aspx
-        url = self.base_url + "Job/%s/EnvVariables" % job_id
-        xml = self._xml_from_properties(**variables)
-        return self.post(url, xml)
+        return self.send_operation(operations.set_job_environment_variables(job_id, variables)).ok
 
     def set_job_properties(self, job_id, **properties):
         # Sets the values for the properties of the specified job.
         # http://msdn.microsoft.com/en-us/library/hh529664(v=vs.85).aspx
         if self.api_version is None:
             raise RuntimeError("Minimum supported api-version: %s" % HPC_Pack_2008_R2_SP3)
-        url = self.base_url + "Job/%s" % job_id
-        xml = self._xml_from_properties(**properties)
-        return self.put(url, xml)
+        r = self.send_operation(operations.set_job_properties(job_id, properties)).ok
+        self._invalidate_job(job_id)
+        return r
 
     def set_job_custom_properties(self, job_id, **properties):
         # Sets the values of custom properties for a job.
         # http://msdn.microsoft.com/en-us/library/hh529662(v=vs.85).aspx
-        url = self.base_url + "Job/%s/Custom" % job_id
-        xml = self._xml_from_properties(**properties)
-        return self.post(url, xml)
+        r = self.send_operation(operations.set_job_custom_properties(job_id, properties)).ok
+        if self.property_cache is not None:
+            self.property_cache.invalidate(("job_custom", "%s" % job_id))
+        return r
 
     def set_task_environment_variables(self, job_id, task_id, **env_variables):
         # Sets the value of one or more environment variables for a task.
         # http://msdn.microsoft.com/en-us/library/hh529665(v=vs.85).aspx
-        url = self.base_url + "/Job/%s/Task/%s/EnvVariables" % (job_id, task_id)
-        xml = self._xml_from_properties(**env_variables)
-        return self.post(url, xml)
+        return self.send_operation(operations.set_task_environment_variables(job_id, task_id, env_variables)).ok
 
     def set_task_properties(self, job_id, task_id, **properties):
         # Sets the values of properties for a task in a job.
         # http://msdn.microsoft.com/en-us/library/hh529667(v=vs.85).aspx
-        url = self.base_url + "Job/%s/Task/%s" % (job_id, task_id)
-        xml = self._xml_from_properties(**properties)
-        return self.put(url, xml)
+        r = self.send_operation(operations.set_task_properties(job_id, task_id, properties)).ok
+        self._invalidate_task(job_id, task_id)
+        return r
+
+    def set_tasks_properties(self, job_id, tasks, concurrency=8):
+        """ Set properties of many tasks of a job by up to `concurrency` parallel requests
+        :param job_id: Job ID
+        :param tasks: Dictionary {task_id: dictionary of task properties}
+        :param concurrency: Maximum number of requests in flight
+        :return: Dictionary {task_id: True if properties were set, False otherwise}
+        """
+        return self._batch(lambda task_id: self.set_task_properties(job_id, task_id, **tasks[task_id]),
+                           tasks, concurrency)
 
     def submit_job(self, job_id, **properties):
         # Creates a new job on the HPC cluster, for which the specified properties have the specified values.
         # http://msdn.microsoft.com/en-us/library/hh560265(v=vs.85).aspx
-        url = self.base_url + "/Job/%s/Submit" % job_id
-        xml = self._xml_from_properties(**properties)
-        return self.post(url, xml)
+        r = self.send_operation(operations.submit_job(job_id, properties)).ok
+        self._invalidate_job(job_id, tasks=True)
+        if not r:
+            return self._applied_after_retry(job_id, JOB_SUBMITTED_STATES)
+        return r
+
+    def wait_for_job(self, job_id, timeout=None, requested_properties=None, **kwargs):
+        """ Wait until the job reaches a terminal state (Finished, Failed or Canceled)
+        :param job_id: Job ID
+        :param timeout: (optional) Maximum time to wait, in seconds
+        :param requested_properties: (optional) List of job properties to return in addition to State
+        :param kwargs: Polling parameters passed to wait_for_jobs
+        :return: Dictionary of job properties (State is JOB_NOT_FOUND if the job doesn't exist),
+                 None if timeout expired
+        """
+        for finished_job_id, properties in self.wait_for_jobs([job_id], timeout=timeout,
+                                                              requested_properties=requested_properties,
+                                                              **kwargs):
+            return properties
+        return None
+
+    def wait_for_jobs(self, job_ids, timeout=None, callback=None, requested_properties=None,
+                      min_interval=1.0, max_interval=60.0, backoff=1.5, concurrency=8):
+        """ Wait until jobs reach a terminal state (Finished, Failed or Canceled).
+        Only State (and requested_properties) are retrieved. Each job is polled independently: polling interval
+        grows by `backoff` factor while job state does not change and is reset to min_interval when it does.
+
+        :param job_ids: List of job IDs
+        :param timeout: (optional) Maximum time to wait, in seconds. Jobs that didn't finish are not returned
+        :param callback: (optional) Function called as callback(job_id, properties) when a job finishes
+        :param requested_properties: (optional) List of job properties to return in addition to State
+        :param min_interval: Minimum time between two polls of the same job, in seconds
+        :param max_interval: Maximum time between two polls of the same job, in seconds
+        :param backoff: Polling interval multiplier
+        :param concurrency: Maximum number of get_job requests in flight
+        :return: Generator of (job_id, properties) tuples, in the order jobs finish. Jobs that server doesn't know
+                 (JOB_NOT_FOUND_POLLS consecutive 404 responses) are returned as (job_id, {"State": JOB_NOT_FOUND})
+        """
+        properties_to_request = ["State"]
+        for property_name in requested_properties or []:
+            if property_name not in properties_to_request:
+                properties_to_request.append(property_name)
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+        else:
+            deadline = None
+        # job_id -> [time of next poll, polling interval, last known state, number of consecutive 404 responses]
+        # Jobs are polled in the given order (also in python 2.7)
+        pending = OrderedDict((job_id, [0, min_interval, None, 0]) for job_id in job_ids)
+
+        def poll(job_id):
+            properties = self.get_job(job_id, properties_to_request)
+            # last_response is per thread, so it belongs to this get_job call
+            not_found = properties is None and self.last_response is not None and \
+                self.last_response.status_code == 404
+            return job_id, properties, not_found
+
+        # Worker threads are shared by all polling rounds
+        with WorkerPool(concurrency) as pool:
+            while pending:
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    return
+                due = [job_id for job_id in pending if pending[job_id][0] <= now]
+                if not due:
+                    next_poll = min(schedule[0] for schedule in pending.values())
+                    if deadline is not None:
+                        next_poll = min(next_poll, deadline)
+                    time.sleep(max(next_poll - now, 0))
+                    continue
+                results = pool.imap(poll, due)
+                try:
+                    for job_id, properties, not_found in results:
+                        schedule = pending[job_id]
+                        schedule[3] = schedule[3] + 1 if not_found else 0
+                        if schedule[3] >= JOB_NOT_FOUND_POLLS:
+                            properties = {"State": JOB_NOT_FOUND}
+                        state = properties.get("State") if properties else None
+                        if state in JOB_TERMINAL_STATES or state == JOB_NOT_FOUND:
+                            del pending[job_id]
+                            if callback is not None:
+                                callback(job_id, properties)
+                            # Returned as soon as it is polled, while the rest of the round is still in progress
+                            yield job_id, properties
+                            continue
+                        if state is not None and state != schedule[2]:
+                            schedule[1] = min_interval
+                            schedule[2] = state
+                        else:
+                            schedule[1] = min(schedule[1] * backoff, max_interval)
+                        schedule[0] = time.time() + schedule[1]
+                finally:
+                    # Drop polls that have not started if the caller abandons the generator (before the worker
+                    # threads are stopped)
+                    results.close()
+
+
+def _failed_task_results(tasks, consumed, error):
+    # One TaskResult(None, error) per input task. If tasks is an iterator, `consumed` tasks were already read
+    # from it (request body streamed before the request failed) and the rest is read now
+    if hasattr(tasks, "__len__"):
+        count = len(tasks)
+    else:
+        count = consumed + sum(1 for task in tasks)
+    return [TaskResult(None, error) for i in range(count)]
+
+
+def _metadata_outdated(url, response):
+    # True if failed request may be caused by outdated cached metadata (head node or cluster name).
+    # Ordinary client errors (404 for unknown job, 400 for invalid property) are not.
+    if response.error is not None or response.status_code >= 500:
+        return True
+    return response.status_code == 404 and endpoint_from_url(url) in CLUSTER_ENDPOINTS
+
+
+def _is_connect_error(e):
+    # True if connection to the server could not be established, so the request was not sent
+    if isinstance(e, ConnectTimeout):
+        return True
+    reason = e.args[0] if e.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, ConnectTimeoutError)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Bounded thread pool helpers used by bulk WebAPI operations
+"""
+import collections
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class _WorkItem(object):
+    __slots__ = ("func", "item", "result", "error", "done")
+
+    def __init__(self, func, item):
+        self.func = func
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class WorkerPool(object):
+    """ Fixed set of `concurrency` worker threads that can run several bounded_imap-like maps one after another,
+    so that repeated rounds of requests (e.g. polling) don't start new threads every round.
+
+        with WorkerPool(8) as pool:
+            while ...:
+                for result in pool.imap(func, items):
+                    ...
+    """
+    def __init__(self, concurrency=8):
+        """
+        :param concurrency: Number of worker threads (maximum number of func calls running at the same time)
+        """
+        self.concurrency = concurrency
+        self._work = queue.Queue()
+        self._threads = []
+        for i in range(concurrency):
+            thread = threading.Thread(target=self._worker, name="WorkerPool-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            work_item = self._work.get()
+            if work_item is None:
+                return
+            try:
+                work_item.result = work_item.func(work_item.item)
+            except Exception:
+                work_item.error = sys.exc_info()[1]
+            work_item.done.set()
+
+    def imap(self, func, iterable):
+        """ Apply func to every element of iterable using worker threads of the pool.
+        iterable is consumed lazily - no more than 2 * concurrency elements are read ahead.
+        Only one imap of a pool should be in progress at a time.
+
+        :param func: Function to be called for each element
+        :param iterable: Input elements
+        :raises: Exception raised by func (remaining work is abandoned)
+        :return: Generator of func results, in the same order as input elements
+        """
+        pending = collections.deque()
+        window = 2 * self.concurrency
+        try:
+            for item in iterable:
+                work_item = _WorkItem(func, item)
+                pending.append(work_item)
+                self._work.put(work_item)
+                while len(pending) >= window:
+                    yield _result(pending.popleft())
+            while pending:
+                yield _result(pending.popleft())
+        finally:
+            # Abandon work that has not been started yet
+            while True:
+                try:
+                    self._work.get_nowait()
+                except queue.Empty:
+                    break
+
+    def close(self):
+        """ Stop worker threads (after they finish work in progress) """
+        for thread in self._threads:
+            self._work.put(None)
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def bounded_imap(func, iterable, concurrency=8):
+    """ Apply func to every element of iterable using up to `concurrency` threads.
+    iterable is consumed lazily - no more than 2 * concurrency elements are read ahead,
+    so it can be a generator producing millions of items.
+
+    :param func: Function to be called for each element
+    :param iterable: Input elements
+    :param concurrency: Maximum number of func calls running at the same time
+    :raises: Exception raised by func (remaining work is abandoned)
+    :return: Generator of func results, in the same order as input elements
+    """
+    if concurrency <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    with WorkerPool(concurrency) as pool:
+        results = pool.imap(func, iterable)
+        try:
+            for result in results:
+                yield result
+        finally:
+            # Abandon queued work before worker threads are stopped
+            results.close()
+
+
+def _result(work_item):
+    # Event.wait() without timeout can't be interrupted by Ctrl+C in python 2.7
+    while not work_item.done.wait(1):
+        pass
+    if work_item.error is not None:
+        raise work_item.error
+    return work_item.result
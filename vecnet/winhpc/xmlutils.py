@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# This file is part of the vecnet.winhpc package.
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/vecnet/vecnet.winhpc
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License (MPL), version 2.0.  If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Parsers for XML documents returned by WinHPC WebAPI server and serializers for documents sent to it.
+Documents are parsed in a single pass with ElementTree.iterparse, without building DOM tree.
+Element names are matched regardless of their namespace.
+"""
+from io import BytesIO
+from xml.sax.saxutils import escape, quoteattr
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+
+def _to_bytes(xml):
+    if isinstance(xml, bytes):
+        return xml
+    return xml.encode("utf-8")
+
+
+def _iterparse(xml):
+    """ Generator of (local element name, element) for every closed element in xml document """
+    # Cache of local names for namespace-qualified tags ({namespace}Name -> Name)
+    local_names = {}
+    for event, element in ElementTree.iterparse(BytesIO(_to_bytes(xml)), events=("end",)):
+        tag = element.tag
+        local_name = local_names.get(tag)
+        if local_name is None:
+            local_name = local_names[tag] = tag.rpartition("}")[2]
+        yield local_name, element
+
+
+def parse_string(xml):
+    """ Text of the root element, for example
+    <string xmlns="http://schemas.microsoft.com/2003/10/Serialization/">value</string>
+
+    :param xml: xml document
+    :return: Text of the root element, None if the element is empty
+    """
+    return ElementTree.fromstring(_to_bytes(xml)).text
+
+
+def parse_properties(xml):
+    """ Properties in xml response from WebAPI
+    Expected xml format:
+    <ArrayOfProperty xmlns="http://schemas.microsoft.com/HPCS2008R2/common"
+                     xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+    <Property>
+        <Name>job_property1_name</Name>
+        <Value>job_property1_value</Value>
+    </Property>
+    ...
+    <ArrayOfProperty>
+
+    :param xml: xml document
+    :return: Dictionary of properties. Value of a property is None if <Value/> tag is empty
+    """
+    properties = {}
+    name = value = None
+    for local_name, element in _iterparse(xml):
+        if local_name == "Name":
+            name = element.text
+        elif local_name == "Value":
+            value = element.text
+        elif local_name == "Property":
+            properties[name] = value
+            name = value = None
+            element.clear()
+    return properties
+
+
+def iter_objects(xml):
+    """ Objects in xml response from WebAPI (for example, list of clusters, jobs or tasks)
+    Expected xml format:
+    <ArrayOfObject xmlns="http://schemas.microsoft.com/HPCS2008R2/common">
+    <Object>
+        <Properties>
+            <Property><Name>property1_name</Name><Value>property1_value</Value></Property>
+            ...
+        </Properties>
+    </Object>
+    ...
+    </ArrayOfObject>
+
+    :param xml: xml document
+    :return: Generator of dictionaries, one per <Object>
+    """
+    properties = {}
+    name = value = None
+    for local_name, element in _iterparse(xml):
+        if local_name == "Name":
+            name = element.text
+        elif local_name == "Value":
+            value = element.text
+        elif local_name == "Property":
+            properties[name] = value
+            name = value = None
+            element.clear()
+        elif local_name == "Object":
+            yield properties
+            properties = {}
+            element.clear()
+
+
+def parse_clusters(xml):
+    """ Names of clusters in response to Get Clusters request
+    :param xml: xml document
+    :return: List of cluster names
+    """
+    clusters = []
+    for properties in iter_objects(xml):
+        if "Name" in properties:
+            clusters.append(properties["Name"])
+        else:
+            clusters.extend(properties.values())
+    return clusters
+
+
+def _to_text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return u"%s" % value
+
+
+def properties_to_xml(properties):
+    """ Serialize dictionary of properties into ArrayOfProperty document, escaping names and values
+    :param properties: Dictionary of properties
+    :return: xml document (utf-8 encoded)
+    """
+    xml = [u"<ArrayOfProperty xmlns=\"http://schemas.microsoft.com/HPCS2008R2/common\">"]
+    for name in properties:
+        xml.append(u"<Property><Name>%s</Name><Value>%s</Value></Property>" %
+                   (escape(_to_text(name)), escape(_to_text(properties[name]))))
+    xml.append(u"</ArrayOfProperty>")
+    return u"".join(xml).encode("utf-8")
+
+
+class JobXml(object):
+    """ Job description in HpcJobXml format (as expected by Create Job From XML operation).
+    The document is generated in chunks while it is iterated, so it can be passed to requests as
+    a streaming (chunked) request body - memory usage doesn't depend on the number of tasks.
+
+    Usage:
+        server.create_job_from_xml(JobXml({"Name": "My job"}, task_generator))
+    """
+    def __init__(self, job_properties, tasks, chunk_size=65536):
+        """
+        :param job_properties: Dictionary of job properties
+        :param tasks: Iterable (for example, a generator) of dictionaries with task properties.
+                      Environment variables can be specified as a dictionary in "EnvironmentVariables" property
+        :param chunk_size: Approximate size of a chunk of the document, in characters
+        """
+        self.job_properties = job_properties
+        self.tasks = tasks
+        self.chunk_size = chunk_size
+        # Number of tasks serialized so far
+        self.task_count = 0
+
+    @staticmethod
+    def _attributes(properties):
+        # Property names in HpcJobXml start with a capital letter (commandLine -> CommandLine)
+        return u"".join(u" %s=%s" % (name[:1].upper() + name[1:], quoteattr(_to_text(properties[name])))
+                        for name in properties if name != "EnvironmentVariables")
+
+    @staticmethod
+    def _environment_variables(properties):
+        variables = properties.get("EnvironmentVariables")
+        if not variables:
+            return u""
+        return u"<EnvironmentVariables>%s</EnvironmentVariables>" % u"".join(
+            u"<Variable><Name>%s</Name><Value>%s</Value></Variable>" %
+            (escape(_to_text(name)), escape(_to_text(variables[name]))) for name in variables)
+
+    def __iter__(self):
+        self.task_count = 0
+        buf = [u"<?xml version=\"1.0\" encoding=\"utf-8\"?>",
+               u"<Job xmlns=\"http://schemas.microsoft.com/HPCS2008R2/scheduler/\"%s>" %
+               self._attributes(self.job_properties),
+               self._environment_variables(self.job_properties),
+               u"<Tasks>"]
+        size = 0
+        for task_properties in self.tasks:
+            environment_variables = self._environment_variables(task_properties)
+            if environment_variables:
+                task_xml = u"<Task%s>%s</Task>" % (self._attributes(task_properties), environment_variables)
+            else:
+                task_xml = u"<Task%s />" % self._attributes(task_properties)
+            buf.append(task_xml)
+            size += len(task_xml)
+            self.task_count += 1
+            if size >= self.chunk_size:
+                yield u"".join(buf).encode("utf-8")
+                buf = []
+                size = 0
+        buf.append(u"</Tasks></Job>")
+        yield u"".join(buf).encode("utf-8")
+
+    def to_bytes(self):
+        """ Complete document as a single byte string """
+        return b"".join(self)